@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+#
+# Benchmarks for yadro and mdro that run without Linuxcnc. Fake linuxcnc
+# and hal modules stand in for the real ones: the input pins move, the
+# stat fields change now and then and wait_complete takes a while.
+# Results are printed as one JSON object per line.
+
+from __future__ import print_function
+import sys
+import os
+import types
+import time
+import json
+import math
+import argparse
+import importlib
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc, the memory run is skipped
+    tracemalloc = None
+
+# The fake linuxcnc module
+class fake_stat():
+    def __init__(self):
+        self.estop = 0
+        self.homed = (1, 1, 1, 1, 1, 1, 1, 1, 1)
+        self.axis_mask = 0x1ff
+        self.task_state = fake_linuxcnc.STATE_ON
+        self.task_mode = fake_linuxcnc.MODE_MANUAL
+        self.interp_state = fake_linuxcnc.INTERP_IDLE
+        self.g5x_index = 1
+        self.enabled = 1
+        self.linear_units = 1.0 / 25.4
+        self.program_units = 1
+        self.actual_position = (0.0,) * 9
+        self.g5x_offset = (0.0,) * 9
+        self.g92_offset = (0.0,) * 9
+        self.tool_offset = (0.0,) * 9
+        self.polls = 0
+
+    # Every 50 polls something changes: the mode or the interpreter state
+    def poll(self):
+        self.polls += 1
+        if self.polls % 50 == 0:
+            if self.task_mode == fake_linuxcnc.MODE_MANUAL:
+                self.task_mode = fake_linuxcnc.MODE_MDI
+            else:
+                self.task_mode = fake_linuxcnc.MODE_MANUAL
+
+class fake_command():
+    delay = 0.0
+
+    def __init__(self):
+        self.sent = 0
+        self.texts = []
+
+    def mode(self, m):
+        pass
+
+    def state(self, s):
+        pass
+
+    # The texts are kept for the tests
+    def mdi(self, s):
+        self.sent += 1
+        self.texts.append(s)
+
+    def wait_complete(self, timeout=5.0):
+        if fake_command.delay > timeout:
+            time.sleep(timeout)
+            return -1
+        time.sleep(fake_command.delay)
+        return fake_linuxcnc.RCS_DONE
+
+class fake_ini():
+    def __init__(self, name):
+        self.name = name
+
+    def find(self, section, key):
+        return None
+
+    def findall(self, section, key):
+        return []
+
+fake_linuxcnc = types.ModuleType("linuxcnc")
+fake_linuxcnc.STATE_ESTOP = 1
+fake_linuxcnc.STATE_ESTOP_RESET = 2
+fake_linuxcnc.STATE_OFF = 3
+fake_linuxcnc.STATE_ON = 4
+fake_linuxcnc.MODE_MANUAL = 1
+fake_linuxcnc.MODE_AUTO = 2
+fake_linuxcnc.MODE_MDI = 3
+fake_linuxcnc.INTERP_IDLE = 1
+fake_linuxcnc.INTERP_READING = 2
+fake_linuxcnc.RCS_DONE = 1
+fake_linuxcnc.RCS_EXEC = 2
+fake_linuxcnc.RCS_ERROR = 3
+fake_linuxcnc.stat = fake_stat
+fake_linuxcnc.command = fake_command
+fake_linuxcnc.ini = fake_ini
+
+# The fake hal module. Pins are a dict, components are kept so the
+# benchmark can drive their input pins.
+class fake_component():
+    made = []
+
+    def __init__(self, name):
+        self.name = name
+        self.pins = dict()
+        fake_component.made.append(self)
+
+    def newpin(self, name, kind, direction):
+        if kind == fake_hal.HAL_FLOAT:
+            self.pins[name] = 0.0
+        else:
+            self.pins[name] = 0
+
+    def ready(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def __getitem__(self, name):
+        return self.pins[name]
+
+    def __setitem__(self, name, v):
+        self.pins[name] = v
+
+fake_hal = types.ModuleType("hal")
+fake_hal.HAL_FLOAT = 1
+fake_hal.HAL_BIT = 2
+fake_hal.HAL_S32 = 3
+fake_hal.HAL_U32 = 4
+fake_hal.HAL_IN = 16
+fake_hal.HAL_OUT = 32
+fake_hal.HAL_IO = 48
+fake_hal.component = fake_component
+
+# Loads yadro or mdro against the fakes with params built from argv
+def load(tool, argv):
+    sys.modules["linuxcnc"] = fake_linuxcnc
+    sys.modules["hal"] = fake_hal
+    here = os.path.dirname(os.path.abspath(__file__))
+    if not here in sys.path:
+        sys.path.insert(0, here)
+    mod = importlib.import_module(tool)
+    mod.params = mod.get_params(mod.get_parser().parse_args(argv))
+    return mod
+
+# Input pin names of the last component made
+def input_pins(tool, naxes):
+    if tool == "yadro":
+        return [str(p) for p in range(naxes)]
+    return ["axis." + str(p) for p in range(naxes)]
+
+# Synthetic handwheel motion, every axis moves every poll
+def move(comp, names, i):
+    for a in range(len(names)):
+        comp.pins[names[a]] = 2.0 * math.sin(0.01 * i + a)
+
+def percentile(sorted_times, p):
+    return sorted_times[min(len(sorted_times) - 1, int(p * len(sorted_times)))]
+
+def summary(times):
+    times = sorted(times)
+    n = len(times)
+    return {"n": n,
+            "mean_us": 1e6 * sum(times) / n,
+            "p50_us": 1e6 * percentile(times, 0.50),
+            "p99_us": 1e6 * percentile(times, 0.99),
+            "max_us": 1e6 * times[-1]}
+
+def emit(out, result):
+    out.write(json.dumps(result, sort_keys=True) + "\n")
+    out.flush()
+
+# Per poll latency of the engine alone (no Tk) or of main_gui.poll
+def bench_poll(tool, naxes, polls, with_gui, out):
+    axes = "XYZABCUVW"[:naxes]
+    mod = load(tool, ["--sample_ms", "0", axes])
+    lcnc = mod.lc()
+    comp = fake_component.made[-1]
+    names = input_pins(tool, naxes)
+    engine = mod.dro_engine(lcnc)
+    poll = engine.poll
+    if with_gui:
+        try:
+            mod.root = mod.tk.Tk()
+        except Exception as e:
+            emit(out, {"bench": "gui_poll", "tool": tool, "naxes": naxes,
+                       "skipped": str(e)})
+            lcnc.stop()
+            return
+        gui = mod.main_gui(engine)
+        poll = gui.poll
+    times = []
+    for i in range(polls):
+        move(comp, names, i)
+        t0 = time.time()
+        poll()
+        if with_gui:
+            mod.root.update_idletasks()
+        times.append(time.time() - t0)
+    result = {"bench": "gui_poll" if with_gui else "engine_poll",
+              "tool": tool, "naxes": naxes}
+    result.update(summary(times))
+    emit(out, result)
+    if with_gui:
+        mod.root.destroy()
+        mod.root = None
+    lcnc.stop()
+
+# Time from send_mdi until the command reports done with a slow controller
+def bench_mdi(commands, delay, out):
+    fake_command.delay = delay
+    mod = load("yadro", ["--sample_ms", "0", "XYZ"])
+    lcnc = mod.lc()
+    engine = mod.dro_engine(lcnc)
+    times = []
+    blocked = []
+    for i in range(commands):
+        t0 = time.time()
+        cmd = engine.set_value(i % 3, 0.001 * i)
+        blocked.append(time.time() - t0)
+        while cmd.status == "pending":
+            time.sleep(0.0005)
+        times.append(time.time() - t0)
+    result = {"bench": "mdi_round_trip", "wait_complete_s": delay}
+    result.update(summary(times))
+    result["send_blocked_max_us"] = 1e6 * max(blocked)
+    emit(out, result)
+    lcnc.stop()
+    fake_command.delay = 0.0
+
+# Memory allocated and still held after a long run of polls
+def bench_memory(tool, naxes, polls, out):
+    if tracemalloc is None:
+        emit(out, {"bench": "memory", "tool": tool, "naxes": naxes,
+                   "skipped": "no tracemalloc"})
+        return
+    mod = load(tool, ["--sample_ms", "0", "XYZABCUVW"[:naxes]])
+    lcnc = mod.lc()
+    comp = fake_component.made[-1]
+    names = input_pins(tool, naxes)
+    engine = mod.dro_engine(lcnc)
+    for i in range(1000):
+        move(comp, names, i)
+        engine.poll()
+    tracemalloc.start()
+    start, peak = tracemalloc.get_traced_memory()
+    for i in range(polls):
+        move(comp, names, i)
+        engine.poll()
+    end, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    emit(out, {"bench": "memory", "tool": tool, "naxes": naxes, "polls": polls,
+               "growth_bytes": end - start, "peak_bytes": peak})
+    lcnc.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--polls', type=int, default=2000,
+                    help='polls per latency run, default: 2000')
+    parser.add_argument('--memory_polls', type=int, default=50000,
+                    help='polls in the memory run, default: 50000')
+    parser.add_argument('--mdi', type=int, default=20,
+                    help='MDI commands to time, default: 20')
+    parser.add_argument('--mdi_delay', type=float, default=0.05,
+                    help='seconds wait_complete takes, default: 0.05')
+    parser.add_argument('--gui', action='store_true',
+                    help='also time main_gui.poll with Tk, needs a display')
+    parser.add_argument('--out', type=str, help='write results here, default: stdout')
+    parser.add_argument('--bench', action='append', choices=["poll", "mdi", "memory"],
+                    help='run only this benchmark, can be repeated, default: all of them')
+    parser.add_argument('--tool', action='append', choices=["yadro", "mdro"],
+                    help='run only this program, can be repeated, default: both')
+    parser.add_argument('--naxes', type=int, choices=range(1, 10),
+                    help='run only this many axes, default: 3 to 9, 3 for memory')
+    args = parser.parse_args()
+
+    out = sys.stdout
+    if not args.out is None:
+        out = open(args.out, "w")
+    benches = args.bench or ["poll", "mdi", "memory"]
+    tools = args.tool or ["yadro", "mdro"]
+    if "poll" in benches:
+        for tool in tools:
+            for naxes in [args.naxes] if args.naxes else range(3, 10):
+                bench_poll(tool, naxes, args.polls, False, out)
+                if args.gui:
+                    bench_poll(tool, naxes, args.polls, True, out)
+    # Only yadro sends MDI commands
+    if "mdi" in benches and "yadro" in tools:
+        bench_mdi(args.mdi, args.mdi_delay, out)
+    if "memory" in benches:
+        for tool in tools:
+            bench_memory(tool, args.naxes or 3, args.memory_polls, out)
@@ -18,16 +18,598 @@
 from __future__ import print_function
 import sys
 import os
-if sys.version_info[0] == 2:
-    import Tkinter as tk
-else:
-    import tkinter as tk
+import errno
+try:
+    if sys.version_info[0] == 2:
+        import Tkinter as tk
+        import tkFont as tkfont
+    else:
+        import tkinter as tk
+        import tkinter.font as tkfont
+except ImportError:
+    # Only --headless works without Tk
+    tk = None
 import argparse
 import time
+import threading
+import socket
+import select
+import json
+import struct
+import math
+import bisect
+from array import array
+from collections import deque
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 import linuxcnc
 import hal
 
-root = tk.Tk()
+# For hal, messages and the logs, so the code both tools share reads the same
+prog = "mdro"
+root = None
+
+# Latency histogram with fixed buckets, in seconds
+class histogram():
+    bounds = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1.0)
+
+    def __init__(self):
+        self.counts = array('l', [0]) * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.n = 0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.n += 1
+
+# Structured events and metrics. Logging an event is an append to a ring
+# buffer and a counter bump, so it costs the poll loop next to nothing.
+# Once started, a writer thread flushes new events to the --log file as
+# json lines every second. The counters and histograms can also be read
+# as Prometheus text, see metrics_server.
+class event_log(threading.Thread):
+    def __init__(self, prefix, size):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.prefix = prefix
+        self.events = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.written = 0
+        self.counters = dict()
+        self.histograms = dict()
+        self.path = None
+        self.timing = False
+        self.stopped = threading.Event()
+
+    # Starts writing events to path
+    def open(self, path):
+        self.path = path
+        self.start()
+
+    def event(self, name, **fields):
+        with self.lock:
+            self.seq += 1
+            self.events.append((self.seq, time.time(), name, fields))
+            self.counters[name] = self.counters.get(name, 0) + 1
+        if params["very_verbose"]:
+            print(self.prefix, name, fields)
+
+    def observe(self, name, v):
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = histogram()
+            h.observe(v)
+
+    # Events not written yet, oldest first, and how many fell off the ring
+    def pending(self):
+        with self.lock:
+            new = [e for e in self.events if e[0] > self.written]
+            dropped = self.seq - self.written - len(new)
+            self.written = self.seq
+        return new, dropped
+
+    def run(self):
+        while not self.stopped.wait(1.0):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        new, dropped = self.pending()
+        if len(new) == 0 and dropped == 0:
+            return
+        lines = []
+        if dropped > 0:
+            lines.append(json.dumps({"t": time.time(), "event": "log_dropped", "count": dropped}))
+        for seq, t, name, fields in new:
+            d = dict(fields)
+            d["t"] = t
+            d["event"] = name
+            lines.append(json.dumps(d, sort_keys=True))
+        try:
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        except (IOError, OSError) as e:
+            if params["verbose"]:
+                print(self.prefix, "log:", e)
+
+    def prometheus(self):
+        p = self.prefix
+        out = ["# TYPE {}_events_total counter".format(p)]
+        with self.lock:
+            for name in sorted(self.counters):
+                out.append('{}_events_total{{event="{}"}} {}'.format(p, name, self.counters[name]))
+            for name in sorted(self.histograms):
+                h = self.histograms[name]
+                out.append("# TYPE {}_{} histogram".format(p, name))
+                total = 0
+                for i, b in enumerate(h.bounds):
+                    total += h.counts[i]
+                    out.append('{}_{}_bucket{{le="{}"}} {}'.format(p, name, b, total))
+                out.append('{}_{}_bucket{{le="+Inf"}} {}'.format(p, name, h.n))
+                out.append("{}_{}_sum {}".format(p, name, h.sum))
+                out.append("{}_{}_count {}".format(p, name, h.n))
+        return "\n".join(out) + "\n"
+
+    def stop(self):
+        if self.path is None:
+            return
+        self.stopped.set()
+        self.join()
+
+# Serves the event counters and latency histograms as Prometheus text on
+# http://host:port/metrics
+class metrics_server(threading.Thread):
+    def __init__(self, addr):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = log.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = HTTPServer(addr, handler)
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+log = event_log(prog, 1000)
+
+# Runs poll fast while values are moving and backs off when they stop.
+# Any button press or key snaps it back to the fast rate. Without a Tk
+# root it runs poll from run_headless instead.
+class poll_scheduler():
+    def __init__(self, poll):
+        self.poll = poll
+        self.delay = params["fast_ms"]
+        self.after_id = None
+        self.wake_pending = False
+        self.event = None
+        self.running = True
+
+    def backoff(self, changed):
+        if changed:
+            self.delay = params["fast_ms"]
+        else:
+            self.delay = min(params["slow_ms"], int(self.delay * params["backoff"]) + 1)
+        return self.delay
+
+    def start(self):
+        self.after_id = root.after(20, self.run)
+        root.bind_all("<ButtonPress>", self.kick, "+")
+        root.bind_all("<KeyPress>", self.kick, "+")
+
+    # Runs poll and times it, a poll longer than the fast period is an
+    # overrun. With a log or metrics the Tk redraw is timed too.
+    def timed_poll(self):
+        t0 = time.time()
+        changed = self.poll()
+        t1 = time.time()
+        log.observe("poll_seconds", t1 - t0)
+        if (t1 - t0) * 1000.0 > params["fast_ms"]:
+            log.event("poll_overrun", ms=round((t1 - t0) * 1000.0, 1))
+        if changed and log.timing and not root is None:
+            root.update_idletasks()
+            log.observe("tk_update_seconds", time.time() - t1)
+        return changed
+
+    def run(self):
+        self.after_id = root.after(self.backoff(self.timed_poll()), self.run)
+
+    # Runs until finish is called or ^C. The poll after finish still
+    # picks up the last snapshot.
+    def run_headless(self):
+        self.event = threading.Event()
+        try:
+            while True:
+                finishing = not self.running
+                delay = self.backoff(self.timed_poll())
+                if finishing:
+                    break
+                self.event.wait(delay / 1000.0)
+                self.event.clear()
+        except KeyboardInterrupt:
+            pass
+
+    # Ends the program, from any thread: run_headless returns or the Tk
+    # mainloop quits
+    def finish(self):
+        self.running = False
+        if not self.event is None:
+            self.event.set()
+            return
+        try:
+            root.after_idle(root.quit)
+        except RuntimeError:
+            # mainloop has gone away
+            pass
+
+    def kick(self, event=None):
+        self.delay = params["fast_ms"]
+        self.wake_pending = False
+        if not self.after_id is None:
+            root.after_cancel(self.after_id)
+        self.after_id = root.after_idle(self.run)
+
+    # Called from the sampler thread when a new snapshot shows up
+    def wake(self):
+        if not self.event is None:
+            self.event.set()
+            return
+        if self.wake_pending or self.delay <= params["fast_ms"]:
+            return
+        self.wake_pending = True
+        try:
+            root.after_idle(self.kick)
+        except RuntimeError:
+            # mainloop has gone away
+            pass
+
+# A copy of the hal pins and the axis velocities derived from them.
+# Snapshots are never modified once they are published.
+class snapshot():
+    def __init__(self, t, raw, pins, ready, vel, feed, seq, probe_seq=0):
+        self.seq = seq
+        self.probe_seq = probe_seq
+        self.t = t
+        self.raw = raw
+        self.pins = pins
+        self.ready = ready
+        self.vel = vel
+        self.feed = feed
+        self.key = (tuple(pins), tuple(ready), tuple(vel), probe_seq)
+
+    # One json line for a snap_client
+    def encode(self):
+        return json.dumps({"snap": {"t": self.t, "raw": self.raw, "pins": self.pins,
+                                    "ready": self.ready, "vel": self.vel,
+                                    "feed": self.feed}}) + "\n"
+
+# Fixed size history of timestamped axis positions. One array('d') per axis
+# plus one for the times, overwritten in place so memory never grows.
+class sample_ring():
+    def __init__(self, naxes, size):
+        self.size = size
+        self.t = array('d', [0.0]) * size
+        self.v = [array('d', [0.0]) * size for i in range(naxes)]
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, t, values):
+        with self.lock:
+            i = self.head
+            self.t[i] = t
+            for a in range(len(values)):
+                self.v[a][i] = values[a]
+            self.head = (i + 1) % self.size
+            if self.count < self.size:
+                self.count += 1
+
+    # Ring position of the k'th oldest sample
+    def slot(self, k):
+        return (self.head - self.count + k) % self.size
+
+    # (start, end) slices covering the samples newer than t0, oldest first.
+    # Call with the lock held.
+    def spans(self, t0):
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.t[self.slot(mid)] < t0:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count:
+            return []
+        start = self.slot(lo)
+        end = self.slot(self.count - 1) + 1
+        if start < end:
+            return [(start, end)]
+        return [(start, self.size), (0, end)]
+
+    # Copies of the times and of every axis's values over the last seconds
+    def window(self, seconds, now):
+        ts = array('d')
+        vss = [array('d') for v in self.v]
+        with self.lock:
+            for a, b in self.spans(now - seconds):
+                ts.extend(self.t[a:b])
+                for i in range(len(self.v)):
+                    vss[i].extend(self.v[i][a:b])
+        return ts, vss
+
+    # min, max, mean and sample count of one axis over the last seconds,
+    # None if there are no samples that new. Read straight from the ring
+    # slices, nothing is copied per sample.
+    def stats(self, axis, seconds, now):
+        lo = None
+        hi = None
+        total = 0.0
+        n = 0
+        with self.lock:
+            for a, b in self.spans(now - seconds):
+                vs = self.v[axis][a:b]
+                if lo is None:
+                    lo = min(vs)
+                    hi = max(vs)
+                else:
+                    lo = min(lo, min(vs))
+                    hi = max(hi, max(vs))
+                total += sum(vs)
+                n += len(vs)
+        if n == 0:
+            return None
+        return lo, hi, total / n, n
+
+    # Least squares slope of every axis over the last seconds in units per
+    # second, 0.0 when there aren't two samples to fit
+    def slopes(self, seconds, now):
+        ts, vss = self.window(seconds, now)
+        n = len(ts)
+        rv = [0.0] * len(vss)
+        if n < 2:
+            return rv
+        tm = sum(ts) / n
+        dt = [t - tm for t in ts]
+        stt = sum([d * d for d in dt])
+        if stt == 0.0:
+            return rv
+        for i in range(len(vss)):
+            vm = sum(vss[i]) / n
+            rv[i] = sum([d * (v - vm) for d, v in zip(dt, vss[i])]) / stt
+        return rv
+
+# Display filters. update() takes a raw reading and returns the value to show.
+class median_filter():
+    def __init__(self, n):
+        self.buf = deque(maxlen=int(n))
+
+    def update(self, v):
+        self.buf.append(v)
+        return sorted(self.buf)[len(self.buf) // 2]
+
+# Once the average is closer to the reading than the display can show it
+# snaps to the reading, so the value stops changing when the axis stops
+# and the scheduler can back off.
+class ema_filter():
+    def __init__(self, alpha):
+        self.alpha = float(alpha)
+        self.v = None
+
+    def update(self, v):
+        if self.v is None or abs(v - self.v) < params["settle"]:
+            self.v = v
+        else:
+            self.v += self.alpha * (v - self.v)
+        return self.v
+
+# Holds the shown value until the reading moves more than band away from it
+class deadband_filter():
+    def __init__(self, band):
+        self.band = float(band)
+        self.v = None
+
+    def update(self, v):
+        if self.v is None or abs(v - self.v) > self.band:
+            self.v = v
+        return self.v
+
+# The filters for one axis, applied in order
+class filter_chain():
+    kinds = {"median": median_filter, "ema": ema_filter, "deadband": deadband_filter}
+
+    def __init__(self, spec):
+        self.filters = []
+        for item in spec.split():
+            kind, arg = item.split(":")
+            self.filters.append(filter_chain.kinds[kind](arg))
+
+    def update(self, v):
+        for f in self.filters:
+            v = f.update(v)
+        return v
+
+# A scale error map, read from a file of "reading correction" pairs in
+# scale units, one per line. Comments, blank lines and lines that don't
+# parse are skipped and counted. Between points the correction is interpolated, past
+# the ends the end correction holds. The points are kept sorted in arrays
+# with the slopes worked out once, so a lookup is a bisect and one
+# multiply however many points there are.
+class error_map():
+    def __init__(self, name):
+        points = []
+        self.skipped = 0
+        with open(name, 'r') as f:
+            text = f.read()
+        for line in text.splitlines():
+            fields = line.split()
+            if len(fields) == 0 or fields[0][0] in "#;(":
+                continue
+            try:
+                points.append((float(fields[0]), float(fields[1])))
+            except (ValueError, IndexError):
+                self.skipped += 1
+        if len(points) == 0:
+            raise ValueError("no points in " + name)
+        points.sort()
+        self.at = array('d', [p[0] for p in points])
+        self.corr = array('d', [p[1] for p in points])
+        self.slope = array('d', [0.0]) * len(points)
+        for i in range(len(points) - 1):
+            dx = self.at[i + 1] - self.at[i]
+            if dx > 0.0:
+                self.slope[i] = (self.corr[i + 1] - self.corr[i]) / dx
+
+    def lookup(self, v):
+        i = bisect.bisect_right(self.at, v) - 1
+        if i < 0:
+            return self.corr[0]
+        return self.corr[i] + self.slope[i] * (v - self.at[i])
+
+# Corrects one axis's readings before anything else sees them. Backlash
+# is taken out first: moving positive the reading is used as is, after a
+# reversal it has to come back the backlash before the value moves, and
+# from then on moving negative the backlash is added. Then the reading is
+# multiplied by the linear scale factor and the error map's correction
+# at that reading is added.
+class axis_comp():
+    def __init__(self, factor, emap, backlash):
+        self.factor = factor
+        self.map = emap
+        self.backlash = backlash
+        self.v = None
+
+    def update(self, v):
+        if self.backlash > 0.0:
+            if self.v is None:
+                self.v = v
+            self.v = min(max(self.v, v), v + self.backlash)
+            v = self.v
+        c = v * self.factor
+        if not self.map is None:
+            c += self.map.lookup(v)
+        return c
+
+# Where the probe or edge finder touched, in pin units. The edge came
+# somewhere between two samples so the positions are taken halfway between
+# them, which halves the worst case error. edge is that point moved by the
+# probe radius along the direction of travel of the linear axes; axis is
+# the one moving fastest.
+class probe_capture():
+    def __init__(self, t0, pins0, t1, pins1, vel):
+        self.t = (t0 + t1) / 2.0
+        self.pos = [(a + b) / 2.0 for a, b in zip(pins0, pins1)]
+        d = [0.0] * len(pins1)
+        for i, a in enumerate(params["axes"]):
+            if a.upper() in "XYZUVW":
+                d[i] = pins1[i] - pins0[i]
+                if d[i] == 0.0:
+                    d[i] = vel[i]
+        n = sum([x * x for x in d]) ** 0.5
+        self.axis = None
+        self.dir = [0.0] * len(d)
+        if n > 0.0:
+            self.dir = [x / n for x in d]
+            mags = [abs(x) for x in d]
+            self.axis = mags.index(max(mags))
+        r = params["probe_radius"]
+        self.edge = [p + r * u for p, u in zip(self.pos, self.dir)]
+
+# Hole positions for a bolt circle, a line of holes or a grid, worked out
+# once when the pattern is set and kept as x, y pairs in a flat array.
+#   circle X Y DIAMETER HOLES [START_ANGLE]
+#   line X Y ANGLE SPACING HOLES
+#   grid X Y DX DY COLUMNS ROWS
+# Grids are walked back and forth a row at a time to keep the moves short.
+class hole_pattern():
+    def __init__(self, spec):
+        fields = spec.split()
+        if len(fields) == 0:
+            raise ValueError("empty pattern")
+        kind = fields[0].lower()
+        a = [float(f) for f in fields[1:]]
+        self.spec = spec
+        self.points = array('d')
+        if kind == "circle" and len(a) in (4, 5):
+            x, y, r, n = a[0], a[1], a[2] / 2.0, int(a[3])
+            start = a[4] if len(a) == 5 else 0.0
+            for i in range(n):
+                ang = math.radians(start + 360.0 * i / n)
+                self.points.extend((x + r * math.cos(ang), y + r * math.sin(ang)))
+        elif kind == "line" and len(a) == 5:
+            x, y, ang, s, n = a[0], a[1], math.radians(a[2]), a[3], int(a[4])
+            dx, dy = s * math.cos(ang), s * math.sin(ang)
+            for i in range(n):
+                self.points.extend((x + i * dx, y + i * dy))
+        elif kind == "grid" and len(a) == 6:
+            x, y, dx, dy, nx, ny = a[0], a[1], a[2], a[3], int(a[4]), int(a[5])
+            for j in range(ny):
+                cols = range(nx) if j % 2 == 0 else range(nx - 1, -1, -1)
+                for i in cols:
+                    self.points.extend((x + i * dx, y + j * dy))
+        else:
+            raise ValueError("bad pattern: " + spec)
+        self.n = len(self.points) // 2
+        if self.n == 0:
+            raise ValueError("no holes: " + spec)
+
+    def point(self, i):
+        return self.points[2 * i], self.points[2 * i + 1]
+
+# The first two linear axes, the plane patterns are laid out in
+def pattern_axes():
+    axes = [i for i, a in enumerate(params["axes"]) if a.upper() in "XYZUVW"]
+    return axes[:2]
+
+# Samples the hal pins every sample_ms off the Tk thread. A new snapshot is
+# published only when something changed, by swapping the latest reference,
+# so the gui never waits on the sampler.
+class sampler(threading.Thread):
+    def __init__(self, lcnc):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lcnc = lcnc
+        self.latest = lcnc.sample(0)
+        self.wake = None
+        self.running = True
+
+    # Samples every probe_ms while the probe is armed
+    def run(self):
+        period = params["sample_ms"] / 1000.0
+        probe_period = params["probe_ms"] / 1000.0
+        while self.running:
+            snap = self.lcnc.sample(self.latest.seq + 1)
+            if snap.key != self.latest.key:
+                self.latest = snap
+                if not self.wake is None:
+                    self.wake()
+            if self.lcnc.armed:
+                time.sleep(probe_period)
+            else:
+                time.sleep(period)
+
+    def stop(self):
+        self.running = False
 
 # Linux cnc interface
 class lc():
@@ -36,32 +618,168 @@ class lc():
             self.s = linuxcnc.stat()
             self.s.poll()
             self.c = linuxcnc.command()
-            self.h = hal.component("mdro")
-            self.pins = ["axis."+str(p) for p in range(params["naxes"])]
-            for pin in self.pins:
-                self.h.newpin(pin, hal.HAL_FLOAT, hal.HAL_IN)
-            self.indexes = ["index-enable."+str(p) for p in range(params["naxes"])]
-            for pin in self.indexes:
-                self.h.newpin(pin, hal.HAL_BIT, hal.HAL_IO)
+            self.h = hal.component(prog)
+            self.new_pins()
             self.h.ready()
             if params["verbose"]:
                 print("Linuxcnc interface up")
         except:
-            print("mdro: Linuxcnc interface aborted")
+            print(prog + ": Linuxcnc interface aborted")
             exit(1)
+        self.setup(sampler if params["sample_ms"] > 0 else None)
+
+    # Creates mdro's pins on self.h
+    def new_pins(self):
+        self.pins = ["axis."+str(p) for p in range(params["naxes"])]
+        for pin in self.pins:
+            self.h.newpin(pin, hal.HAL_FLOAT, hal.HAL_IN)
+        self.indexes = ["index-enable."+str(p) for p in range(params["naxes"])]
+        for pin in self.indexes:
+            self.h.newpin(pin, hal.HAL_BIT, hal.HAL_IO)
+        self.vels = ["vel."+str(p) for p in range(params["naxes"])]
+        for pin in self.vels:
+            self.h.newpin(pin, hal.HAL_FLOAT, hal.HAL_OUT)
+        self.h.newpin("feed", hal.HAL_FLOAT, hal.HAL_OUT)
+        self.positions = ["pos."+str(p) for p in range(params["naxes"])]
+        for pin in self.positions:
+            self.h.newpin(pin, hal.HAL_FLOAT, hal.HAL_OUT)
+        self.h.newpin("cs-index", hal.HAL_S32, hal.HAL_OUT)
+        self.h.newpin("units-mm", hal.HAL_BIT, hal.HAL_OUT)
+        if params["probe"]:
+            self.h.newpin("probe", hal.HAL_BIT, hal.HAL_IN)
+
+    # source takes the sampler's place, None samples from poll
+    def setup(self, source):
+        self.history = sample_ring(params["naxes"], params["history"])
+        # Velocities are refit about as often as the display can show them
+        self.vel = [0.0] * params["naxes"]
+        self.feed = 0.0
+        self.vel_every = max(1, params["fast_ms"] // max(params["sample_ms"], 1))
+        self.vel_count = 0
+        self.linear = [a.upper() in "XYZUVW" for a in params["axes"]]
+        self.filters = [filter_chain(f) for f in params["filters"]]
+        self.comps = None
+        if any([not c is None for c in params["comps"]]):
+            self.comps = [None if c is None else axis_comp(*c) for c in params["comps"]]
+        self.armed = False
+        self.capture = None
+        self.probe_seq = 0
+        self.last_probe = False
+        self.prev_sample = None
+        self.clock = time.time
+        self.recorder = None
+        if not params["record"] is None:
+            self.recorder = recorder(params["record"], params["record_size"])
+        self.sampler = None
+        if not source is None:
+            self.sampler = source(self)
+            self.snap = self.sampler.latest
+            self.sampler.start()
+        else:
+            self.snap = self.sample(0)
+
+    def stop(self):
+        if not self.sampler is None:
+            self.sampler.stop()
+        if not self.recorder is None:
+            self.recorder.close()
+
+    # Runs on the sampler thread unless sample_ms is 0. mdro doesn't use
+    # any linuxcnc.stat fields so only the hal pins are read.
+    # Velocities come from the raw readings, the display from the filtered ones.
+    # Scale error and backlash compensation comes first, so from here on
+    # raw means the corrected readings. The pins themselves are recorded.
+    def sample(self, seq):
+        t = self.clock()
+        raw = [self.h[pin] for pin in self.pins]
+        ready = [self.h[pin] == 0 for pin in self.indexes]
+        if not self.recorder is None:
+            self.recorder.add(t, raw, ready, params["probe"] and self.h["probe"] != 0)
+        if not self.comps is None:
+            raw = [v if c is None else c.update(v) for c, v in zip(self.comps, raw)]
+        self.history.add(t, raw)
+        self.vel_count += 1
+        if self.vel_count >= self.vel_every:
+            self.vel_count = 0
+            self.update_vel(t)
+        pins = [self.filters[i].update(raw[i]) for i in range(len(raw))]
+        if params["probe"]:
+            self.check_probe(t, raw)
+        return snapshot(t, raw, pins, ready, self.vel, self.feed, seq, self.probe_seq)
 
+    # Latches a probe_capture when the probe pin goes true while armed.
+    # The raw readings are used, the filters would only add lag.
+    def check_probe(self, t, raw):
+        probe = self.h["probe"] != 0
+        if probe and not self.last_probe and self.armed and not self.prev_sample is None:
+            t0, raw0 = self.prev_sample
+            self.capture = probe_capture(t0, raw0, t, raw, self.vel)
+            self.armed = False
+            if not self.recorder is None:
+                self.recorder.arm(t, False)
+            self.probe_seq += 1
+            if params["verbose"]:
+                print("probe: edge at", self.capture.edge, "axis", self.capture.axis)
+            log.event("probe", axis=self.capture.axis, edge=self.capture.edge)
+        self.last_probe = probe
+        self.prev_sample = (t, raw)
+
+    def arm_probe(self, on):
+        self.armed = on
+        if not self.recorder is None:
+            self.recorder.arm(self.clock(), on)
+
+    # Whether the probe is armed and the last capture
+    def get_probe(self):
+        return self.armed, self.capture
+
+    # Refits the velocities and publishes them on the hal pins
+    def update_vel(self, t):
+        vel = self.history.slopes(params["vel_window"], t)
+        feed2 = 0.0
+        for i in range(len(vel)):
+            self.h[self.vels[i]] = vel[i]
+            if self.linear[i]:
+                feed2 += vel[i] * vel[i]
+        self.vel = vel
+        self.feed = feed2 ** 0.5
+        self.h["feed"] = self.feed
+
+    # Picks up the newest snapshot, everything below reads from it
     def poll(self):
-        self.s.poll()
+        if self.sampler is None:
+            snap = self.sample(self.snap.seq + 1)
+            if snap.key != self.snap.key:
+                self.snap = snap
+        else:
+            self.snap = self.sampler.latest
+
+    # The newest snapshot without polling, for other threads
+    def latest(self):
+        if self.sampler is None:
+            return self.snap
+        return self.sampler.latest
+
+    def get_seq(self):
+        return self.snap.seq
 
     def get_pins(self):
-        pins = [self.h[pin] for pin in self.pins]
-        if params["very_verbose"]:
-            print("pins:", pins)
-        return pins
+        return self.snap.pins
+
+    # Units per second
+    def get_velocities(self):
+        return self.snap.vel, self.snap.feed
 
     def index_ready(self, row):
-        pin_name = self.indexes[row]
-        return self.h[pin_name] == 0
+        return self.snap.ready[row]
+
+    # Publishes what the display shows: positions in display units, the
+    # coordinate system (0 is mcs) and the display units
+    def set_outputs(self, positions, cs_index, units_mm):
+        for i in range(len(positions)):
+            self.h[self.positions[i]] = positions[i]
+        self.h["cs-index"] = cs_index
+        self.h["units-mm"] = units_mm
 
     def set_index_enable(self, row):
         pin_name = self.indexes[row]
@@ -69,25 +787,819 @@ class lc():
             print(pin_name, "= 1")
         self.h[pin_name] = 1
 
+# Shares this lc with other mdro windows. Clients connect to a Unix
+# socket and get a json line for every new snapshot. The only thing they
+# send back is the index button.
+class snap_server(threading.Thread):
+    def __init__(self, lcnc, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lcnc = lcnc
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(5)
+        self.clients = dict()
+        self.running = True
+
+    def run(self):
+        period = max(params["sample_ms"], 5) / 1000.0
+        last_seq = None
+        while self.running:
+            r, w, x = select.select([self.sock] + list(self.clients), [], [], period)
+            for conn in r:
+                if conn is self.sock:
+                    self.accept()
+                else:
+                    self.receive(conn)
+            snap = self.lcnc.latest()
+            if snap.seq != last_seq:
+                last_seq = snap.seq
+                line = snap.encode().encode()
+                for conn in list(self.clients):
+                    self.send(conn, line)
+        for conn in list(self.clients):
+            self.drop(conn)
+        self.sock.close()
+        os.unlink(self.path)
+
+    def accept(self):
+        conn, addr = self.sock.accept()
+        conn.settimeout(1.0)
+        self.clients[conn] = b""
+        if params["verbose"]:
+            print("snap_server: client", len(self.clients), "attached")
+        log.event("client_attached", clients=len(self.clients))
+        hello = {"hello": {"axes": "".join(params["axes"])}}
+        self.send(conn, (json.dumps(hello) + "\n").encode())
+        self.send(conn, self.lcnc.latest().encode().encode())
+
+    def drop(self, conn):
+        if not conn in self.clients:
+            return
+        del self.clients[conn]
+        conn.close()
+        if params["verbose"]:
+            print("snap_server: client detached,", len(self.clients), "left")
+        log.event("client_detached", clients=len(self.clients))
+
+    # A client that can't keep up or has gone away is dropped
+    def send(self, conn, line):
+        try:
+            conn.sendall(line)
+        except (socket.error, OSError):
+            self.drop(conn)
+
+    def receive(self, conn):
+        try:
+            data = conn.recv(4096)
+        except (socket.error, OSError):
+            data = b""
+        if len(data) == 0:
+            self.drop(conn)
+            return
+        lines = (self.clients[conn] + data).split(b"\n")
+        self.clients[conn] = lines[-1]
+        for line in lines[:-1]:
+            try:
+                msg = json.loads(line.decode())
+                if params["verbose"]:
+                    print("snap_server:", msg)
+                row = int(msg["index"])
+                if 0 <= row < params["naxes"] and self.lcnc.latest().ready[row]:
+                    self.lcnc.set_index_enable(row)
+            except (ValueError, KeyError, TypeError) as e:
+                print("snap_server: bad request", line, e)
+
+    def stop(self):
+        self.running = False
+
+# Reads snapshots from a snap_server for a remote_lc. It takes the
+# sampler's place, latest and wake work the same way. If the server goes
+# away it keeps trying to attach again.
+class snap_client(threading.Thread):
+    def __init__(self, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.lock = threading.Lock()
+        self.wake = None
+        self.finished = None
+        self.done = False
+        self.running = True
+        self.seq = 0
+        if not self.attach():
+            if not self.done:
+                print(prog + ": Could not attach to", path)
+            exit(1)
+
+    # Connects and reads the hello and the first snapshot
+    def attach(self):
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.path)
+            self.f = self.sock.makefile('rb')
+            hello = json.loads(self.f.readline().decode())["hello"]
+            if hello["axes"] != "".join(params["axes"]):
+                print(prog + ": server axes are", hello["axes"])
+                self.done = True
+                return False
+            self.latest = self.decode(json.loads(self.f.readline().decode())["snap"])
+        except (socket.error, OSError, ValueError, KeyError):
+            return False
+        if params["verbose"]:
+            print("snap_client: attached to", self.path)
+        return True
+
+    # Local sequence numbers so they keep going up across a reattach
+    def decode(self, d):
+        self.seq += 1
+        return snapshot(d["t"], d["raw"], d["pins"], d["ready"], d["vel"],
+                        d["feed"], self.seq)
+
+    def handle(self, msg):
+        self.latest = self.decode(msg["snap"])
+
+    # A line that doesn't parse is handled like a lost connection. If the
+    # server comes back with other axes the client gives up and calls
+    # finished, the window can't show them.
+    def run(self):
+        while self.running:
+            try:
+                line = self.f.readline()
+                if len(line) > 0:
+                    self.handle(json.loads(line.decode()))
+            except (socket.error, OSError, ValueError, KeyError, TypeError) as e:
+                if params["verbose"]:
+                    print("snap_client:", e)
+                line = b""
+            if len(line) == 0:
+                if not self.running:
+                    return
+                print(prog + ": lost", self.path)
+                self.close()
+                while self.running and not self.attach():
+                    if self.done:
+                        self.running = False
+                        if not self.finished is None:
+                            self.finished()
+                        return
+                    time.sleep(1.0)
+            if not self.wake is None:
+                self.wake()
+
+    def close(self):
+        try:
+            self.f.close()
+            self.sock.close()
+        except (socket.error, OSError):
+            pass
+
+    def send(self, msg):
+        with self.lock:
+            try:
+                self.sock.sendall((json.dumps(msg) + "\n").encode())
+            except (socket.error, OSError):
+                pass
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, OSError):
+            pass
+
+# An lc that reads everything from a snap_server instead of hal. The
+# server publishes the output pins.
+class remote_lc(lc):
+    def __init__(self, path):
+        self.armed = False
+        self.capture = None
+        self.recorder = None
+        self.sampler = snap_client(path)
+        self.snap = self.sampler.latest
+        self.sampler.start()
+
+    def poll(self):
+        self.snap = self.sampler.latest
+
+    def stop(self):
+        self.sampler.stop()
+
+    def set_outputs(self, positions, cs_index, units_mm):
+        pass
+
+    def set_index_enable(self, row):
+        if params["verbose"]:
+            print("index", row, "sent")
+        self.sampler.send({"index": row})
+
+# The record log, written by --record and read back by --replay. A header
+# with the axes, then a record for each sample that changed something: a
+# kind byte and the sample time, then
+#   REC_PINS    a flags byte (1 is the probe pin), a mask of the
+#               index-enable pins that are set, then a double per axis
+#   REC_ARM     a byte, 1 when the probe was armed and 0 when it was disarmed
+# mdro reads nothing from linuxcnc.stat so there are no stat records.
+REC_PINS = 2
+REC_ARM = 3
+rec_magic = b"MDRO"
+rec_version = 2
+rec_header = struct.Struct("!4sBB9s")
+rec_head = struct.Struct("!Bd")
+rec_arm = struct.Struct("!B")
+
+def rec_pins(naxes):
+    return struct.Struct("!BI{}d".format(naxes))
+
+# Appends samples to the record log from the sampler thread. Writes are
+# buffered and flushed about once a second. When the file passes limit
+# kilobytes it is renamed to path.1, replacing the one before, and a new
+# file is started with the current pins, so no more than twice the limit
+# is ever on disk.
+class recorder():
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit * 1024
+        self.pins = rec_pins(params["naxes"])
+        self.lock = threading.Lock()
+        self.last_pins = None
+        self.last_arm = False
+        try:
+            self.start()
+        except (IOError, OSError) as e:
+            print(prog + ": can't record to", path, e)
+            exit(1)
+
+    def start(self):
+        self.f = open(self.path, "wb")
+        self.f.write(rec_header.pack(rec_magic, rec_version, params["naxes"],
+                                     "".join(params["axes"]).encode()))
+        self.size = rec_header.size
+        self.flushed = time.time()
+
+    def write(self, kind, t, payload):
+        self.f.write(rec_head.pack(kind, t))
+        self.f.write(payload)
+        self.size += rec_head.size + len(payload)
+
+    def add(self, t, raw, ready, probe):
+        mask = 0
+        for i in range(len(ready)):
+            mask |= (not ready[i]) << i
+        pins = self.pins.pack(probe, mask, *raw)
+        with self.lock:
+            if self.f is None or pins == self.last_pins:
+                return
+            self.write(REC_PINS, t, pins)
+            self.last_pins = pins
+            try:
+                if self.size >= self.limit:
+                    self.rotate(t)
+                elif time.time() - self.flushed >= 1.0:
+                    self.f.flush()
+                    self.flushed = time.time()
+            except (IOError, OSError) as e:
+                print(prog + ": recording stopped,", e)
+                self.f = None
+
+    def rotate(self, t):
+        self.f.close()
+        os.rename(self.path, self.path + ".1")
+        self.start()
+        self.write(REC_PINS, t, self.last_pins)
+        if self.last_arm:
+            self.write(REC_ARM, t, rec_arm.pack(True))
+        log.event("record_rotated", path=self.path)
+
+    # Arming is recorded so a replay latches the same touches
+    def arm(self, t, on):
+        with self.lock:
+            if self.f is None:
+                return
+            self.write(REC_ARM, t, rec_arm.pack(on))
+            self.last_arm = on
+
+    def close(self):
+        with self.lock:
+            if not self.f is None:
+                self.f.close()
+                self.f = None
+
+# Reads a record log back, checking it was made with the same axes
+class replay_log():
+    def __init__(self, path):
+        try:
+            with open(path, "rb") as f:
+                self.data = f.read()
+            magic, version, naxes, axes = rec_header.unpack_from(self.data, 0)
+        except (IOError, OSError, struct.error) as e:
+            print(prog + ": can't replay", path, e)
+            exit(1)
+        axes = axes[:naxes].decode()
+        if magic != rec_magic:
+            print(prog + ":", path, "is not a " + prog + " record log")
+            exit(1)
+        if version != rec_version:
+            print(prog + ":", path, "was recorded by another version of " + prog)
+            exit(1)
+        if axes != "".join(params["axes"]):
+            print(prog + ":", path, "was recorded with axes", axes)
+            exit(1)
+        self.pins = rec_pins(naxes)
+
+    # (kind, t, fields) for each record, a cut off last record is dropped
+    def records(self):
+        off = rec_header.size
+        sizes = {REC_PINS: self.pins, REC_ARM: rec_arm}
+        while off + rec_head.size <= len(self.data):
+            kind, t = rec_head.unpack_from(self.data, off)
+            off += rec_head.size
+            body = sizes.get(kind)
+            if body is None or off + body.size > len(self.data):
+                return
+            yield kind, t, body.unpack_from(self.data, off)
+            off += body.size
+
+# Stand in for hal.component during a replay. Inputs come from the log,
+# outputs are kept but go nowhere.
+class replay_component():
+    def __init__(self):
+        self.pins = dict()
+
+    def newpin(self, name, kind, direction):
+        self.pins[name] = 0
+
+    def __getitem__(self, name):
+        return self.pins[name]
+
+    def __setitem__(self, name, v):
+        self.pins[name] = v
+
+# Plays a record log into a replay_lc in the sampler's place. Each pins
+# record is sampled at its recorded time, scaled by --replay_speed, and the
+# sample clock is the recorded one so velocities and probe touches come
+# out as they did at the machine. 0 plays as fast as it can. At the end
+# the last values stay up, done is set and finished is called.
+class replayer(threading.Thread):
+    def __init__(self, lcnc):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lcnc = lcnc
+        self.records = lcnc.replay.records()
+        self.speed = params["replay_speed"]
+        self.wake = None
+        self.finished = None
+        self.done = False
+        self.running = True
+        self.t = 0.0
+        lcnc.clock = self.now
+        for kind, t, fields in self.records:
+            self.apply(kind, t, fields)
+            if kind == REC_PINS:
+                break
+        self.t0 = self.t
+        self.latest = lcnc.sample(0)
+
+    def now(self):
+        return self.t
+
+    def apply(self, kind, t, fields):
+        self.t = t
+        if kind == REC_ARM:
+            self.lcnc.armed = fields[0] != 0
+            return
+        h = self.lcnc.h
+        for i, pin in enumerate(self.lcnc.pins):
+            h[pin] = fields[i + 2]
+        for i, pin in enumerate(self.lcnc.indexes):
+            h[pin] = (fields[1] >> i) & 1
+        if params["probe"]:
+            h["probe"] = fields[0] & 1
+
+    def run(self):
+        start = time.time()
+        for kind, t, fields in self.records:
+            if not self.running:
+                return
+            if kind == REC_PINS and self.speed > 0:
+                delay = start + (t - self.t0) / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.apply(kind, t, fields)
+            if kind != REC_PINS:
+                continue
+            snap = self.lcnc.sample(self.latest.seq + 1)
+            if snap.key != self.latest.key:
+                self.latest = snap
+                if not self.wake is None:
+                    self.wake()
+        if params["verbose"]:
+            print("replay: done, {:.1f}s played in {:.1f}s".format(self.t - self.t0,
+                                                                  time.time() - start))
+        log.event("replay_done", seconds=round(self.t - self.t0, 3))
+        self.done = True
+        if not self.finished is None:
+            self.finished()
+
+    def stop(self):
+        self.running = False
+
+# An lc that reads a record log instead of hal. The engine and the gui
+# can't tell the difference.
+class replay_lc(lc):
+    def __init__(self, path):
+        self.replay = replay_log(path)
+        self.h = replay_component()
+        self.new_pins()
+        self.setup(replayer)
+
+# The network display protocol. Every frame is a type byte, a flags byte
+# and a 16 bit payload length, then the payload:
+#   NET_HELLO   server to client, json: tool, axes, field names, cs names
+#   NET_STATE   server to client, 32 bit mask of the fields that changed
+#               since the last state frame, then a double for each of them
+#   NET_RATE    client to server, uint16 most state frames per second
+#   NET_ACTION  client to server, action byte, int16 argument, double value
+#               NET_ZERO, NET_HALF and NET_SET take the axis row from 0.
+#               NET_CS takes the coordinate system slot, 0 is mcs, the
+#               same number as the index into cs names in the hello
+NET_HELLO = 1
+NET_STATE = 2
+NET_RATE = 3
+NET_ACTION = 4
+NET_ZERO = 1
+NET_HALF = 2
+NET_SET = 3
+NET_CS = 4
+net_header = struct.Struct("!BBH")
+net_action = struct.Struct("!Bhd")
+net_mask = struct.Struct("!I")
+
+def net_frame(kind, payload):
+    return net_header.pack(kind, 0, len(payload)) + payload
+
+# Splits buf into (kind, payload) frames, returns them and what's left over
+def net_split(buf):
+    frames = []
+    while len(buf) >= net_header.size:
+        kind, flags, n = net_header.unpack_from(buf)
+        if len(buf) < net_header.size + n:
+            break
+        frames.append((kind, buf[net_header.size:net_header.size + n]))
+        buf = buf[net_header.size + n:]
+    return frames, buf
+
+# The fields that differ from last, None if nothing does. last is None
+# before the first frame so that one carries everything.
+def net_encode_state(last, values):
+    mask = 0
+    changed = []
+    for i in range(len(values)):
+        if last is None or values[i] != last[i]:
+            mask |= 1 << i
+            changed.append(values[i])
+    if mask == 0:
+        return None
+    return net_mask.pack(mask) + struct.pack("!" + "d" * len(changed), *changed)
+
+# Applies a state payload to values in place
+def net_decode_state(values, payload):
+    mask, = net_mask.unpack_from(payload)
+    n = bin(mask).count("1")
+    changed = struct.unpack_from("!" + "d" * n, payload, net_mask.size)
+    k = 0
+    for i in range(len(values)):
+        if mask & (1 << i):
+            values[i] = changed[k]
+            k += 1
+
+# One network display client and what it was last sent
+class net_peer():
+    def __init__(self, conn):
+        self.conn = conn
+        self.inbuf = b""
+        self.outbuf = b""
+        self.last = None
+        self.interval = 1.0 / params["net_rate"]
+        self.next_t = 0.0
+
+# Streams the DRO state to network displays over TCP. Each client gets
+# only the fields that changed since its last frame and no more frames a
+# second than it asked for, so a slow client just sees fewer of them. With
+# --net_actions, actions from clients are posted to the engine and run
+# like the ones from the screen.
+class net_server(threading.Thread):
+    max_outbuf = 65536
+
+    def __init__(self, engine, addr):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.engine = engine
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+        self.sock.listen(5)
+        self.peers = dict()
+        self.fields = [a + " pos" for a in params["axes"]] + ["cs index", "units mm"]
+        self.wake = None
+        self.running = True
+
+    def values(self):
+        engine = self.engine
+        values = [float(v) for v in engine.get_positions()]
+        values.extend([engine.get_cs_index(), engine.disp_mm])
+        return values
+
+    def run(self):
+        while self.running:
+            now = time.time()
+            timeout = 1.0 / params["net_rate"]
+            for peer in self.peers.values():
+                if peer.next_t > now:
+                    timeout = min(timeout, peer.next_t - now)
+            socks = [peer.conn for peer in self.peers.values()]
+            writers = [peer.conn for peer in self.peers.values() if len(peer.outbuf) > 0]
+            r, w, x = select.select([self.sock] + socks, writers, [], timeout)
+            for conn in r:
+                if conn is self.sock:
+                    self.accept()
+                elif conn in self.peers:
+                    self.receive(self.peers[conn])
+            for conn in w:
+                if conn in self.peers:
+                    self.flush(self.peers[conn])
+            self.stream(time.time())
+        for conn in list(self.peers):
+            self.drop(conn)
+        self.sock.close()
+
+    def accept(self):
+        conn, addr = self.sock.accept()
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = net_peer(conn)
+        self.peers[conn] = peer
+        if params["verbose"]:
+            print("net_server:", addr, "connected")
+        log.event("net_connected", addr=str(addr))
+        hello = {"tool": prog, "axes": "".join(params["axes"]),
+                 "fields": self.fields, "cs_names": self.engine.get_cs_names()}
+        self.queue(peer, net_frame(NET_HELLO, json.dumps(hello).encode()))
+
+    def drop(self, conn):
+        if conn in self.peers:
+            del self.peers[conn]
+            conn.close()
+            if params["verbose"]:
+                print("net_server: client dropped,", len(self.peers), "left")
+            log.event("net_dropped", clients=len(self.peers))
+
+    def stream(self, now):
+        values = None
+        for peer in list(self.peers.values()):
+            if now < peer.next_t:
+                continue
+            if values is None:
+                values = self.values()
+            payload = net_encode_state(peer.last, values)
+            if payload is None:
+                continue
+            peer.last = values
+            peer.next_t = now + peer.interval
+            self.queue(peer, net_frame(NET_STATE, payload))
+
+    # A client that lets too much pile up is dropped
+    def queue(self, peer, frame):
+        peer.outbuf += frame
+        if len(peer.outbuf) > net_server.max_outbuf:
+            self.drop(peer.conn)
+            return
+        self.flush(peer)
+
+    def flush(self, peer):
+        try:
+            n = peer.conn.send(peer.outbuf)
+            peer.outbuf = peer.outbuf[n:]
+        except socket.error as e:
+            if not e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.drop(peer.conn)
+
+    def receive(self, peer):
+        try:
+            data = peer.conn.recv(4096)
+        except socket.error:
+            data = b""
+        if len(data) == 0:
+            self.drop(peer.conn)
+            return
+        frames, peer.inbuf = net_split(peer.inbuf + data)
+        for kind, payload in frames:
+            try:
+                self.handle(peer, kind, payload)
+            except (struct.error, ValueError, IndexError) as e:
+                print("net_server: bad frame", kind, e)
+
+    def handle(self, peer, kind, payload):
+        if kind == NET_RATE:
+            rate, = struct.unpack("!H", payload)
+            peer.interval = 1.0 / min(max(rate, 1), params["net_rate"])
+        elif kind == NET_ACTION:
+            action, arg, value = net_action.unpack(payload)
+            if not params["net_actions"]:
+                if params["verbose"]:
+                    print("net_server: actions are off, ignored", action, arg, value)
+                return
+            if action == NET_CS:
+                if not 0 <= arg < len(self.engine.get_cs_names()):
+                    raise ValueError("no coordinate system " + str(arg))
+                self.engine.post("select_cs", [arg])
+            else:
+                if not 0 <= arg < params["naxes"]:
+                    raise ValueError("no axis " + str(arg))
+                if action == NET_ZERO:
+                    self.engine.post("zero", [arg])
+                elif action == NET_HALF:
+                    self.engine.post("half", [arg])
+                elif action == NET_SET:
+                    self.engine.post("set_value", [arg, value])
+            if not self.wake is None:
+                self.wake()
+
+    def stop(self):
+        self.running = False
+
+# A network display client for testing a net_server. It prints the state
+# as it changes, stdin lines like "zero 0", "half 1", "set 2 1.25" or
+# "cs 2" are sent as actions.
+class net_client():
+    def __init__(self, addr, rate):
+        self.sock = socket.create_connection(addr)
+        self.sock.sendall(net_frame(NET_RATE, struct.pack("!H", rate)))
+        self.buf = b""
+        self.hello = None
+        self.values = None
+
+    # Returns the frames that have come in, None once the server is gone
+    def read(self):
+        data = self.sock.recv(4096)
+        if len(data) == 0:
+            return None
+        frames, self.buf = net_split(self.buf + data)
+        for kind, payload in frames:
+            if kind == NET_HELLO:
+                self.hello = json.loads(payload.decode())
+                self.values = [0.0] * len(self.hello["fields"])
+            elif kind == NET_STATE:
+                net_decode_state(self.values, payload)
+        return frames
+
+    def action(self, action, arg, value=0.0):
+        self.sock.sendall(net_frame(NET_ACTION, net_action.pack(action, arg, value)))
+
+    def show(self):
+        s = []
+        for name, v in zip(self.hello["fields"], self.values):
+            s.append("{}={:g}".format(name.replace(" ", "_"), v))
+        print(" ".join(s))
+        sys.stdout.flush()
+
+    def commands(self):
+        codes = {"zero": NET_ZERO, "half": NET_HALF, "set": NET_SET, "cs": NET_CS}
+        for line in iter(sys.stdin.readline, ""):
+            fields = line.split()
+            try:
+                self.action(codes[fields[0]], int(fields[1]),
+                            float(fields[2]) if len(fields) > 2 else 0.0)
+            except (KeyError, IndexError, ValueError):
+                print("zero|half|set|cs <n> [value]")
+
+    def run(self):
+        t = threading.Thread(target=self.commands)
+        t.daemon = True
+        t.start()
+        while True:
+            frames = self.read()
+            if frames is None:
+                print("server closed")
+                return
+            if any(kind == NET_STATE for kind, payload in frames):
+                self.show()
+
+# [host:]port to an address tuple, host defaults to all interfaces
+def net_addr(s):
+    host, sep, port = s.rpartition(":")
+    return (host, int(port))
+
+# All the axis readouts drawn on one canvas, for --canvas. The font is
+# measured once so every character cell has the same width. Each row is a
+# background rectangle and one text item per cell, and an update only
+# reconfigures the cells whose character changed, with no Tcl variable
+# traces in the way.
+class readout_canvas():
+    pad = 4
+
+    def __init__(self, frame, nrows, ncells):
+        font = tkfont.Font(font=params["font1"])
+        self.cw = max([font.measure(c) for c in "0123456789.-#"])
+        self.ncells = ncells
+        self.width = ncells * self.cw + 2 * readout_canvas.pad
+        row_h = font.metrics("linespace") + 2 * readout_canvas.pad
+        self.canvas = tk.Canvas(frame, width=self.width, height=nrows * row_h,
+                                highlightthickness=0)
+        self.bg = self.canvas.cget("bg")
+        self.rects = []
+        self.cells = []
+        self.shown = []
+        for row in range(nrows):
+            y = row * row_h
+            self.rects.append(self.canvas.create_rectangle(0, y, self.width, y + row_h,
+                                                           width=0, fill=self.bg))
+            self.cells.append([self.canvas.create_text(self.cell_x(c), y + row_h // 2, text="",
+                                                       font=params["font1"])
+                               for c in range(ncells)])
+            self.shown.append([""] * ncells)
+
+    def cell_x(self, c):
+        return readout_canvas.pad + c * self.cw + self.cw // 2
+
+    # Lines each readout up with its grid row once the frame is laid out.
+    # column is the grid column the canvas spans the rows of.
+    def align(self, frame, column):
+        top = None
+        for row in range(len(self.cells)):
+            bbox = frame.grid_bbox(column, row)
+            if bbox is None:
+                return
+            x, y, w, h = bbox
+            if top is None:
+                top = y
+            y -= top
+            self.canvas.coords(self.rects[row], 0, y, self.width, y + h)
+            for c in range(self.ncells):
+                self.canvas.coords(self.cells[row][c], self.cell_x(c), y + h // 2)
+
+    # Right justifies s in the row, a value too wide for it fills the row
+    # with # rather than losing its sign or top digits. Returns True if any
+    # cell changed.
+    def set_text(self, row, s):
+        if len(s) > self.ncells:
+            s = "#" * self.ncells
+        s = s.rjust(self.ncells)
+        shown = self.shown[row]
+        cells = self.cells[row]
+        changed = False
+        for c in range(self.ncells):
+            if s[c] != shown[c]:
+                shown[c] = s[c]
+                self.canvas.itemconfigure(cells[c], text=s[c])
+                changed = True
+        return changed
+
+    # None goes back to the canvas background
+    def set_bg(self, row, color):
+        self.canvas.itemconfigure(self.rects[row], fill=color or self.bg)
+
 # One of these for each DRO row
 class axis_row_gui():
-    def __init__(self, frame, row, text, entry_callback, index_callback):
+    zone_colors = {"near": "yellow", "on": "green"}
+
+    def __init__(self, frame, row, text, entry_callback, index_callback, target_callback,
+                 readout=None):
         px = 10
         self.row = row
         self.text = text
-        self.value = tk.StringVar()
+        self.readout = readout
         if params["mm"] == 0:
             self.cur_format = params["inch_format"]
+            self.vel_format = params["inch_vel_format"]
         else:
             self.cur_format = params["mm_format"]
-        self.value.set(self.cur_format.format(0.0))
+            self.vel_format = params["mm_vel_format"]
+        self.shown_v = 0.0
+        self.shown_s = self.cur_format.format(0.0)
+        self.pos = 0.0
+        self.shown_to_go = False
+        self.shown_zone = None
+        self.entry_state = None
+        self.index_state = None
         self.entry_callback = entry_callback
         self.index_callback = index_callback
+        self.target_callback = target_callback
         self.title = tk.Label(frame, justify=tk.RIGHT, anchor=tk.E, text=text, font=params["font1"])
+        self.title_fg = self.title.cget("fg")
         self.title.grid(row=row, column=0, columnspan=1, sticky=tk.W)
-        self.vlabel = tk.Label(frame, width=10, justify=tk.RIGHT, anchor=tk.E,
-                            textvariable=self.value, font=params["font1"])
-        self.vlabel.grid(row=row, column=1, columnspan=1, sticky=tk.W)
+        if readout is None:
+            self.value = tk.StringVar()
+            self.value.set(self.shown_s)
+            self.vlabel = tk.Label(frame, width=10, justify=tk.RIGHT, anchor=tk.E,
+                                textvariable=self.value, font=params["font1"])
+            self.vlabel.grid(row=row, column=1, columnspan=1, sticky=tk.W)
+            self.value_bg = self.vlabel.cget("bg")
+        else:
+            readout.set_text(row, self.shown_s)
         self.zero = tk.Button(frame, text="0", font=params["font2"])
         self.zero.bind("<ButtonRelease-1>", lambda event: self.zero_up(event))
         self.zero.grid(row=row, column=2, columnspan=1, padx=px, sticky=tk.W)
@@ -101,6 +1613,12 @@ class axis_row_gui():
         self.index = tk.Button(frame, text="I", font=params["font2"])
         self.index.bind("<ButtonRelease-1>", lambda event: self.index_up(event))
         self.index.grid(row=row, column=5, columnspan=1, padx=px, sticky=tk.W)
+        self.vel = None
+        self.shown_vel = None
+        if params["velocity"]:
+            self.vel = tk.Label(frame, width=7, justify=tk.RIGHT, anchor=tk.E,
+                                text="", font=params["font2"])
+            self.vel.grid(row=row, column=6, columnspan=1, padx=px, sticky=tk.E)
         self.disable_entry()
 
     def enter_hit(self):
@@ -119,6 +1637,21 @@ class axis_row_gui():
             print("enter_clicked")
         self.entry_callback(self.row, None)
 
+    # The entry becomes the target, an empty entry clears it
+    def target_hit(self):
+        if params["verbose"]:
+            print("target_hit")
+        s = self.entry.get().strip()
+        v = None
+        if s != "":
+            try:
+                v = float(s)
+            except:
+                print('\a')
+                return
+        self.target_callback(self.row, v)
+        self.entry.delete(0, tk.END)
+
     def zero_up(self, event):
         if params["verbose"]:
             print("zero_up")
@@ -127,20 +1660,62 @@ class axis_row_gui():
     def half_up(self, event):
         if params["verbose"]:
             print("half_up")
-        self.entry_callback(self.row, float(self.value.get())/2.0)
+        self.entry_callback(self.row, self.pos/2.0)
 
     def index_up(self, event):
         if params["verbose"]:
             print("index_up")
         self.index_callback(self.row)
 
-    def set_value(self, v):
-        self.value.set(self.cur_format.format(v))
+    # v is what's shown, pos the position when v is a distance to go
+    def set_value(self, v, pos=None):
+        self.pos = v if pos is None else pos
+        if v == self.shown_v:
+            return
+        self.shown_v = v
+        s = self.cur_format.format(v)
+        if s == self.shown_s:
+            return
+        self.shown_s = s
+        if self.readout is None:
+            self.value.set(s)
+        else:
+            self.readout.set_text(self.row, s)
+
+    # The title turns blue while the row shows a distance to go
+    def set_to_go(self, to_go):
+        if to_go == self.shown_to_go:
+            return
+        self.shown_to_go = to_go
+        self.title.config(fg="blue" if to_go else self.title_fg)
+
+    # The value turns yellow near the target and green on it
+    def set_zone(self, zone):
+        if zone == self.shown_zone:
+            return
+        self.shown_zone = zone
+        if self.readout is None:
+            self.vlabel.config(bg=self.zone_colors.get(zone, self.value_bg))
+        else:
+            self.readout.set_bg(self.row, self.zone_colors.get(zone))
+
+    # v is in display units per minute
+    def set_velocity(self, v):
+        if self.vel is None:
+            return
+        s = self.vel_format.format(v)
+        if s == self.shown_vel:
+            return
+        self.shown_vel = s
+        self.vel.config(text=s)
 
     def kp_entry(self, key):
         if key == 'E':
             self.enter_hit()
             return
+        if key == 'T':
+            self.target_hit()
+            return
         if key == 'C':
             self.entry.delete(0, tk.END)
             return
@@ -152,22 +1727,37 @@ class axis_row_gui():
         self.entry.insert(tk.END, key)
 
     def disable_entry(self):
+        if self.entry_state == tk.DISABLED:
+            return
+        self.entry_state = tk.DISABLED
         self.entry.config(state=tk.DISABLED)
 
     def enable_entry(self):
+        if self.entry_state == tk.NORMAL:
+            return
+        self.entry_state = tk.NORMAL
         self.entry.config(state=tk.NORMAL)
 
     def disable_index(self):
+        if self.index_state == tk.DISABLED:
+            return
+        self.index_state = tk.DISABLED
         self.index.config(state=tk.DISABLED)
 
     def enable_index(self):
+        if self.index_state == tk.NORMAL:
+            return
+        self.index_state = tk.NORMAL
         self.index.config(state=tk.NORMAL)
 
     def update_units(self, units):
         if units == "inch":
             self.cur_format = params["inch_format"]
+            self.vel_format = params["inch_vel_format"]
         else:
             self.cur_format = params["mm_format"]
+            self.vel_format = params["mm_vel_format"]
+        self.shown_v = None
 
 # The keypad
 class keypad_gui():
@@ -178,7 +1768,8 @@ class keypad_gui():
                 (('4','4'),('5','5'),('6','6')),
                 (('1','1'),('2','2'),('3','3')),
                 (('0','0'),('.','.'),('-','-')),
-                (('C','C'),('\u232B','<'),('\u23CE','E')))
+                (('C','C'),('\u232B','<'),('\u23CE','E')),
+                (('T','T'),))
         px = 5
         for row, values in enumerate(rows):
             for col, e in enumerate(values):
@@ -195,43 +1786,298 @@ class keypad_gui():
         self.callback(key)
         self.kp_var.set("")
 
+# A Linuxcnc parameter (.var) file, read once into a flat array indexed
+# by parameter number. Comments, blank lines and lines that don't parse
+# are skipped. present[n] is 1 for parameters that were in the file.
+class var_file():
+    max_params = 5602
+    g92_enable = 5210
+    g92_base = 5211
+    g5x_index = 5220
+    g5x_base = 5221
+    g5x_stride = 20
+    tool_base = 5401
+
+    def __init__(self, name):
+        self.name = name
+        self.values = array('d', [0.0]) * var_file.max_params
+        self.present = bytearray(var_file.max_params)
+        self.skipped = 0
+        self.mtime = os.path.getmtime(name)
+        with open(name, 'r') as f:
+            text = f.read()
+        for line_no, line in enumerate(text.splitlines(), 1):
+            fields = line.split()
+            if len(fields) == 0 or fields[0][0] in "#;(":
+                continue
+            try:
+                idx = int(fields[0])
+                v = float(fields[1])
+                if idx < 1 or idx >= var_file.max_params:
+                    raise ValueError
+            except (ValueError, IndexError):
+                self.skipped += 1
+                if params["verbose"]:
+                    print(prog + ":", name, "line", line_no, "skipped:", line.strip())
+                continue
+            self.values[idx] = v
+            self.present[idx] = 1
+
+    def get(self, idx, default=0.0):
+        if 0 < idx < var_file.max_params and self.present[idx]:
+            return self.values[idx]
+        return default
+
+    def has(self, idx):
+        return 0 < idx < var_file.max_params and self.present[idx] != 0
+
+    # True if this file has every parameter from lo up to hi that old has.
+    # A file read while Linuxcnc was still writing it is missing the ones
+    # past the cut.
+    def covers(self, old, lo=5200, hi=5400):
+        for idx in range(lo, hi):
+            if old.present[idx] and not self.present[idx]:
+                return False
+        return True
+
+    # Nine values, one for each of XYZABCUVW
+    def get_axes(self, base):
+        return list(self.values[base:base + 9])
+
+    # n is 1 for G54 ... 9 for G59.3
+    def get_g5x(self, n):
+        return self.get_axes(var_file.g5x_base + (n - 1) * var_file.g5x_stride)
+
+    # All zero unless G92 offsets are turned on
+    def get_g92(self):
+        if self.get(var_file.g92_enable) == 0.0:
+            return [0.0] * 9
+        return self.get_axes(var_file.g92_base)
+
+    def get_tool_offset(self):
+        return self.get_axes(var_file.tool_base)
+
+    def get_g5x_index(self):
+        return int(self.get(var_file.g5x_index, 1.0))
+
+# Parses the var file again when Linuxcnc rewrites it. Linuxcnc renames a
+# new file over the old one so inotify watches the directory; without
+# inotify the mtime and size are checked every var_poll_ms, and the file
+# is only parsed once they have stayed the same for two checks. A new file
+# missing any of the 52xx parameters the old one had is taken to be half
+# written and dropped. A good one is published in latest and picked up by
+# the engine's poll.
+class var_watcher(threading.Thread):
+    IN_CLOSE_WRITE = 0x08
+    IN_MOVED_TO = 0x80
+
+    def __init__(self, path, vf):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.latest = vf
+        self.stamp = self.file_stamp()
+        self.pending = None
+        self.wake = None
+        self.running = True
+        self.fd = self.inotify_watch()
+
+    def file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    # Returns an inotify fd watching the file's directory, None if there
+    # is no inotify
+    def inotify_watch(self):
+        fd = -1
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init()
+            if fd < 0:
+                return None
+            d = os.path.dirname(os.path.abspath(self.path)).encode()
+            mask = var_watcher.IN_CLOSE_WRITE | var_watcher.IN_MOVED_TO
+            if libc.inotify_add_watch(fd, d, mask) < 0:
+                os.close(fd)
+                return None
+        except Exception:
+            if fd >= 0:
+                os.close(fd)
+            return None
+        if params["verbose"]:
+            print(prog + ": watching", self.path, "with inotify")
+        return fd
+
+    def run(self):
+        period = params["var_poll_ms"] / 1000.0
+        while self.running:
+            if self.fd is None:
+                time.sleep(period)
+            else:
+                # The timeout only matters for stop()
+                try:
+                    r, w, x = select.select([self.fd], [], [], 1.0)
+                    if len(r) == 0:
+                        continue
+                    os.read(self.fd, 4096)
+                except (select.error, OSError) as e:
+                    print(prog + ": inotify failed, polling", self.path, e)
+                    self.close()
+                    continue
+            self.check()
+
+    def close(self):
+        if not self.fd is None:
+            os.close(self.fd)
+            self.fd = None
+
+    def check(self):
+        stamp = self.file_stamp()
+        if stamp is None or stamp == self.stamp:
+            return
+        if self.fd is None and stamp != self.pending:
+            self.pending = stamp
+            return
+        try:
+            vf = var_file(self.path)
+        except (IOError, OSError, UnicodeDecodeError) as e:
+            if params["verbose"]:
+                print(prog + ": reload of", self.path, "failed:", e)
+            return
+        self.stamp = stamp
+        if not vf.covers(self.latest):
+            if params["verbose"]:
+                print(prog + ":", self.path, "is incomplete, keeping the old one")
+            return
+        if params["verbose"]:
+            print(prog + ": reloaded", self.path)
+        self.latest = vf
+        if not self.wake is None:
+            self.wake()
+
+    # Waits for run to see running go False so the fd isn't closed under
+    # its select
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join()
+        self.close()
+
+# Keeps the coordinate systems across restarts. save() only hands the
+# state to a thread that writes it once no save has come in for delay
+# seconds, so a burst of keypad entries is one write. The new file is
+# synced before it is renamed over the old one, a crash leaves one or
+# the other.
+class state_file(threading.Thread):
+    delay = 0.5
+
+    def __init__(self, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.pending = None
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.running = True
+
+    # Returns the saved state and when it was written, None if there isn't one
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            return state, os.path.getmtime(self.path)
+        except (IOError, OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                print(prog + ": Could not read", self.path, e)
+            return None, 0.0
+
+    def save(self, state):
+        with self.lock:
+            self.pending = state
+        self.event.set()
+
+    def run(self):
+        while self.running:
+            self.event.wait()
+            self.event.clear()
+            while self.running and self.event.wait(state_file.delay):
+                self.event.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            state = self.pending
+            self.pending = None
+        if state is None:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except (IOError, OSError) as e:
+            print(prog + ": Could not save", self.path, e)
+            return
+        log.event("state_saved", path=self.path)
+
+    # Writes anything still pending
+    def stop(self):
+        self.running = False
+        self.event.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+
+# The coordinate system offsets in pin units, one flat array with naxes
+# values per system. Only the display converts to other units so toggling
+# them never touches the offsets. System 0 is the machine coordinate
+# system and is always zero.
 class coord_systems():
-    def __init__(self, frame, callback):
-        self.callback = callback
-        self.rb_var = tk.IntVar()
-        self.rb_var.set(1)
+    g5x_names = ['G54', 'G55', 'G56', 'G57', 'G58', 'G59', 'G59.1', 'G59.2', 'G59.3']
+
+    def __init__(self):
         if not params["preload"] is None:
-            self.coord_sys = ['MCS', 'G54', 'G55', 'G56', 'G57']
+            self.coord_sys = ['MCS'] + coord_systems.g5x_names[:params["num_cs"]]
         else:
-            self.coord_sys = ['MCS', 'CS1', 'CS2', 'CS3', 'CS4']
-        self.coords = []
-        for i in range(len(self.coord_sys)):
-            self.coords.append([0.0]*params["naxes"])
+            self.coord_sys = ['MCS'] + ['CS' + str(i + 1) for i in range(params["num_cs"])]
+        self.naxes = params["naxes"]
+        self.offsets = array('d', [0.0]) * (len(self.coord_sys) * self.naxes)
+        self.vf = None
         if not params["preload"] is None:
             self.preload_cs()
-        self.cur_idx = 1
-        self.cur_sys = self.coords[self.cur_idx]
-        for row, cs in enumerate(self.coord_sys):
-            rb = tk.Radiobutton(frame, text=cs, variable=self.rb_var, value=row, width=6,
-                     indicatoron=0, command=lambda: self.rb_hit(),
-                     font=params["font1"])
-            rb.grid(row=row, column=0, columnspan=1, padx=5)
-        self.last_units_factor = 1.0
+        self.select(1)
 
-    def rb_hit(self):
-        self.cur_idx = self.rb_var.get()
-        if params["verbose"]:
-            print("rb_hit", self.coord_sys[self.cur_idx])
-        self.cur_sys = self.coords[self.cur_idx]
-        self.callback(self.cur_idx)
+    def select(self, idx):
+        self.cur_idx = idx
+        self.base = idx * self.naxes
+
+    # Offsets of system i as a list
+    def get_system(self, i):
+        return list(self.offsets[i * self.naxes:(i + 1) * self.naxes])
+
+    def set_system(self, i, values):
+        self.offsets[i * self.naxes:(i + 1) * self.naxes] = array('d', values)
+
+    # Offset of axis j in the current system
+    def get(self, j):
+        return self.offsets[self.base + j]
 
-    def update_units(self, units_factor):
-        for i in range(len(self.coords)):
-            for j in range(len(self.coords[i])):
-                self.coords[i][j] /= self.last_units_factor
-                self.coords[i][j] *= units_factor
-        self.last_units_factor = units_factor
+    def set(self, j, v):
+        self.offsets[self.base + j] = v
 
+    # The offsets are G5x plus G92, the way Linuxcnc adds them up
     def preload_cs(self):
         valid_axes = list("XYZABCUVW")
         for a in params["axes"]:
@@ -239,57 +2085,467 @@ class coord_systems():
                 print('mdro: Axes must be one of "XYZABCUVW"')
                 exit(1)
         if not os.path.isfile(params["preload"]):
-            print("mdro: Could not find", params["preload"])
+            print(prog + ": Could not find", params["preload"])
             exit(1)
-        number_to_load = (len(self.coord_sys) - 1)*20
-        max_idx = 5221 + number_to_load
-        self.vc = [0.0] * number_to_load
-        with open(params["preload"], 'r') as f:
-            for line in f:
-                line = line.strip()
-                fields = line.split()
-                try:
-                    idx = int(fields[0])
-                    v = float(fields[1])
-                except:
-                    print("mdro: Invalid parameter file:", var_file)
-                    exit(1)
-                if idx >= max_idx:
-                    break
-                if idx >= 5221:
-                    self.vc[idx - 5221] = v
-        axis_idx = {}
-        for i, a in enumerate(valid_axes):
-            axis_idx[a] = i
-            axis_idx[a.lower()] = i
+        try:
+            self.vf = var_file(params["preload"])
+        except (IOError, OSError, UnicodeDecodeError) as e:
+            print(prog + ": Invalid parameter file:", params["preload"], e)
+            exit(1)
+        if self.vf.skipped > 0:
+            print(prog + ":", self.vf.skipped, "lines skipped in", params["preload"])
+        axis_idx = [valid_axes.index(a.upper()) for a in params["axes"]]
+        self.axis_idx = axis_idx
         for i in range(1, len(self.coord_sys)):
-            for j, a in enumerate(params["axes"]):
-                self.coords[i][j] = -(self.vc[(i - 1) * 20 + axis_idx[a]])
+            self.set_system(i, self.file_offsets(self.vf, i))
 
-class main_gui():
+    # Offsets of coordinate system i in vf
+    def file_offsets(self, vf, i):
+        g5x = vf.get_g5x(i)
+        g92 = vf.get_g92()
+        return [-(g5x[k] + g92[k]) for k in self.axis_idx]
+
+    # Takes the offsets from a newer copy of the var file. Only the
+    # systems that changed in the file are replaced so values set from
+    # the keypad in the others are kept. The new offsets are swapped in
+    # as a whole.
+    def reload(self, vf):
+        offsets = array('d', self.offsets)
+        n = self.naxes
+        for i in range(1, len(self.coord_sys)):
+            new = self.file_offsets(vf, i)
+            if new != self.file_offsets(self.vf, i):
+                offsets[i * n:(i + 1) * n] = array('d', new)
+                if params["verbose"]:
+                    print(prog + ": new offsets for", self.coord_sys[i], new)
+        self.vf = vf
+        self.offsets = offsets
+
+    def get_state(self):
+        coords = [self.get_system(i) for i in range(len(self.coord_sys))]
+        return {"axes": "".join(params["axes"]), "names": self.coord_sys,
+                "cur_idx": self.cur_idx, "coords": coords}
+
+    # Puts back the offsets from get_state. Systems loaded from the var file
+    # only take the saved values if they were saved after the file changed.
+    def restore(self, state, mtime):
+        if state is None:
+            return
+        try:
+            if state["axes"] != "".join(params["axes"]):
+                print(prog + ": saved state is for axes", state["axes"], "ignored")
+                return
+            saved = state["coords"]
+            newer = self.vf is None or mtime > self.vf.mtime
+            for i in range(1, min(len(saved), len(self.coord_sys))):
+                cs = [float(v) for v in saved[i]]
+                if newer and len(cs) == self.naxes:
+                    self.set_system(i, cs)
+            cur_idx = int(state["cur_idx"])
+            if 0 <= cur_idx < len(self.coord_sys):
+                self.select(cur_idx)
+        except (KeyError, TypeError, ValueError) as e:
+            print(prog + ": saved state ignored:", e)
+            return
+        if params["verbose"]:
+            print(prog + ": restored", self.coord_sys[self.cur_idx], list(self.offsets))
+
+# Arms the probe and shows the last edge it found, with buttons that make
+# that edge or the center between two edges zero
+class probe_gui():
+    def __init__(self, frame, arm_callback, zero_callback, center_callback):
+        px = 5
+        self.arm = tk.Button(frame, width=6, text="Probe", font=params["font2"],
+                             command=arm_callback)
+        self.arm.grid(row=0, column=0, padx=px)
+        self.edge = tk.Label(frame, width=14, text="", font=params["font2"])
+        self.edge.grid(row=0, column=1, padx=px)
+        self.zero = tk.Button(frame, width=6, text="Edge 0", font=params["font2"],
+                              command=zero_callback)
+        self.zero.grid(row=0, column=2, padx=px)
+        self.center = tk.Button(frame, width=6, text="Center", font=params["font2"],
+                                command=center_callback)
+        self.center.grid(row=0, column=3, padx=px)
+        self.shown_armed = None
+        self.shown_edge = None
+
+    # edge is None or the axis and the value to show
+    def set_probe(self, armed, edge, fmt):
+        if armed != self.shown_armed:
+            self.shown_armed = armed
+            self.arm.config(bg="yellow" if armed else "light gray")
+        s = ""
+        if not edge is None:
+            s = params["axes"][edge[0]] + " " + fmt.format(edge[1])
+        if s != self.shown_edge:
+            self.shown_edge = s
+            self.edge.config(text=s)
+
+# Hole pattern entry and stepping. The spec is typed in the entry, see
+# hole_pattern for the format.
+class pattern_gui():
+    def __init__(self, frame, engine):
+        px = 5
+        self.engine = engine
+        self.spec = tk.Entry(frame, width=24, font=params["font2"])
+        self.spec.bind("<Return>", lambda event: self.set_hit())
+        self.spec.grid(row=0, column=0, padx=px)
+        self.set = tk.Button(frame, width=4, text="Set", font=params["font2"],
+                             command=self.set_hit)
+        self.set.grid(row=0, column=1, padx=px)
+        self.prev = tk.Button(frame, width=2, text="<", font=params["font2"],
+                              command=lambda: engine.step_hole(-1))
+        self.prev.grid(row=0, column=2, padx=px)
+        self.hole = tk.Label(frame, width=7, text="", font=params["font2"])
+        self.hole.grid(row=0, column=3, padx=px)
+        self.next = tk.Button(frame, width=2, text=">", font=params["font2"],
+                              command=lambda: engine.step_hole(1))
+        self.next.grid(row=0, column=4, padx=px)
+        self.clear = tk.Button(frame, width=4, text="Clear", font=params["font2"],
+                               command=engine.clear_pattern)
+        self.clear.grid(row=0, column=5, padx=px)
+        self.shown_hole = None
+
+    def set_hit(self):
+        if params["verbose"]:
+            print("pattern set_hit", self.spec.get())
+        if not self.engine.set_pattern(self.spec.get()):
+            print('\a')
+
+    def set_hole(self, hole):
+        if hole == self.shown_hole:
+            return
+        self.shown_hole = hole
+        s = ""
+        if not hole is None:
+            s = "{}/{}".format(hole[0], hole[1])
+        self.hole.config(text=s)
+
+# The coordinate system radio buttons
+class coord_systems_gui():
+    def __init__(self, frame, names, cur_idx, callback):
+        self.callback = callback
+        self.coord_sys = names
+        self.rb_var = tk.IntVar()
+        self.rb_var.set(cur_idx)
+        for row, cs in enumerate(self.coord_sys):
+            rb = tk.Radiobutton(frame, text=cs, variable=self.rb_var, value=row, width=6,
+                     indicatoron=0, command=lambda: self.rb_hit(),
+                     font=params["font1"])
+            rb.grid(row=row, column=0, columnspan=1, padx=5)
+
+    def rb_hit(self):
+        cur_idx = self.rb_var.get()
+        if params["verbose"]:
+            print("rb_hit", self.coord_sys[cur_idx])
+        self.callback(cur_idx)
+
+# Everything mdro does that doesn't need a screen: the offsets, the units
+# and the values to show. Front ends read the results through it and hand
+# it the operator's actions.
+class dro_engine():
     def __init__(self, lcnc):
         self.lcnc = lcnc
+        self.coords = coord_systems()
+        self.mm_adj = [1.0, 1.0/25.4, 25.4, 1.0]
+        self.units_factor = 1.0
+        self.disp_mm = params["mm"]
+        self.positions = [0.0] * params["naxes"]
+        self.display = self.positions
+        self.last_seq = None
+        self.posted = deque()
+        self.captures = []
+        self.pattern = None
+        self.pattern_factor = 1.0
+        self.hole = 0
+        self.targets = [None] * params["naxes"]
+        self.zones = [None] * params["naxes"]
+        self.arrivals = 0
+        self.watcher = None
+        if not params["preload"] is None and params["var_poll_ms"] > 0:
+            self.watcher = var_watcher(params["preload"], self.coords.vf)
+            self.watcher.start()
+        self.state = None
+        if not params["state_file"] is None:
+            self.state = state_file(params["state_file"])
+            state, mtime = self.state.load()
+            self.coords.restore(state, mtime)
+            self.state.start()
+
+    def stop(self):
+        if not self.watcher is None:
+            self.watcher.stop()
+        if not self.state is None:
+            self.state.stop()
+        self.lcnc.stop()
+
+    def save_state(self):
+        if not self.state is None:
+            self.state.save(self.coords.get_state())
+
+    # Queues an action from another thread, the next poll runs it
+    def post(self, name, args):
+        self.posted.append((name, args))
+
+    # Works out the displayed values and publishes them. Returns True if
+    # anything changed since the last poll.
+    def poll(self):
+        while len(self.posted) > 0:
+            name, args = self.posted.popleft()
+            getattr(self, name)(*args)
+        if not self.watcher is None and not self.watcher.latest is self.coords.vf:
+            self.coords.reload(self.watcher.latest)
+            log.event("var_reload", path=params["preload"])
+            self.save_state()
+            self.redraw()
+        self.lcnc.poll()
+        # The last two captures are kept for probe_center
+        armed, capture = self.lcnc.get_probe()
+        if not capture is None and (len(self.captures) == 0 or not self.captures[-1] is capture):
+            self.captures = (self.captures + [capture])[-2:]
+        seq = self.lcnc.get_seq()
+        if seq == self.last_seq:
+            return False
+        self.last_seq = seq
+        pins = self.lcnc.get_pins()
+        # One pass from pin units to display units
+        f = self.units_factor
+        off = self.coords.offsets
+        base = self.coords.base
+        positions = [(pins[i] + off[base + i]) * f for i in range(len(pins))]
+        self.positions = positions
+        self.update_targets(positions)
+        self.lcnc.set_outputs(positions, self.coords.cur_idx, self.disp_mm != 0)
+        return True
+
+    # Rows with a target show the distance to go. Targets are in pin units
+    # from the origin of the current system. The zones are None without a
+    # target, then "far", "near" and "on", with the limits in scale units.
+    def update_targets(self, positions):
+        f = self.units_factor
+        targets = self.targets
+        self.display = [p if t is None else p - t * f for p, t in zip(positions, targets)]
+        zones = [None] * len(positions)
+        arrived = False
+        for i in range(len(positions)):
+            if targets[i] is None:
+                continue
+            d = abs(self.display[i]) / f
+            if d <= params["tolerance"]:
+                zones[i] = "on"
+                arrived = arrived or self.zones[i] != "on"
+            elif d <= params["approach"]:
+                zones[i] = "near"
+            else:
+                zones[i] = "far"
+        if arrived:
+            self.arrivals += 1
+        self.zones = zones
+
+    # Offsets or units changed, report a change on the next poll
+    def redraw(self):
+        self.last_seq = None
+
+    def get_positions(self):
+        return self.positions
+
+    # What the rows show: the distance to go on axes with a target, the
+    # position on the others
+    def get_display(self):
+        return self.display
+
+    def get_targets(self):
+        return self.targets
+
+    # The approach zone of each axis and a count that goes up each time
+    # an axis reaches its target
+    def get_zones(self):
+        return self.zones, self.arrivals
+
+    # Sets the displayed value an axis is heading for in the current
+    # system, None clears it
+    def set_target(self, row, value):
+        if value is None:
+            self.targets[row] = None
+        else:
+            self.targets[row] = value / self.units_factor
+        log.event("target", axis=row, value=value)
+        self.redraw()
+
+    def index_ready(self, row):
+        return self.lcnc.index_ready(row)
+
+    # Display units per minute
+    def get_velocities(self):
+        vel, feed = self.lcnc.get_velocities()
+        per_min = 60.0 * self.units_factor
+        return [v * per_min for v in vel], feed * per_min
+
+    def get_cs_names(self):
+        return self.coords.coord_sys
+
+    def get_cs_index(self):
+        return self.coords.cur_idx
+
+    def select_cs(self, idx):
+        self.coords.select(idx)
+        log.event("cs", index=idx)
+        self.save_state()
+        self.redraw()
+
+    # mm is 0 for inch, 1 for mm
+    def set_units(self, mm):
+        self.disp_mm = mm
+        self.units_factor = self.mm_adj[params["mm"] + 2 * mm]
+        log.event("units", mm=mm)
+        self.redraw()
+
+    # Makes the current value of an axis read value. The mcs can't be
+    # changed, returns False in that case.
+    def set_value(self, row, value):
+        if self.coords.cur_idx == 0:
+            return False
+        self.lcnc.poll()
+        pins = self.lcnc.get_pins()
+        self.coords.set(row, value / self.units_factor - pins[row])
+        log.event("offset", cs=self.coords.cur_idx, axis=row, offset=self.coords.get(row))
+        self.save_state()
+        self.redraw()
+        return True
+
+    def zero(self, row):
+        return self.set_value(row, 0.0)
+
+    def half(self, row):
+        return self.set_value(row, self.positions[row] / 2.0)
+
+    # Arms the probe, the next touch is latched. Arming again disarms it.
+    def arm_probe(self):
+        armed, capture = self.lcnc.get_probe()
+        self.lcnc.arm_probe(not armed)
+        self.redraw()
+
+    # Whether the probe is armed, and the axis and displayed value of the
+    # last edge found or None
+    def get_probe(self):
+        armed, c = self.lcnc.get_probe()
+        if c is None or c.axis is None:
+            return armed, None
+        v = (c.edge[c.axis] + self.coords.get(c.axis)) * self.units_factor
+        return armed, (c.axis, v)
+
+    # Makes pin value p read zero on an axis. The mcs can't be changed.
+    def set_zero_at(self, axis, p):
+        if self.coords.cur_idx == 0:
+            return False
+        self.coords.set(axis, -p)
+        log.event("offset", cs=self.coords.cur_idx, axis=axis, offset=-p)
+        self.save_state()
+        self.redraw()
+        return True
+
+    # Makes the last edge found zero on the axis it was moving
+    def probe_zero(self):
+        armed, c = self.lcnc.get_probe()
+        if c is None or c.axis is None:
+            return False
+        return self.set_zero_at(c.axis, c.edge[c.axis])
+
+    # Makes the point halfway between the last two edges zero. They have
+    # to be on the same axis, approached from opposite sides.
+    def probe_center(self):
+        if len(self.captures) < 2:
+            return False
+        a, b = self.captures
+        if a.axis is None or a.axis != b.axis or a.dir[a.axis] * b.dir[b.axis] >= 0.0:
+            if params["verbose"]:
+                print("probe_center: need edges on both sides of one axis")
+            return False
+        return self.set_zero_at(a.axis, (a.edge[a.axis] + b.edge[b.axis]) / 2.0)
+
+    # Lays out a hole pattern in the current display units and makes the
+    # first hole the target. The holes are relative to the origin of
+    # whichever coordinate system is selected. Returns False if the spec
+    # doesn't parse.
+    def set_pattern(self, spec):
+        if len(pattern_axes()) < 2:
+            return False
+        try:
+            self.pattern = hole_pattern(spec)
+        except ValueError as e:
+            if params["verbose"]:
+                print("set_pattern:", e)
+            return False
+        self.pattern_factor = self.units_factor
+        self.hole = 0
+        log.event("pattern", spec=spec, holes=self.pattern.n)
+        self.show_hole()
+        return True
+
+    def clear_pattern(self):
+        if self.pattern is None:
+            return
+        self.pattern = None
+        self.hole = 0
+        for i in pattern_axes():
+            self.targets[i] = None
+        self.redraw()
+
+    # Steps to the next (1) or previous (-1) hole
+    def step_hole(self, step):
+        if self.pattern is None:
+            return
+        self.hole = (self.hole + step) % self.pattern.n
+        self.show_hole()
+
+    def show_hole(self):
+        x, y = self.pattern.point(self.hole)
+        ax, ay = pattern_axes()
+        self.targets[ax] = x / self.pattern_factor
+        self.targets[ay] = y / self.pattern_factor
+        self.redraw()
+
+    # The current hole counting from 1 and the number of holes, None if
+    # there's no pattern
+    def get_hole(self):
+        if self.pattern is None:
+            return None
+        return self.hole + 1, self.pattern.n
+
+    # Starts an index sequence, False if one is already running
+    def index(self, row):
+        self.lcnc.poll()
+        if not self.lcnc.index_ready(row):
+            return False
+        self.lcnc.set_index_enable(row)
+        log.event("index", axis=row)
+        return True
+
+class main_gui():
+    def __init__(self, engine):
+        self.engine = engine
 
         px = 5
         py = 15
 
-        root.title("mdro")
+        root.title(prog)
         self.dro_frame = tk.Frame(root)
         self.axis_row = dict()
         self.last_row = None
         self.disp_inch = tk.IntVar()
-        if params["mm"]:
-            self.disp_inch.set(2)
-        else:
-            self.disp_inch.set(0)
-        self.mm_adj = [1.0, 1.0/25.4, 25.4, 1.0]
-        self.units_factor = 1.0
+        self.disp_inch.set(2 * engine.disp_mm)
+        self.shown_arrivals = 0
 
+        self.readout = None
+        if params["canvas"]:
+            self.readout = readout_canvas(self.dro_frame, params["naxes"], 11)
+            self.readout.canvas.grid(row=0, column=1, rowspan=params["naxes"], sticky=tk.NW)
         for row, name in enumerate(params["axes"]):
             self.axis_row[row] = axis_row_gui(self.dro_frame, row, name,
                                               self.entry_callback,
-                                              self.index_callback)
-            self.axis_row[row].enable_entry()
+                                              self.index_callback,
+                                              self.target_callback,
+                                              self.readout)
         self.dro_frame.grid(row=0, column=0, columnspan=2, padx=px, pady=py, sticky=tk.NW)
 
         self.keypad_frame = tk.Frame(root)
@@ -297,8 +2553,10 @@ class main_gui():
         self.keypad_frame.grid(row=1, column=0, padx=px, pady=py, sticky=tk.NW)
 
         self.coord_frame = tk.Frame(root)
-        self.coords = coord_systems(self.coord_frame, self.coord_callback)
+        self.coords = coord_systems_gui(self.coord_frame, engine.get_cs_names(),
+                                        engine.get_cs_index(), self.coord_callback)
         self.coord_frame.grid(row=1, column=1, padx=px, pady=py, sticky=tk.N)
+        self.show_cs(engine.get_cs_index())
 
         self.inch_frame = tk.Frame(root)
         self.inches = tk.Radiobutton(self.inch_frame, text="inch",
@@ -311,17 +2569,40 @@ class main_gui():
                                      command=lambda: self.units_hit(),
                                      font=params["font1"])
         self.inches.grid(row=0, column=1)
+        self.feed = None
+        self.shown_feed = None
+        if params["velocity"]:
+            self.feed = tk.Label(self.inch_frame, width=10, justify=tk.RIGHT, anchor=tk.E,
+                                 text="", font=params["font1"])
+            self.feed.grid(row=0, column=2, padx=px)
         self.inch_frame.grid(row=2, column=0, padx=px, pady=py, sticky=tk.NW)
 
+        self.probe = None
+        if params["probe"]:
+            self.probe_frame = tk.Frame(root)
+            self.probe = probe_gui(self.probe_frame, engine.arm_probe,
+                                   engine.probe_zero, engine.probe_center)
+            self.probe_frame.grid(row=3, column=0, columnspan=2, padx=px, pady=py, sticky=tk.NW)
+
+        self.pattern = None
+        if params["pattern"]:
+            self.pattern_frame = tk.Frame(root)
+            self.pattern = pattern_gui(self.pattern_frame, engine)
+            self.pattern_frame.grid(row=4, column=0, columnspan=2, padx=px, pady=py, sticky=tk.NW)
+
+        # The canvas rows follow the heights the other columns gave the grid
+        if not self.readout is None:
+            root.update_idletasks()
+            self.readout.align(self.dro_frame, 1)
+
     def units_hit(self):
         if params["verbose"]:
             print("units_hit", self.disp_inch.get())
-        self.units_factor = self.mm_adj[params["mm"] + self.disp_inch.get()]
-        self.coords.update_units(self.units_factor)
         if self.disp_inch.get() == 0:
             new_units = "inch"
         else:
             new_units = "mm"
+        self.engine.set_units(int(self.disp_inch.get() != 0))
         for i in range(params["naxes"]):
             self.axis_row[i].update_units(new_units)
 
@@ -336,12 +2617,15 @@ class main_gui():
             self.last_row = row
             return
         # Enter
-        self.lcnc.poll()
-        pins = self.lcnc.get_pins()
-        # Can't change the mcs entry
-        if self.coords.cur_idx != 0:
-            pin = pins[row] * self.units_factor
-            self.coords.cur_sys[row] = value - pin
+        self.engine.set_value(row, value)
+        if not self.last_row is None:
+            self.axis_row[self.last_row].entry.config(bg='light gray')
+        self.last_row = None
+
+    def target_callback(self, row, value):
+        if params["verbose"]:
+            print("Target callback", row, value)
+        self.engine.set_target(row, value)
         if not self.last_row is None:
             self.axis_row[self.last_row].entry.config(bg='light gray')
         self.last_row = None
@@ -349,11 +2633,16 @@ class main_gui():
     def coord_callback(self, coord_sys_idx):
         if params["verbose"]:
             print("coord_callback", coord_sys_idx)
-        if coord_sys_idx == 0:
-            for row in range(params["naxes"]):
+        self.engine.select_cs(coord_sys_idx)
+
+    # The coordinate system can also be switched from a network display
+    def show_cs(self, cs):
+        self.shown_cs = cs
+        self.coords.rb_var.set(cs)
+        for row in range(params["naxes"]):
+            if cs == 0:
                 self.axis_row[row].disable_entry()
-        else:
-            for row in range(params["naxes"]):
+            else:
                 self.axis_row[row].enable_entry()
 
     def keypad_callback(self, key):
@@ -366,23 +2655,56 @@ class main_gui():
     def index_callback(self, row):
         if params["verbose"]:
             print("main_index_callback", row)
-        self.lcnc.poll()
-        if self.lcnc.index_ready(row):
-            self.lcnc.set_index_enable(row)
-        else:
+        if not self.engine.index(row):
             if params["verbose"]:
                 print("index seq not ready", row)
 
+    # Returns True if any pin moved since the last poll
     def poll(self):
-        self.lcnc.poll()
-        pins = self.lcnc.get_pins()
-        for i in range(len(pins)):
-            pin = pins[i] * self.units_factor
-            self.axis_row[i].set_value(pin + self.coords.cur_sys[i])
-            if self.lcnc.index_ready(i):
+        engine = self.engine
+        if not engine.poll():
+            return False
+        if engine.get_cs_index() != self.shown_cs:
+            self.show_cs(engine.get_cs_index())
+        positions = engine.get_positions()
+        shown = engine.get_display()
+        targets = engine.get_targets()
+        zones, arrivals = engine.get_zones()
+        for i in range(len(positions)):
+            self.axis_row[i].set_value(shown[i], positions[i])
+            self.axis_row[i].set_to_go(not targets[i] is None)
+            self.axis_row[i].set_zone(zones[i])
+            if engine.index_ready(i):
                 self.axis_row[i].enable_index()
             else:
                 self.axis_row[i].disable_index()
+        if params["velocity"]:
+            self.show_velocities()
+        if not self.probe is None:
+            armed, edge = engine.get_probe()
+            if self.disp_inch.get() == 0:
+                self.probe.set_probe(armed, edge, params["inch_format"])
+            else:
+                self.probe.set_probe(armed, edge, params["mm_format"])
+        if not self.pattern is None:
+            self.pattern.set_hole(engine.get_hole())
+        if arrivals != self.shown_arrivals:
+            self.shown_arrivals = arrivals
+            if params["beep"]:
+                root.bell()
+        return True
+
+    def show_velocities(self):
+        vel, feed = self.engine.get_velocities()
+        for i in range(len(vel)):
+            self.axis_row[i].set_velocity(vel[i])
+        if self.disp_inch.get() == 0:
+            s = params["inch_vel_format"].format(feed) + " ipm"
+        else:
+            s = params["mm_vel_format"].format(feed) + " mm/m"
+        if s != self.shown_feed:
+            self.shown_feed = s
+            self.feed.config(text=s)
 
 def run_postgui():
     # Run the postgui hal files if called from DISPLAY section of .ini file
@@ -404,11 +2726,6 @@ def run_postgui():
             print("Error processing halfile:", f, "mdro exiting")
             exit(1)
 
-def call_polls():
-    global gui
-    gui.poll()
-    root.after(100, call_polls);
-
 def get_params(args):
     params = dict()
     params["verbose"] = False
@@ -425,8 +2742,35 @@ def get_params(args):
     options = [
         ["GEOMETRY", args.axes, "axes"],
         ["MDRO_VAR_FILE", args.load_cs, "preload"],
+        ["NUM_CS", args.num_cs, "num_cs"],
+        ["VAR_POLL_MS", args.var_poll_ms, "var_poll_ms"],
+        ["MDRO_STATE_FILE", args.state, "state_file"],
         ["POINT_SIZE", args.point_size, "point_size"],
-        ["MM", args.mm, "mm"]
+        ["MM", args.mm, "mm"],
+        ["POLL_FAST_MS", args.fast_ms, "fast_ms"],
+        ["POLL_SLOW_MS", args.slow_ms, "slow_ms"],
+        ["POLL_BACKOFF", args.backoff, "backoff"],
+        ["SAMPLE_MS", args.sample_ms, "sample_ms"],
+        ["HISTORY_SIZE", args.history, "history"],
+        ["VELOCITY", args.velocity, "velocity"],
+        ["VEL_WINDOW_MS", args.vel_window, "vel_window"],
+        ["FILTER", args.filter, "filter"],
+        ["PROBE", args.probe, "probe"],
+        ["PROBE_RADIUS", args.probe_radius, "probe_radius"],
+        ["PROBE_MS", args.probe_ms, "probe_ms"],
+        ["APPROACH", args.approach, "approach"],
+        ["TOLERANCE", args.tolerance, "tolerance"],
+        ["BEEP", args.beep, "beep"],
+        ["PATTERN", args.pattern, "pattern"],
+        ["CANVAS", args.canvas, "canvas"],
+        ["NET", args.net, "net"],
+        ["NET_RATE", args.net_rate, "net_rate"],
+        ["NET_ACTIONS", args.net_actions, "net_actions"],
+        ["LOG", args.log, "log"],
+        ["LOG_SIZE", args.log_size, "log_size"],
+        ["METRICS", args.metrics, "metrics"],
+        ["RECORD", args.record, "record"],
+        ["RECORD_SIZE", args.record_size, "record_size"]
     ]
     if params["ini"] is None:
         for d, a, p in options:
@@ -452,14 +2796,153 @@ def get_params(args):
         params["point_size"] = int(params["point_size"])
     except:
         print("Point size must be an integer")
+
+    try:
+        params["fast_ms"] = int(params["fast_ms"])
+        params["slow_ms"] = max(int(params["slow_ms"]), params["fast_ms"])
+        params["backoff"] = max(float(params["backoff"]), 1.0)
+        params["sample_ms"] = max(int(params["sample_ms"]), 0)
+        params["history"] = max(int(params["history"]), 2)
+        params["vel_window"] = max(int(params["vel_window"]), 1) / 1000.0
+    except:
+        print("Poll and sample rates, history size and velocity window must be integers, backoff a number")
+        exit(1)
+
+    params["velocity"] = int(params["velocity"])
+
+    try:
+        params["num_cs"] = int(params["num_cs"])
+    except:
+        params["num_cs"] = 0
+    if params["num_cs"] < 1 or params["num_cs"] > 9:
+        print("The number of coordinate systems must be 1 to 9")
+        exit(1)
+
+    try:
+        params["var_poll_ms"] = max(int(params["var_poll_ms"]), 0)
+    except:
+        print("VAR_POLL_MS must be an integer")
+        exit(1)
+
+    try:
+        params["probe"] = int(params["probe"])
+        params["probe_radius"] = float(params["probe_radius"])
+        params["probe_ms"] = max(int(params["probe_ms"]), 0)
+    except:
+        print("PROBE and PROBE_MS must be integers, PROBE_RADIUS a number")
+        exit(1)
+
+    # The approach zones default to 0.1 inch and half a thou, or 2.5 and
+    # 0.01 mm with mm scales
+    try:
+        if params["approach"] is None:
+            params["approach"] = [0.1, 2.5][params["mm"]]
+        if params["tolerance"] is None:
+            params["tolerance"] = [0.0005, 0.01][params["mm"]]
+        params["approach"] = abs(float(params["approach"]))
+        params["tolerance"] = abs(float(params["tolerance"]))
+        params["beep"] = int(params["beep"])
+        params["pattern"] = int(params["pattern"])
+        params["canvas"] = int(params["canvas"])
+    except:
+        print("APPROACH and TOLERANCE must be numbers, BEEP, PATTERN and CANVAS integers")
+        exit(1)
+
+    try:
+        params["net_rate"] = max(int(params["net_rate"]), 1)
+        params["net_actions"] = int(params["net_actions"])
+    except:
+        print("NET_RATE and NET_ACTIONS must be integers")
+        exit(1)
+
+    try:
+        params["log_size"] = max(int(params["log_size"]), 1)
+        params["record_size"] = max(int(params["record_size"]), 1)
+    except:
+        print("LOG_SIZE and RECORD_SIZE must be integers")
+        exit(1)
+
+    # FILTER applies to every axis, FILTER_<axis> overrides it for one
+    params["filters"] = []
+    for a in params["axes"]:
+        spec = params["filter"]
+        if not params["ini"] is None:
+            spec = inifile.find("DISPLAY", "FILTER_" + a.upper()) or spec
+        try:
+            filter_chain(spec)
+        except:
+            print("Invalid filter for axis", a, ":", spec)
+            exit(1)
+        params["filters"].append(spec)
+
+    # Scale compensation for each axis. On the command line these are
+    # <axis>:<value> and can be repeated, SCALE_FACTOR_<axis>,
+    # ERROR_MAP_<axis> and BACKLASH_<axis> in the ini override them.
+    comp = dict()
+    for d, items in [["SCALE_FACTOR", args.scale_factor], ["ERROR_MAP", args.error_map],
+                     ["BACKLASH", args.backlash]]:
+        for item in items:
+            try:
+                axis, v = item.split(":", 1)
+            except ValueError:
+                print("Expected <axis>:<value>, got", item)
+                exit(1)
+            comp[(d, axis.upper())] = v
+        if not params["ini"] is None:
+            for a in params["axes"]:
+                dv = inifile.find("DISPLAY", d + "_" + a.upper())
+                if not dv is None:
+                    comp[(d, a.upper())] = dv
+    params["comps"] = []
+    for a in params["axes"]:
+        factor = comp.get(("SCALE_FACTOR", a.upper()))
+        name = comp.get(("ERROR_MAP", a.upper()))
+        backlash = comp.get(("BACKLASH", a.upper()))
+        if factor is None and name is None and backlash is None:
+            params["comps"].append(None)
+            continue
+        try:
+            factor = float(factor or 1.0)
+            backlash = abs(float(backlash or 0.0))
+            emap = None
+            if not name is None:
+                emap = error_map(name)
+        except (ValueError, IOError, OSError) as e:
+            print("Invalid compensation for axis", a, ":", e)
+            exit(1)
+        if params["verbose"]:
+            print("axis", a, "scale factor", factor, "backlash", backlash, "error map", name)
+            if not emap is None:
+                print(len(emap.at), "points,", emap.skipped, "lines skipped")
+        params["comps"].append((factor, emap, backlash))
+
     params["font1"] = ("Helvetica", params["point_size"])
     params["font2"] = ("Helvetica", int(params["point_size"] / 2))
     params["inch_format"] = "{:.4f}"
     params["mm_format"] = "{:.2f}"
+    # Half the last digit shown in either unit, in scale units
+    params["settle"] = [0.00005, 0.00005 * 25.4][params["mm"]]
+    params["inch_vel_format"] = "{:.1f}"
+    params["mm_vel_format"] = "{:.0f}"
+    params["headless"] = args.headless
+    params["serve"] = args.serve
+    params["attach"] = args.attach
+    if not args.serve is None and not args.attach is None:
+        print("Use --serve or --attach, not both")
+        exit(1)
+    # Only the serving mdro samples the probe pin
+    if params["probe"] and not args.attach is None:
+        print("PROBE and --probe can't be used with --attach, only on the --serve side")
+        exit(1)
+    params["replay"] = args.replay
+    params["replay_speed"] = max(args.replay_speed, 0.0)
+    if not args.replay is None and not args.attach is None:
+        print("Use --replay or --attach, not both")
+        exit(1)
 
     return params
 
-if __name__ == '__main__':
+def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--verbose', '-v', action='count', default=0,
                     help='print debug info')
@@ -469,19 +2952,158 @@ if __name__ == '__main__':
                     help='dro values in mm')
     parser.add_argument("--load_cs", "-l", type=str,
                     help="load g5x coordinate system")
+    parser.add_argument('--num_cs', dest='num_cs', type=int, default=4,
+                    help='number of coordinate systems, 1 to 9, default: 4')
+    parser.add_argument('--var_poll_ms', dest='var_poll_ms', type=int, default=1000,
+                    help='var file check period without inotify, 0 never reloads, default: 1000')
+    parser.add_argument("--state", type=str,
+                    help="keep the coordinate systems in this file across restarts")
     parser.add_argument("--ini", "-ini", type=str, help="ini file name")
+    parser.add_argument('--fast_ms', dest='fast_ms', type=int, default=20,
+                    help='poll period while values change, default: 20')
+    parser.add_argument('--slow_ms', dest='slow_ms', type=int, default=250,
+                    help='poll period when idle, default: 250')
+    parser.add_argument('--backoff', dest='backoff', type=float, default=1.25,
+                    help='poll period growth per idle poll, default: 1.25')
+    parser.add_argument('--sample_ms', dest='sample_ms', type=int, default=10,
+                    help='pin sample period, 0 samples from the gui, default: 10')
+    parser.add_argument('--history', dest='history', type=int, default=1000,
+                    help='samples of position history kept per axis, default: 1000')
+    parser.add_argument('--velocity', action='store_const', const=1, default=0,
+                    help='show axis velocities and feed rate')
+    parser.add_argument('--vel_window', dest='vel_window', type=int, default=100,
+                    help='milliseconds of history used for velocities, default: 100')
+    parser.add_argument('--filter', dest='filter', type=str, default="",
+                    help='display filters, example: "median:5 deadband:0.0002"')
+    parser.add_argument('--scale_factor', action='append', default=[],
+                    help='linear scale correction for an axis, example: X:1.0002')
+    parser.add_argument('--error_map', action='append', default=[],
+                    help='file of "reading correction" pairs for an axis, example: X:x.map')
+    parser.add_argument('--backlash', action='append', default=[],
+                    help='backlash of an axis in scale units, example: Y:0.003')
     parser.add_argument("axes", nargs='?', type=str, default='XYZ',
                     help="Axes (example: XYZ)")
+    parser.add_argument('--headless', action='store_true',
+                    help='run without a window, only the hal pins are updated')
+    parser.add_argument('--serve', type=str,
+                    help='share the hal pins on this unix socket')
+    parser.add_argument('--attach', type=str,
+                    help='read the hal pins from a --serve socket')
+    parser.add_argument('--probe', action='store_const', const=1, default=0,
+                    help='add a mdro.probe input pin and the probe buttons')
+    parser.add_argument('--probe_radius', dest='probe_radius', type=float, default=0.0,
+                    help='probe or edge finder radius in scale units, default: 0')
+    parser.add_argument('--probe_ms', dest='probe_ms', type=int, default=1,
+                    help='sample period while the probe is armed, default: 1')
+    parser.add_argument('--approach', type=float,
+                    help='distance to go in scale units shown yellow, default: 0.1 inch or 2.5 mm')
+    parser.add_argument('--tolerance', type=float,
+                    help='distance to go in scale units shown green, default: 0.0005 inch or 0.01 mm')
+    parser.add_argument('--beep', action='store_const', const=1, default=0,
+                    help='beep when an axis reaches its target')
+    parser.add_argument('--pattern', action='store_const', const=1, default=0,
+                    help='add the bolt circle, line and grid hole pattern row')
+    parser.add_argument('--canvas', action='store_const', const=1, default=0,
+                    help='draw the axis values on one canvas')
+    parser.add_argument('--net', type=str,
+                    help='stream the dro state to network displays on [host:]port')
+    parser.add_argument('--net_rate', dest='net_rate', type=int, default=20,
+                    help='most network updates per second per client, default: 20')
+    parser.add_argument('--net_actions', action='store_const', const=1, default=0,
+                    help='let network displays zero, halve and set axes and switch coordinate systems')
+    parser.add_argument('--net_client', type=str,
+                    help='run a test network display for the server on host:port')
+    parser.add_argument('--log', type=str,
+                    help='append events to this file as json lines')
+    parser.add_argument('--log_size', dest='log_size', type=int, default=1000,
+                    help='events kept in memory between writes, default: 1000')
+    parser.add_argument('--metrics', type=str,
+                    help='serve event counts and poll timing as prometheus text on [host:]port')
+    parser.add_argument('--record', type=str,
+                    help='record the scale and index pins to this file')
+    parser.add_argument('--record_size', dest='record_size', type=int, default=10240,
+                    help='kilobytes per record file before it is rotated, default: 10240')
+    parser.add_argument('--replay', type=str,
+                    help='play a --record file instead of reading hal')
+    parser.add_argument('--replay_speed', dest='replay_speed', type=float, default=1.0,
+                    help='replay speed, 0 is as fast as possible, default: 1.0')
+    return parser
 
-    args = parser.parse_args()
+if __name__ == '__main__':
+    args = get_parser().parse_args()
     params = get_params(args)
 
-    lcnc = lc()
+    if not args.net_client is None:
+        net_client(net_addr(args.net_client), params["net_rate"]).run()
+        exit(0)
 
-    gui = main_gui(lcnc)
+    log = event_log(prog, params["log_size"])
+    log.timing = not params["log"] is None or not params["metrics"] is None
+    if not params["log"] is None:
+        log.open(params["log"])
+    metrics = None
+    if not params["metrics"] is None:
+        host, port = net_addr(params["metrics"])
+        metrics = metrics_server((host or "127.0.0.1", port))
+        metrics.start()
+    log.event("start", axes="".join(params["axes"]))
+
+    if not params["attach"] is None:
+        lcnc = remote_lc(params["attach"])
+    elif not params["replay"] is None:
+        lcnc = replay_lc(params["replay"])
+    else:
+        lcnc = lc()
+    server = None
+    if not params["serve"] is None:
+        server = snap_server(lcnc, params["serve"])
+        server.start()
+    engine = dro_engine(lcnc)
+    net = None
+    if not params["net"] is None:
+        net = net_server(engine, net_addr(params["net"]))
+        net.start()
+
+    if params["headless"]:
+        sched = poll_scheduler(engine.poll)
+    else:
+        if tk is None:
+            print("No Tk, use --headless")
+            exit(1)
+        root = tk.Tk()
+        gui = main_gui(engine)
+        sched = poll_scheduler(gui.poll)
 
     if params["is_display"]:
         run_postgui()
 
-    root.after(20, call_polls);
-    root.mainloop()
+    if not lcnc.sampler is None:
+        lcnc.sampler.wake = sched.wake
+    # A headless replay exits at the end of the log, an attached window
+    # when the server comes back with other axes
+    if not params["attach"] is None or (params["headless"] and not params["replay"] is None):
+        lcnc.sampler.finished = sched.finish
+        if lcnc.sampler.done:
+            sched.finish()
+    if not engine.watcher is None:
+        engine.watcher.wake = sched.wake
+    if not net is None:
+        net.wake = sched.wake
+    if params["headless"]:
+        sched.run_headless()
+    else:
+        sched.start()
+        root.mainloop()
+    if not server is None:
+        server.stop()
+        server.join()
+    if not net is None:
+        net.stop()
+    engine.stop()
+    if not metrics is None:
+        metrics.stop()
+    log.event("stop")
+    log.stop()
+    # It gave up on a server that came back with other axes
+    if not params["attach"] is None and lcnc.sampler.done:
+        exit(1)
@@ -0,0 +1,28 @@
+#
+# The tests load yadro.py and mdro.py through bench.py, whose fake
+# linuxcnc and hal modules stand in for the real ones.
+#
+
+import os
+import sys
+
+import pytest
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not top in sys.path:
+    sys.path.insert(0, top)
+
+import bench
+
+# Each test that takes mod runs once against each tool
+@pytest.fixture(params=["yadro", "mdro"])
+def mod(request):
+    return bench.load(request.param, ["XYZ"])
+
+@pytest.fixture
+def mdro():
+    return bench.load("mdro", ["XYZ"])
+
+@pytest.fixture
+def yadro():
+    return bench.load("yadro", ["XYZ"])
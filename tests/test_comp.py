@@ -0,0 +1,39 @@
+import pytest
+
+@pytest.fixture
+def emap(mdro, tmp_path):
+    name = str(tmp_path / "x.map")
+    with open(name, "w") as f:
+        f.write("# reading correction\n10 0.002\n0 0\n\n5 0.004\nbad line\n20\n")
+    return mdro.error_map(name)
+
+def test_map_points(emap):
+    assert emap.skipped == 2
+    assert list(emap.at) == [0.0, 5.0, 10.0]
+
+# Interpolated between the points, the end corrections hold past them
+def test_map_lookup(emap):
+    assert emap.lookup(0.0) == 0.0
+    assert emap.lookup(2.5) == pytest.approx(0.002)
+    assert emap.lookup(5.0) == pytest.approx(0.004)
+    assert emap.lookup(7.5) == pytest.approx(0.003)
+    assert emap.lookup(-3.0) == 0.0
+    assert emap.lookup(12.0) == pytest.approx(0.002)
+
+def test_map_empty(mdro, tmp_path):
+    name = str(tmp_path / "empty.map")
+    with open(name, "w") as f:
+        f.write("# nothing\n")
+    with pytest.raises(ValueError):
+        mdro.error_map(name)
+
+def test_factor_and_map(mdro, emap):
+    comp = mdro.axis_comp(1.001, emap, 0.0)
+    assert comp.update(5.0) == pytest.approx(5.005 + 0.004)
+
+# After a reversal the reading has to come back the backlash before the
+# value moves, and from then on the backlash is added
+def test_backlash(mdro):
+    comp = mdro.axis_comp(1.0, None, 0.1)
+    out = [comp.update(v) for v in [0.0, 1.0, 0.95, 0.9, 0.8, 0.85, 0.95, 1.0]]
+    assert out == pytest.approx([0.0, 1.0, 1.0, 1.0, 0.9, 0.9, 0.95, 1.0])
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import bench
+
+@pytest.fixture
+def engine():
+    yadro = bench.load("yadro", ["--sample_ms", "0", "XYZ"])
+    lcnc = yadro.lc()
+    engine = yadro.dro_engine(lcnc)
+    comp = bench.fake_component.made[-1]
+    for pin, v in zip(bench.input_pins("yadro", 3), [1.0, 3.0, -2.0]):
+        comp.pins[pin] = v
+    engine.poll()
+    yield engine
+    engine.stop()
+
+def wait(cmd):
+    t0 = time.time()
+    while cmd.status == "pending" and time.time() - t0 < 2.0:
+        time.sleep(0.005)
+    return cmd.status
+
+def test_zero(engine):
+    cmd = engine.zero(0)
+    assert wait(cmd) == "done"
+    assert engine.lcnc.c.texts == ["G10 L20 P1 X0.0"]
+
+def test_half(engine):
+    cmd = engine.half(1)
+    assert wait(cmd) == "done"
+    assert engine.lcnc.c.texts == ["G10 L20 P1 Y1.5"]
+
+def test_set_value(engine):
+    engine.lcnc.s.g5x_index = 3
+    engine.poll()
+    cmd = engine.set_value(2, 0.25)
+    assert wait(cmd) == "done"
+    assert engine.lcnc.c.texts == ["G10 L20 P3 Z0.25"]
+
+# An inch machine running a G21 program gets the value in mm
+def test_set_value_program_units(engine):
+    engine.lcnc.s.program_units = 2
+    engine.poll()
+    assert wait(engine.set_value(0, 1.0)) == "done"
+    assert engine.lcnc.c.texts == ["G10 L20 P1 X25.4"]
+
+# The same command sent again while the first is queued is merged with it
+def test_merged(engine):
+    bench.fake_command.delay = 0.05
+    try:
+        first = engine.zero(0)
+        assert engine.zero(0) is first
+        assert wait(first) == "done"
+    finally:
+        bench.fake_command.delay = 0.0
+    assert engine.lcnc.c.texts == ["G10 L20 P1 X0.0"]
+
+def test_not_running(engine):
+    engine.lcnc.s.estop = 1
+    engine.poll()
+    assert engine.zero(0) is None
+    assert engine.lcnc.c.texts == []
+
+# Commands that outlast --mdi_timeout
+@pytest.fixture
+def slow():
+    yadro = bench.load("yadro", ["--sample_ms", "0", "--mdi_timeout", "0.05",
+                                  "--pattern_moves", "XY"])
+    engine = yadro.dro_engine(yadro.lc())
+    engine.lcnc.s.task_mode = bench.fake_linuxcnc.MODE_MDI
+    engine.poll()
+    bench.fake_command.delay = 0.5
+    yield engine
+    bench.fake_command.delay = 0.0
+    engine.stop()
+
+# A long G0 to a hole is still running, not stuck
+def test_long_move(slow):
+    assert slow.set_pattern("line 10 0 0 1 2")
+    cmd = slow.goto_hole()
+    slow.lcnc.s.interp_state = bench.fake_linuxcnc.INTERP_READING
+    slow.poll()
+    assert wait(cmd) == "done"
+    assert slow.lcnc.c.texts == ["G0 X10.0000 Y0.0000"]
+
+def test_stuck(slow):
+    assert wait(slow.zero(0)) == "timeout"
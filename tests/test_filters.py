@@ -0,0 +1,34 @@
+import pytest
+
+def run(f, values):
+    return [f.update(v) for v in values]
+
+# A single spike never gets through a median of three
+def test_median(mdro):
+    f = mdro.filter_chain("median:3")
+    assert run(f, [1.0, 1.0, 9.0, 1.0, 2.0, 2.0]) == [1.0, 1.0, 1.0, 1.0, 2.0, 2.0]
+
+def test_ema(mdro):
+    f = mdro.filter_chain("ema:0.5")
+    assert run(f, [0.0, 1.0, 1.0]) == [0.0, 0.5, 0.75]
+
+# Within the last displayed digit the average settles on the reading
+def test_ema_settles(mdro):
+    f = mdro.filter_chain("ema:0.5")
+    out = run(f, [0.0] + [1.0] * 20)
+    assert out[-1] == 1.0
+    assert out[-2] == 1.0
+
+def test_deadband(mdro):
+    f = mdro.filter_chain("deadband:0.01")
+    assert run(f, [1.0, 1.005, 0.992, 1.02, 1.025]) == [1.0, 1.0, 1.0, 1.02, 1.02]
+
+# The filters run in the order given
+def test_chain(mdro):
+    f = mdro.filter_chain("median:3 deadband:0.5")
+    assert [type(x) for x in f.filters] == [mdro.median_filter, mdro.deadband_filter]
+    assert run(f, [0.0, 0.0, 5.0, 0.2, 0.3, 0.9, 0.9]) == [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.9]
+
+def test_bad_filter(mdro):
+    with pytest.raises(KeyError):
+        mdro.filter_chain("lowpass:3")
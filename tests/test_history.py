@@ -0,0 +1,58 @@
+import pytest
+
+def test_slopes(mod):
+    ring = mod.sample_ring(2, 100)
+    for i in range(20):
+        t = 0.01 * i
+        ring.add(t, [3.0 * t + 1.0, -0.5 * t])
+    vel = ring.slopes(0.1, 0.19)
+    assert vel[0] == pytest.approx(3.0)
+    assert vel[1] == pytest.approx(-0.5)
+
+# Only the samples inside the window count
+def test_slopes_window(mod):
+    ring = mod.sample_ring(1, 100)
+    for i in range(10):
+        ring.add(0.01 * i, [0.0])
+    for i in range(10, 20):
+        ring.add(0.01 * i, [2.0 * (0.01 * i - 0.1)])
+    assert ring.slopes(0.095, 0.19)[0] == pytest.approx(2.0)
+
+# The ring wraps without losing the newest samples
+def test_slopes_wrapped(mod):
+    ring = mod.sample_ring(1, 8)
+    for i in range(30):
+        ring.add(0.01 * i, [0.01 * i])
+    ts, vss = ring.window(1.0, 0.29)
+    assert len(ts) == 8
+    assert ts[0] == pytest.approx(0.22)
+    assert ring.slopes(1.0, 0.29)[0] == pytest.approx(1.0)
+
+def test_slopes_too_few(mod):
+    ring = mod.sample_ring(2, 10)
+    assert ring.slopes(1.0, 0.0) == [0.0, 0.0]
+    ring.add(0.0, [1.0, 2.0])
+    assert ring.slopes(1.0, 0.0) == [0.0, 0.0]
+
+def test_stats(mod):
+    ring = mod.sample_ring(2, 100)
+    for i, v in enumerate([5.0, 1.0, 4.0, 2.0, 3.0]):
+        ring.add(0.01 * i, [v, -v])
+    assert ring.stats(0, 0.025, 0.04) == (2.0, 4.0, 3.0, 3)
+    assert ring.stats(1, 1.0, 0.04) == (-5.0, -1.0, -3.0, 5)
+
+def test_stats_empty(mod):
+    ring = mod.sample_ring(1, 10)
+    assert ring.stats(0, 1.0, 0.0) is None
+    ring.add(0.0, [1.0])
+    assert ring.stats(0, 0.5, 1.0) is None
+
+# A window that spans the end of the arrays after the ring wraps
+def test_stats_wrapped(mod):
+    ring = mod.sample_ring(1, 8)
+    for i in range(13):
+        ring.add(0.01 * i, [float(i)])
+    lo, hi, mean, n = ring.stats(0, 0.055, 0.12)
+    assert (lo, hi, n) == (7.0, 12.0, 6)
+    assert mean == pytest.approx(9.5)
+    assert ring.stats(0, 1.0, 0.12)[3] == 8
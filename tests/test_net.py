@@ -0,0 +1,32 @@
+import pytest
+
+def test_state_round_trip(mod):
+    sent = [1.0, -2.5, 0.0, 3.0]
+    got = [0.0] * 4
+    mod.net_decode_state(got, mod.net_encode_state(None, sent))
+    assert got == sent
+    last = list(sent)
+    sent[1] = 7.25
+    sent[3] = -1.0
+    payload = mod.net_encode_state(last, sent)
+    # Only the mask and the two changed values go out
+    assert len(payload) == 4 + 2 * 8
+    mod.net_decode_state(got, payload)
+    assert got == sent
+
+def test_state_unchanged(mod):
+    assert mod.net_encode_state([1.0, 2.0], [1.0, 2.0]) is None
+
+# Frames split across reads come out once they are whole
+def test_split(mod):
+    data = mod.net_frame(mod.NET_RATE, b"\x00\x05") + mod.net_frame(mod.NET_STATE, b"abc")
+    frames, rest = mod.net_split(data[:5])
+    assert frames == []
+    frames, rest = mod.net_split(rest + data[5:])
+    assert frames == [(mod.NET_RATE, b"\x00\x05"), (mod.NET_STATE, b"abc")]
+    assert rest == b""
+
+# Without a host the server takes every interface
+def test_addr(mod):
+    assert mod.net_addr("5000") == ("", 5000)
+    assert mod.net_addr("0.0.0.0:5001") == ("0.0.0.0", 5001)
@@ -0,0 +1,32 @@
+import pytest
+
+def points(p):
+    return [tuple(round(v, 6) for v in p.point(i)) for i in range(p.n)]
+
+def test_circle(mod):
+    p = mod.hole_pattern("circle 10 20 4 4")
+    assert points(p) == [(12.0, 20.0), (10.0, 22.0), (8.0, 20.0), (10.0, 18.0)]
+
+def test_circle_start_angle(mod):
+    p = mod.hole_pattern("circle 0 0 2 2 90")
+    assert points(p) == [(0.0, 1.0), (0.0, -1.0)]
+
+def test_line(mod):
+    p = mod.hole_pattern("line 1 1 90 0.5 3")
+    assert points(p) == [(1.0, 1.0), (1.0, 1.5), (1.0, 2.0)]
+
+# Every other row runs backwards
+def test_grid(mod):
+    p = mod.hole_pattern("grid 0 0 1 2 3 2")
+    assert points(p) == [(0.0, 0.0), (1.0, 0.0), (2.0, 0.0),
+                         (2.0, 2.0), (1.0, 2.0), (0.0, 2.0)]
+
+@pytest.mark.parametrize("spec", ["", "circle 0 0 1", "line 0 0 x 1 2", "star 0 0 1 5",
+                                  "circle 0 0 1 0"])
+def test_bad_specs(mod, spec):
+    with pytest.raises(ValueError):
+        mod.hole_pattern(spec)
+
+def test_pattern_axes(mod):
+    mod.params["axes"] = list("AXCY")
+    assert mod.pattern_axes() == [1, 3]
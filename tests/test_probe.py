@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+import bench
+
+# A yadro engine whose X pin reads machine position less the G54 offset,
+# with G10 L20 applied to the offset the way Linuxcnc would
+class machine():
+    def __init__(self):
+        self.yadro = bench.load("yadro", ["--sample_ms", "0", "--probe", "XYZ"])
+        self.lcnc = self.yadro.lc()
+        self.engine = self.yadro.dro_engine(self.lcnc)
+        self.comp = bench.fake_component.made[-1]
+        self.x = 0.0
+
+    def move(self, x, probe=0):
+        self.x = x
+        self.comp.pins["0"] = x - self.lcnc.s.g5x_offset[0]
+        self.comp.pins["probe"] = probe
+        self.engine.poll()
+
+    def run(self, cmd):
+        t0 = time.time()
+        while cmd.status == "pending" and time.time() - t0 < 2.0:
+            time.sleep(0.005)
+        assert cmd.status == "done"
+        text = self.lcnc.c.texts[-1]
+        assert text.startswith("G10 L20 P1 X")
+        value = float(text[len("G10 L20 P1 X"):])
+        self.lcnc.s.g5x_offset = (self.x - value,) + (0.0,) * 8
+        self.move(self.x)
+        return value
+
+    # Arms the probe and touches moving from a to b
+    def touch(self, a, b):
+        self.move(a)
+        self.engine.arm_probe()
+        self.move(a)
+        self.move(b, 1)
+        self.move(b, 0)
+
+@pytest.fixture
+def m():
+    m = machine()
+    yield m
+    m.engine.stop()
+
+def test_touch(m):
+    m.touch(0.9, 1.0)
+    armed, edge = m.engine.get_probe()
+    assert not armed
+    assert edge[0] == 0
+    assert edge[1] == pytest.approx(0.95)
+
+def test_edge_zero(m):
+    m.touch(0.9, 1.0)
+    assert m.run(m.engine.probe_zero()) == pytest.approx(0.05)
+    assert m.engine.get_probe()[1][1] == pytest.approx(0.0)
+    # Pressed again it finds the same edge in the new offsets
+    assert m.run(m.engine.probe_zero()) == pytest.approx(0.05)
+
+# Edge 0 on the first touch changes the offsets before the second one
+def test_center_after_edge_zero(m):
+    m.touch(0.9, 1.0)
+    m.run(m.engine.probe_zero())
+    m.move(3.5)
+    m.touch(3.0, 2.9)
+    # The edges are at 0.95 and 2.95 in machine coordinates
+    assert m.run(m.engine.probe_center()) == pytest.approx(2.9 - 1.95)
+    assert m.engine.get_probe()[1][1] == pytest.approx(1.0)
+
+def test_center_needs_both_sides(m):
+    m.touch(0.9, 1.0)
+    m.touch(1.9, 2.0)
+    assert m.engine.probe_center() is None
+
+# mdro keeps the edge in pin units and shows it in the current system
+def test_mdro_touch():
+    mdro = bench.load("mdro", ["--sample_ms", "0", "--probe", "XYZ"])
+    lcnc = mdro.lc()
+    engine = mdro.dro_engine(lcnc)
+    comp = bench.fake_component.made[-1]
+    engine.arm_probe()
+    for x, probe in [(2.0, 0), (1.9, 1), (1.9, 0)]:
+        comp.pins["axis.0"] = x
+        comp.pins["probe"] = probe
+        engine.poll()
+    armed, edge = engine.get_probe()
+    assert not armed
+    assert edge[0] == 0
+    assert edge[1] == pytest.approx(1.95)
+    engine.probe_zero()
+    engine.poll()
+    assert engine.get_probe()[1][1] == pytest.approx(0.0)
+
+# An attached window never sees the probe pin
+@pytest.mark.parametrize("tool", ["yadro", "mdro"])
+def test_no_probe_when_attached(tool):
+    with pytest.raises(SystemExit):
+        bench.load(tool, ["--probe", "--attach", "/tmp/none.sock", "XYZ"])
@@ -0,0 +1,32 @@
+# Stands in for the Tk canvas, only the cell texts are kept
+class fake_canvas():
+    def __init__(self):
+        self.texts = dict()
+
+    def itemconfigure(self, item, text):
+        self.texts[item] = text
+
+def readout(mod, ncells):
+    r = mod.readout_canvas.__new__(mod.readout_canvas)
+    r.canvas = fake_canvas()
+    r.ncells = ncells
+    r.cells = [list(range(ncells))]
+    r.shown = [[""] * ncells]
+    return r
+
+def shown(r):
+    return "".join(r.canvas.texts.get(c, "") for c in r.cells[0])
+
+def test_right_justified(mod):
+    r = readout(mod, 8)
+    assert r.set_text(0, "-1.2500")
+    assert shown(r) == " -1.2500"
+    assert not r.set_text(0, "-1.2500")
+
+# Too wide, the row says so instead of dropping the sign or top digits
+def test_overflow(mod):
+    r = readout(mod, 8)
+    assert r.set_text(0, "-12.50000")
+    assert shown(r) == "########"
+    assert r.set_text(0, "12.5000")
+    assert shown(r) == " 12.5000"
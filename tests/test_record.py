@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+import bench
+
+def wait(cond, seconds=5.0):
+    t0 = time.time()
+    while not cond() and time.time() - t0 < seconds:
+        time.sleep(0.01)
+    return cond()
+
+# Polls a recording lc through some handwheel motion and stops it
+def record(mod, path, polls, size=10240, argv=[], step=None):
+    mod.params = mod.get_params(mod.get_parser().parse_args(
+        ["--sample_ms", "0", "--record", path, "--record_size", str(size)] + argv + ["XYZ"]))
+    lcnc = mod.lc()
+    comp = bench.fake_component.made[-1]
+    names = bench.input_pins(mod.prog, 3)
+    for i in range(polls):
+        bench.move(comp, names, i)
+        if mod.prog == "yadro" and i == polls // 2:
+            lcnc.s.g5x_index = 3
+        if not step is None:
+            step(i, lcnc, comp)
+        lcnc.poll()
+    lcnc.stop()
+    return lcnc
+
+def replay(mod, path, argv=[]):
+    mod.params = mod.get_params(mod.get_parser().parse_args(
+        ["--replay", path, "--replay_speed", "0"] + argv + ["XYZ"]))
+    lcnc = mod.replay_lc(path)
+    assert wait(lambda: lcnc.sampler.done)
+    lcnc.poll()
+    return lcnc
+
+# Played back as fast as it goes, the replay ends where the machine did
+def test_round_trip(mod, tmp_path):
+    path = str(tmp_path / "a.rec")
+    last = record(mod, path, 200).latest()
+    snap = replay(mod, path).latest()
+    assert snap.pins == last.pins
+    if mod.prog == "yadro":
+        assert snap.g5x_index == 3
+        assert snap.state.homed == last.state.homed
+
+# After a rotation the new file starts from the current values
+def test_rotated(mod, tmp_path):
+    path = str(tmp_path / "a.rec")
+    last = record(mod, path, 400, 1).latest()
+    assert (tmp_path / "a.rec.1").exists()
+    assert replay(mod, path).latest().pins == last.pins
+
+# Arming is in the log, so the replay latches the same touch
+def test_probe(mod, tmp_path):
+    path = str(tmp_path / "a.rec")
+    def step(i, lcnc, comp):
+        if i == 20:
+            lcnc.arm_probe(True)
+        comp.pins["probe"] = int(i >= 30)
+    first = record(mod, path, 60, argv=["--probe"], step=step).get_probe()[1]
+    assert first.axis is not None
+    second = replay(mod, path, ["--probe"]).get_probe()[1]
+    assert second.axis == first.axis
+    assert second.edge == first.edge
+
+def test_other_axes(mod, tmp_path):
+    path = str(tmp_path / "a.rec")
+    record(mod, path, 10)
+    with pytest.raises(SystemExit):
+        mod.params = mod.get_params(mod.get_parser().parse_args(
+            ["--replay", path, "XY"]))
+        mod.replay_lc(path)
+
+# A log cut off mid record plays up to the last whole one
+def test_truncated(mod, tmp_path):
+    path = str(tmp_path / "a.rec")
+    record(mod, path, 50)
+    mod.params = mod.get_params(mod.get_parser().parse_args(["--replay", path, "XYZ"]))
+    whole = list(mod.replay_log(path).records())
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-3])
+    assert list(mod.replay_log(path).records()) == whole[:-1]
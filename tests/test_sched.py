@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+# Stands in for the Tk root, after callbacks are only recorded
+class fake_root():
+    def __init__(self):
+        self.calls = []
+
+    def after(self, ms, fn):
+        self.calls.append(("after", ms))
+        return len(self.calls)
+
+    def after_idle(self, fn):
+        self.calls.append(("idle", fn))
+        return len(self.calls)
+
+    def after_cancel(self, after_id):
+        self.calls.append(("cancel", after_id))
+
+@pytest.fixture
+def tk(mod, monkeypatch):
+    root = fake_root()
+    monkeypatch.setattr(mod, "root", root)
+    return root
+
+# Idle polls stretch the period up to slow_ms, a change snaps it back
+def test_backoff(mod):
+    sched = mod.poll_scheduler(lambda: False)
+    delays = [sched.backoff(False) for i in range(40)]
+    assert delays[0] == 26
+    assert delays == sorted(delays)
+    assert delays[-1] == 250
+    assert sched.backoff(True) == 20
+
+def test_run_reschedules(mod, tk):
+    changed = [False]
+    sched = mod.poll_scheduler(lambda: changed[0])
+    sched.run()
+    sched.run()
+    changed[0] = True
+    sched.run()
+    assert [c[1] for c in tk.calls] == [26, 33, 20]
+
+# Input cancels the slow poll and polls at once
+def test_kick(mod, tk):
+    sched = mod.poll_scheduler(lambda: False)
+    for i in range(10):
+        sched.run()
+    sched.kick()
+    assert sched.delay == 20
+    assert tk.calls[-2] == ("cancel", 10)
+    assert tk.calls[-1] == ("idle", sched.run)
+
+# A new snapshot only kicks a backed off scheduler, and only once
+def test_wake(mod, tk):
+    sched = mod.poll_scheduler(lambda: False)
+    sched.wake()
+    assert tk.calls == []
+    sched.run()
+    sched.run()
+    sched.wake()
+    sched.wake()
+    assert tk.calls[-1] == ("idle", sched.kick)
+    assert len(tk.calls) == 3
+
+# Headless, finish from another thread still gets one last poll
+def test_headless_finish(mod):
+    polls = []
+    def poll():
+        polls.append(1)
+        return False
+    sched = mod.poll_scheduler(poll)
+    t = threading.Timer(0.05, sched.finish)
+    t.start()
+    sched.run_headless()
+    t.join()
+    assert not sched.running
+    assert len(polls) >= 2
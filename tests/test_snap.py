@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+import bench
+
+def wait(cond, seconds=2.0):
+    t0 = time.time()
+    while not cond() and time.time() - t0 < seconds:
+        time.sleep(0.01)
+    return cond()
+
+# Starts a serving lc of a tool, stopped again after the test
+@pytest.fixture
+def serve(tmp_path, request):
+    def start(mod):
+        path = str(tmp_path / "s.sock")
+        lcnc = mod.lc()
+        comp = bench.fake_component.made[-1]
+        server = mod.snap_server(lcnc, path)
+        server.start()
+        def stop():
+            server.stop()
+            server.join()
+            lcnc.stop()
+        request.addfinalizer(stop)
+        return lcnc, comp, path
+    return start
+
+# An attached lc sees the pins the serving one samples
+def test_attach(mod, serve):
+    lcnc, comp, path = serve(mod)
+    remote = mod.remote_lc(path)
+    pins = bench.input_pins(mod.prog, 3)
+    for a in range(3):
+        comp.pins[pins[a]] = 1.5 * (a + 1)
+    assert wait(lambda: remote.latest().pins == [1.5, 3.0, 4.5])
+    remote.stop()
+
+# A window detaching leaves the server running for the others
+def test_detach(mod, serve):
+    lcnc, comp, path = serve(mod)
+    first = mod.remote_lc(path)
+    second = mod.remote_lc(path)
+    first.stop()
+    pins = bench.input_pins(mod.prog, 3)
+    comp.pins[pins[0]] = 7.0
+    assert wait(lambda: second.latest().pins[0] == 7.0)
+    second.stop()
+
+# MDI from the attached window runs on the server and the result comes back
+def test_remote_mdi(yadro, serve):
+    lcnc, comp, path = serve(yadro)
+    remote = yadro.remote_lc(path)
+    remote.poll()
+    cmd = remote.cmds.send("G0 X1")
+    assert wait(lambda: cmd.status != "pending")
+    assert cmd.status == "done"
+    assert lcnc.c.texts[-1] == "G0 X1"
+    remote.stop()
+
+# The only thing an attached mdro sends back is the index button
+def test_remote_index(mdro, serve):
+    lcnc, comp, path = serve(mdro)
+    remote = mdro.remote_lc(path)
+    remote.set_index_enable(1)
+    assert wait(lambda: comp.pins.get("index-enable.1") == 1)
+    remote.stop()
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+@pytest.fixture
+def state(mdro, tmp_path, monkeypatch):
+    monkeypatch.setattr(mdro.state_file, "delay", 0.01)
+    return mdro.state_file(str(tmp_path / "mdro.json"))
+
+def test_save_load(state):
+    assert state.load() == (None, 0.0)
+    state.start()
+    state.save({"cur_idx": 1})
+    state.save({"cur_idx": 2})
+    state.stop()
+    saved, mtime = state.load()
+    assert saved == {"cur_idx": 2}
+    assert mtime == os.path.getmtime(state.path)
+    assert not os.path.exists(state.path + ".tmp")
+
+# A write that fails part way leaves the last good file alone
+def test_failed_write(mdro, state, monkeypatch, capsys):
+    state.save({"cur_idx": 1})
+    state.flush()
+    def fail(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(mdro.os, "rename", fail)
+    state.save({"cur_idx": 2})
+    state.flush()
+    assert "Could not save" in capsys.readouterr().out
+    assert state.load()[0] == {"cur_idx": 1}
+
+def test_bad_file(state, capsys):
+    with open(state.path, "w") as f:
+        f.write('{"cur_idx": ')
+    assert state.load() == (None, 0.0)
+    assert "Could not read" in capsys.readouterr().out
+
+# Nothing pending, nothing written
+def test_stop_without_save(state):
+    state.start()
+    state.stop()
+    assert not os.path.exists(state.path)
@@ -0,0 +1,58 @@
+import pytest
+
+import bench
+
+@pytest.fixture
+def lcnc(yadro):
+    yadro.params["sample_ms"] = 0
+    return yadro.lc()
+
+# Pin changes share the derived state, a stat change makes a new one
+def test_shared_until_stat_changes(lcnc):
+    comp = bench.fake_component.made[-1]
+    lcnc.poll()
+    first = lcnc.get_state()
+    comp.pins["0"] = 1.0
+    lcnc.poll()
+    assert lcnc.get_state() is first
+    lcnc.s.g5x_index = 2
+    lcnc.poll()
+    assert not lcnc.get_state() is first
+    assert lcnc.get_state().g5x_index == 2
+
+# Every stat field the derived state reads has to make a new one
+@pytest.mark.parametrize("field, value", [("estop", 1), ("homed", (1, 0, 1)),
+                                          ("task_state", 1), ("interp_state", 2),
+                                          ("task_mode", 3), ("axis_mask", 3)])
+def test_invalidated(lcnc, field, value):
+    lcnc.poll()
+    first = lcnc.get_state()
+    setattr(lcnc.s, field, value)
+    lcnc.poll()
+    assert not lcnc.get_state() is first
+
+def test_running(lcnc):
+    lcnc.poll()
+    assert lcnc.get_state().running
+    lcnc.s.estop = 1
+    lcnc.poll()
+    assert not lcnc.get_state().running
+    lcnc.s.estop = 0
+    lcnc.s.homed = (1, 0, 1, 1, 1, 1, 1, 1, 1)
+    lcnc.poll()
+    assert not lcnc.get_state().homed
+    assert not lcnc.is_running()
+
+# Subscribers hear each field once at the start and then only its changes
+def test_subscribe(lcnc):
+    heard = []
+    lcnc.subscribe("g5x_index", lambda name, value: heard.append(value))
+    lcnc.subscribe("estop", lambda name, value: heard.append(name))
+    lcnc.poll()
+    lcnc.poll()
+    lcnc.s.g5x_index = 4
+    lcnc.poll()
+    lcnc.s.interp_state = 2
+    lcnc.poll()
+    assert heard == ["estop", 1, 4]
+    assert lcnc.changed == ["running"]
@@ -0,0 +1,62 @@
+import pytest
+
+import bench
+
+class dro():
+    def __init__(self, tool):
+        self.mod = bench.load(tool, ["--sample_ms", "0", "--approach", "0.1",
+                                     "--tolerance", "0.001", "XYZ"])
+        self.engine = self.mod.dro_engine(self.mod.lc())
+        self.comp = bench.fake_component.made[-1]
+        self.pins = bench.input_pins(tool, 3)
+
+    def move(self, *values):
+        for pin, v in zip(self.pins, values):
+            self.comp.pins[pin] = v
+        self.engine.poll()
+
+@pytest.fixture(params=["yadro", "mdro"])
+def d(request):
+    d = dro(request.param)
+    yield d
+    d.engine.stop()
+
+# Axes with a target show the distance to go, the others their position
+def test_distance_to_go(d):
+    d.move(1.0, 2.0, 3.0)
+    d.engine.set_target(0, 1.5)
+    d.engine.poll()
+    assert d.engine.get_display() == pytest.approx([-0.5, 2.0, 3.0])
+    assert d.engine.get_targets() == [1.5, None, None]
+    d.engine.set_target(0, None)
+    d.engine.poll()
+    assert d.engine.get_display() == pytest.approx([1.0, 2.0, 3.0])
+
+def test_zones(d):
+    d.move(0.0, 0.0, 0.0)
+    d.engine.set_target(0, 1.0)
+    d.engine.set_target(1, 0.0)
+    d.move(0.5, 0.0, 0.0)
+    assert d.engine.get_zones() == (["far", "on", None], 1)
+    d.move(0.95, 0.0, 0.0)
+    assert d.engine.get_zones()[0][0] == "near"
+    d.move(0.9995, 0.0, 0.0)
+    assert d.engine.get_zones() == (["on", "on", None], 2)
+
+# Staying on target counts once, leaving and coming back counts again
+def test_arrivals(d):
+    d.engine.set_target(0, 1.0)
+    d.move(1.0, 0.0, 0.0)
+    d.move(1.0005, 0.0, 0.0)
+    assert d.engine.get_zones()[1] == 1
+    d.move(1.05, 0.0, 0.0)
+    d.move(1.0, 0.0, 0.0)
+    assert d.engine.get_zones()[1] == 2
+
+# Clearing a pattern leaves the targets on other axes
+def test_clear_pattern(d):
+    d.engine.set_target(2, -1.0)
+    assert d.engine.set_pattern("line 1 2 0 1 3")
+    assert d.engine.get_targets() == [1.0, 2.0, -1.0]
+    d.engine.clear_pattern()
+    assert d.engine.get_targets() == [None, None, -1.0]
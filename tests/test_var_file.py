@@ -0,0 +1,141 @@
+import os
+import time
+
+import pytest
+
+import bench
+
+def write(path, lines):
+    with open(str(path), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return str(path)
+
+def test_parse(mod, tmp_path):
+    name = write(tmp_path / "a.var", ["5220 2.000000", "5221 1.5", "5222 -2", "",
+                                      "# comment", "5241 10", "5243 30", "5211 7",
+                                      "oops 3", "5230", "9999 1"])
+    vf = mod.var_file(name)
+    assert vf.skipped == 3
+    assert vf.get_g5x_index() == 2
+    assert vf.get_g5x(1)[:3] == [1.5, -2.0, 0.0]
+    assert vf.get_g5x(2)[:3] == [10.0, 0.0, 30.0]
+    assert vf.has(5243) and not vf.has(5242)
+    assert vf.get(5242, -1.0) == -1.0
+    # G92 only counts when it is turned on
+    assert vf.get_g92() == [0.0] * 9
+
+def test_g92_enabled(mod, tmp_path):
+    vf = mod.var_file(write(tmp_path / "a.var", ["5210 1", "5211 0.25", "5213 -1"]))
+    assert vf.get_g92()[:3] == [0.25, 0.0, -1.0]
+
+# A file cut short is missing parameters the last one had
+def test_covers(mod, tmp_path):
+    full = mod.var_file(write(tmp_path / "a.var", ["5220 1", "5221 1", "5241 2"]))
+    cut = mod.var_file(write(tmp_path / "b.var", ["5220 1", "5221 1"]))
+    assert full.covers(cut)
+    assert not cut.covers(full)
+
+@pytest.fixture
+def preloaded(tmp_path):
+    name = write(tmp_path / "mdro.var", ["5220 1", "5221 1", "5222 2", "5223 3",
+                                         "5241 10", "5242 20", "5243 30"])
+    mdro = bench.load("mdro", ["--load_cs", name, "XYZ"])
+    return mdro, name
+
+def test_preload(preloaded):
+    mdro, name = preloaded
+    cs = mdro.coord_systems()
+    assert cs.coord_sys == ["MCS", "G54", "G55", "G56", "G57"]
+    assert cs.get_system(0) == [0.0, 0.0, 0.0]
+    assert cs.get_system(1) == [-1.0, -2.0, -3.0]
+    assert cs.get_system(2) == [-10.0, -20.0, -30.0]
+    assert cs.cur_idx == 1
+
+# Only the systems the new file changed are replaced
+def test_reload(preloaded, tmp_path):
+    mdro, name = preloaded
+    cs = mdro.coord_systems()
+    cs.select(1)
+    cs.set(0, 5.0)
+    new = write(tmp_path / "new.var", ["5220 1", "5221 1", "5222 2", "5223 3",
+                                       "5241 11", "5242 20", "5243 30"])
+    cs.reload(mdro.var_file(new))
+    assert cs.get_system(1) == [5.0, -2.0, -3.0]
+    assert cs.get_system(2) == [-11.0, -20.0, -30.0]
+
+def test_restore(preloaded):
+    mdro, name = preloaded
+    cs = mdro.coord_systems()
+    cs.select(2)
+    cs.set(1, 4.0)
+    state = cs.get_state()
+    # Saved after the file changed, the saved values win
+    back = mdro.coord_systems()
+    back.restore(state, os.path.getmtime(name) + 10.0)
+    assert back.cur_idx == 2
+    assert back.get_system(2) == [-10.0, 4.0, -30.0]
+    # Saved before, the file wins but the selection is kept
+    back = mdro.coord_systems()
+    back.restore(state, os.path.getmtime(name) - 10.0)
+    assert back.cur_idx == 2
+    assert back.get_system(2) == [-10.0, -20.0, -30.0]
+
+def test_restore_other_axes(preloaded):
+    mdro, name = preloaded
+    cs = mdro.coord_systems()
+    state = cs.get_state()
+    state["axes"] = "XZ"
+    state["cur_idx"] = 3
+    cs.restore(state, os.path.getmtime(name) + 10.0)
+    assert cs.cur_idx == 1
+
+def test_restore_bad_state(preloaded):
+    mdro, name = preloaded
+    cs = mdro.coord_systems()
+    cs.restore({"axes": "XYZ", "coords": [[0, 0, 0], ["x", 1, 2]], "cur_idx": 0},
+               os.path.getmtime(name) + 10.0)
+    assert cs.cur_idx == 1
+    assert cs.get_system(1) == [-1.0, -2.0, -3.0]
+
+def wait(cond, seconds=3.0):
+    t0 = time.time()
+    while not cond() and time.time() - t0 < seconds:
+        time.sleep(0.01)
+    return cond()
+
+# Linuxcnc renames the new file over the old one
+def test_watch(mod, tmp_path):
+    name = write(tmp_path / "a.var", ["5220 1", "5221 1"])
+    w = mod.var_watcher(name, mod.var_file(name))
+    assert not w.fd is None
+    w.start()
+    os.rename(write(tmp_path / "new", ["5220 1", "5221 2"]), name)
+    assert wait(lambda: w.latest.get_g5x(1)[0] == 2.0)
+    fd = w.fd
+    w.stop()
+    assert w.fd is None
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+def test_stop_unstarted(mod, tmp_path):
+    name = write(tmp_path / "a.var", ["5220 1"])
+    w = mod.var_watcher(name, mod.var_file(name))
+    w.stop()
+    assert w.fd is None
+
+# If inotify stops working the watcher closes it and polls
+def test_inotify_lost(mod, tmp_path, monkeypatch):
+    mod.params["var_poll_ms"] = 10
+    name = write(tmp_path / "a.var", ["5220 1", "5221 1"])
+    w = mod.var_watcher(name, mod.var_file(name))
+    fd = w.fd
+    def fail(fds, w, x, timeout):
+        raise OSError("gone")
+    monkeypatch.setattr(mod.select, "select", fail)
+    w.start()
+    assert wait(lambda: w.fd is None)
+    with pytest.raises(OSError):
+        os.fstat(fd)
+    os.rename(write(tmp_path / "new", ["5220 1", "5221 3"]), name)
+    assert wait(lambda: w.latest.get_g5x(1)[0] == 3.0)
+    w.stop()
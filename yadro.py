@@ -18,16 +18,843 @@
 
 from __future__ import print_function
 import sys
-if sys.version_info[0] == 2:
-    import Tkinter as tk
-else:
-    import tkinter as tk
+try:
+    if sys.version_info[0] == 2:
+        import Tkinter as tk
+        import tkFont as tkfont
+    else:
+        import tkinter as tk
+        import tkinter.font as tkfont
+except ImportError:
+    # Only --headless works without Tk
+    tk = None
+import os
+import errno
 import argparse
 import time
+import threading
+import socket
+import select
+import json
+import struct
+import math
+import bisect
+from array import array
+from collections import deque
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 import linuxcnc
 import hal
 
-root = tk.Tk()
+# For hal, messages and the logs, so the code both tools share reads the same
+prog = "yadro"
+root = None
+
+g5x_names = ['G54', 'G55', 'G56', 'G57', 'G58', 'G59', 'G59.1', 'G59.2', 'G59.3']
+# The order of the axes in stat offsets and in the var file
+var_axes = list("XYZABCUVW")
+
+# Latency histogram with fixed buckets, in seconds
+class histogram():
+    bounds = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1.0)
+
+    def __init__(self):
+        self.counts = array('l', [0]) * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.n = 0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.n += 1
+
+# Structured events and metrics. Logging an event is an append to a ring
+# buffer and a counter bump, so it costs the poll loop next to nothing.
+# Once started, a writer thread flushes new events to the --log file as
+# json lines every second. The counters and histograms can also be read
+# as Prometheus text, see metrics_server.
+class event_log(threading.Thread):
+    def __init__(self, prefix, size):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.prefix = prefix
+        self.events = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.written = 0
+        self.counters = dict()
+        self.histograms = dict()
+        self.path = None
+        self.timing = False
+        self.stopped = threading.Event()
+
+    # Starts writing events to path
+    def open(self, path):
+        self.path = path
+        self.start()
+
+    def event(self, name, **fields):
+        with self.lock:
+            self.seq += 1
+            self.events.append((self.seq, time.time(), name, fields))
+            self.counters[name] = self.counters.get(name, 0) + 1
+        if params["very_verbose"]:
+            print(self.prefix, name, fields)
+
+    def observe(self, name, v):
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = histogram()
+            h.observe(v)
+
+    # Events not written yet, oldest first, and how many fell off the ring
+    def pending(self):
+        with self.lock:
+            new = [e for e in self.events if e[0] > self.written]
+            dropped = self.seq - self.written - len(new)
+            self.written = self.seq
+        return new, dropped
+
+    def run(self):
+        while not self.stopped.wait(1.0):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        new, dropped = self.pending()
+        if len(new) == 0 and dropped == 0:
+            return
+        lines = []
+        if dropped > 0:
+            lines.append(json.dumps({"t": time.time(), "event": "log_dropped", "count": dropped}))
+        for seq, t, name, fields in new:
+            d = dict(fields)
+            d["t"] = t
+            d["event"] = name
+            lines.append(json.dumps(d, sort_keys=True))
+        try:
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        except (IOError, OSError) as e:
+            if params["verbose"]:
+                print(self.prefix, "log:", e)
+
+    def prometheus(self):
+        p = self.prefix
+        out = ["# TYPE {}_events_total counter".format(p)]
+        with self.lock:
+            for name in sorted(self.counters):
+                out.append('{}_events_total{{event="{}"}} {}'.format(p, name, self.counters[name]))
+            for name in sorted(self.histograms):
+                h = self.histograms[name]
+                out.append("# TYPE {}_{} histogram".format(p, name))
+                total = 0
+                for i, b in enumerate(h.bounds):
+                    total += h.counts[i]
+                    out.append('{}_{}_bucket{{le="{}"}} {}'.format(p, name, b, total))
+                out.append('{}_{}_bucket{{le="+Inf"}} {}'.format(p, name, h.n))
+                out.append("{}_{}_sum {}".format(p, name, h.sum))
+                out.append("{}_{}_count {}".format(p, name, h.n))
+        return "\n".join(out) + "\n"
+
+    def stop(self):
+        if self.path is None:
+            return
+        self.stopped.set()
+        self.join()
+
+# Serves the event counters and latency histograms as Prometheus text on
+# http://host:port/metrics
+class metrics_server(threading.Thread):
+    def __init__(self, addr):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = log.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = HTTPServer(addr, handler)
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+log = event_log(prog, 1000)
+
+# Counts the Tk updates poll makes and the ones it skips
+class render_stats():
+    def __init__(self):
+        self.applied = 0
+        self.skipped = 0
+        self.polls = 0
+
+    def note(self, changed):
+        if changed:
+            self.applied += 1
+        else:
+            self.skipped += 1
+
+    def poll_done(self):
+        self.polls += 1
+        if params["verbose"] and self.polls % 100 == 0:
+            self.report()
+
+    def report(self):
+        total = self.applied + self.skipped
+        if total == 0:
+            return
+        print("render: {} applied, {} skipped ({:.1f}% skipped) in {} polls".format(
+              self.applied, self.skipped, 100.0 * self.skipped / total, self.polls))
+
+# Runs poll fast while values are moving and backs off when they stop.
+# Any button press or key snaps it back to the fast rate. Without a Tk
+# root it runs poll from run_headless instead.
+class poll_scheduler():
+    def __init__(self, poll):
+        self.poll = poll
+        self.delay = params["fast_ms"]
+        self.after_id = None
+        self.wake_pending = False
+        self.event = None
+        self.running = True
+
+    def backoff(self, changed):
+        if changed:
+            self.delay = params["fast_ms"]
+        else:
+            self.delay = min(params["slow_ms"], int(self.delay * params["backoff"]) + 1)
+        return self.delay
+
+    def start(self):
+        self.after_id = root.after(20, self.run)
+        root.bind_all("<ButtonPress>", self.kick, "+")
+        root.bind_all("<KeyPress>", self.kick, "+")
+
+    # Runs poll and times it, a poll longer than the fast period is an
+    # overrun. With a log or metrics the Tk redraw is timed too.
+    def timed_poll(self):
+        t0 = time.time()
+        changed = self.poll()
+        t1 = time.time()
+        log.observe("poll_seconds", t1 - t0)
+        if (t1 - t0) * 1000.0 > params["fast_ms"]:
+            log.event("poll_overrun", ms=round((t1 - t0) * 1000.0, 1))
+        if changed and log.timing and not root is None:
+            root.update_idletasks()
+            log.observe("tk_update_seconds", time.time() - t1)
+        return changed
+
+    def run(self):
+        self.after_id = root.after(self.backoff(self.timed_poll()), self.run)
+
+    # Runs until finish is called or ^C. The poll after finish still
+    # picks up the last snapshot.
+    def run_headless(self):
+        self.event = threading.Event()
+        try:
+            while True:
+                finishing = not self.running
+                delay = self.backoff(self.timed_poll())
+                if finishing:
+                    break
+                self.event.wait(delay / 1000.0)
+                self.event.clear()
+        except KeyboardInterrupt:
+            pass
+
+    # Ends the program, from any thread: run_headless returns or the Tk
+    # mainloop quits
+    def finish(self):
+        self.running = False
+        if not self.event is None:
+            self.event.set()
+            return
+        try:
+            root.after_idle(root.quit)
+        except RuntimeError:
+            # mainloop has gone away
+            pass
+
+    def kick(self, event=None):
+        self.delay = params["fast_ms"]
+        self.wake_pending = False
+        if not self.after_id is None:
+            root.after_cancel(self.after_id)
+        self.after_id = root.after_idle(self.run)
+
+    # Called from the sampler thread when a new snapshot shows up
+    def wake(self):
+        if not self.event is None:
+            self.event.set()
+            return
+        if self.wake_pending or self.delay <= params["fast_ms"]:
+            return
+        self.wake_pending = True
+        try:
+            root.after_idle(self.kick)
+        except RuntimeError:
+            # mainloop has gone away
+            pass
+
+# A copy of everything the gui needs from linuxcnc.stat and the hal pins.
+# Snapshots are never modified once they are published.
+class snapshot():
+    def __init__(self, s, t, pins, vel, feed, seq, probe_seq=0, prev_state=None):
+        self.seq = seq
+        self.probe_seq = probe_seq
+        self.t = t
+        self.pins = pins
+        self.vel = vel
+        self.feed = feed
+        self.estop = s.estop
+        self.homed = tuple(s.homed)
+        self.axis_mask = s.axis_mask
+        self.task_state = s.task_state
+        self.task_mode = s.task_mode
+        self.interp_state = s.interp_state
+        self.g5x_index = s.g5x_index
+        self.enabled = s.enabled
+        self.linear_units = s.linear_units
+        self.program_units = s.program_units
+        self.g5x_offset = tuple(s.g5x_offset)
+        self.stat_key = (self.estop, self.homed, self.axis_mask, self.task_state,
+                         self.task_mode, self.interp_state, self.g5x_index, self.enabled,
+                         self.program_units, self.g5x_offset)
+        self.key = (tuple(pins), tuple(vel)) + self.stat_key + (probe_seq,)
+        if prev_state is None or prev_state.key != self.stat_key:
+            self.state = derived_state(self)
+        else:
+            self.state = prev_state
+
+    stat_fields = ["estop", "homed", "axis_mask", "task_state", "task_mode",
+                   "interp_state", "g5x_index", "enabled", "linear_units", "program_units",
+                   "g5x_offset"]
+
+    # One json line for a snap_client, remote_stat turns it back into one
+    def encode(self):
+        stat = dict()
+        for f in snapshot.stat_fields:
+            stat[f] = getattr(self, f)
+        return json.dumps({"snap": {"seq": self.seq, "t": self.t, "pins": self.pins,
+                                    "vel": self.vel, "feed": self.feed,
+                                    "stat": stat}}) + "\n"
+
+# What yadro works out from a snapshot's stat fields: the homed mask and
+# the indicator and running flags. The stat fields change far less often
+# than the pins, so a snapshot shares the previous one's derived_state
+# unless they differ. Everything reads these instead of working them out.
+class derived_state():
+    fields = ("estop", "homed_mask", "homed", "enabled", "running", "task_mode", "g5x_index")
+
+    def __init__(self, snap):
+        self.key = snap.stat_key
+        mask = 0
+        for i in range(len(snap.homed)):
+            mask |= (snap.homed[i] << i)
+        self.homed_mask = mask
+        self.homed = mask == snap.axis_mask
+        self.estop = snap.estop != 0
+        self.enabled = snap.task_state == linuxcnc.STATE_ON
+        self.running = (not self.estop and self.enabled and self.homed and
+                        snap.interp_state == linuxcnc.INTERP_IDLE)
+        self.task_mode = snap.task_mode
+        self.g5x_index = snap.g5x_index
+
+    # Names of the fields that differ from prev, all of them if prev is None
+    def diff(self, prev):
+        if prev is None:
+            return list(derived_state.fields)
+        return [f for f in derived_state.fields if getattr(self, f) != getattr(prev, f)]
+
+# Stands in for linuxcnc.stat when a snapshot is rebuilt from its json
+class remote_stat():
+    def __init__(self, stat):
+        for f in snapshot.stat_fields:
+            setattr(self, f, stat[f])
+
+# Fixed size history of timestamped axis positions. One array('d') per axis
+# plus one for the times, overwritten in place so memory never grows.
+class sample_ring():
+    def __init__(self, naxes, size):
+        self.size = size
+        self.t = array('d', [0.0]) * size
+        self.v = [array('d', [0.0]) * size for i in range(naxes)]
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, t, values):
+        with self.lock:
+            i = self.head
+            self.t[i] = t
+            for a in range(len(values)):
+                self.v[a][i] = values[a]
+            self.head = (i + 1) % self.size
+            if self.count < self.size:
+                self.count += 1
+
+    # Ring position of the k'th oldest sample
+    def slot(self, k):
+        return (self.head - self.count + k) % self.size
+
+    # (start, end) slices covering the samples newer than t0, oldest first.
+    # Call with the lock held.
+    def spans(self, t0):
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.t[self.slot(mid)] < t0:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count:
+            return []
+        start = self.slot(lo)
+        end = self.slot(self.count - 1) + 1
+        if start < end:
+            return [(start, end)]
+        return [(start, self.size), (0, end)]
+
+    # Copies of the times and of every axis's values over the last seconds
+    def window(self, seconds, now):
+        ts = array('d')
+        vss = [array('d') for v in self.v]
+        with self.lock:
+            for a, b in self.spans(now - seconds):
+                ts.extend(self.t[a:b])
+                for i in range(len(self.v)):
+                    vss[i].extend(self.v[i][a:b])
+        return ts, vss
+
+    # min, max, mean and sample count of one axis over the last seconds,
+    # None if there are no samples that new. Read straight from the ring
+    # slices, nothing is copied per sample.
+    def stats(self, axis, seconds, now):
+        lo = None
+        hi = None
+        total = 0.0
+        n = 0
+        with self.lock:
+            for a, b in self.spans(now - seconds):
+                vs = self.v[axis][a:b]
+                if lo is None:
+                    lo = min(vs)
+                    hi = max(vs)
+                else:
+                    lo = min(lo, min(vs))
+                    hi = max(hi, max(vs))
+                total += sum(vs)
+                n += len(vs)
+        if n == 0:
+            return None
+        return lo, hi, total / n, n
+
+    # Least squares slope of every axis over the last seconds in units per
+    # second, 0.0 when there aren't two samples to fit
+    def slopes(self, seconds, now):
+        ts, vss = self.window(seconds, now)
+        n = len(ts)
+        rv = [0.0] * len(vss)
+        if n < 2:
+            return rv
+        tm = sum(ts) / n
+        dt = [t - tm for t in ts]
+        stt = sum([d * d for d in dt])
+        if stt == 0.0:
+            return rv
+        for i in range(len(vss)):
+            vm = sum(vss[i]) / n
+            rv[i] = sum([d * (v - vm) for d, v in zip(dt, vss[i])]) / stt
+        return rv
+
+# Where the probe touched. The edge came somewhere between two samples so
+# the positions are taken halfway between them, which halves the worst
+# case error. edge is that point moved by the probe radius along the
+# direction of travel of the linear axes; axis is the one moving fastest.
+# The positions are in the G5x system active at the touch, so its offsets
+# are kept to move the edge into whatever system is active later.
+class probe_capture():
+    def __init__(self, t0, pins0, t1, pins1, vel, g5x_offset):
+        self.t = (t0 + t1) / 2.0
+        self.offset = [g5x_offset[var_axes.index(a.upper())] for a in params["axes"]]
+        self.pos = [(a + b) / 2.0 for a, b in zip(pins0, pins1)]
+        d = [0.0] * len(pins1)
+        for i, a in enumerate(params["axes"]):
+            if a.upper() in "XYZUVW":
+                d[i] = pins1[i] - pins0[i]
+                if d[i] == 0.0:
+                    d[i] = vel[i]
+        n = sum([x * x for x in d]) ** 0.5
+        self.axis = None
+        self.dir = [0.0] * len(d)
+        if n > 0.0:
+            self.dir = [x / n for x in d]
+            mags = [abs(x) for x in d]
+            self.axis = mags.index(max(mags))
+        r = params["probe_radius"]
+        self.edge = [p + r * u for p, u in zip(self.pos, self.dir)]
+
+    # The edge on axis i seen from a G5x system with these offsets
+    def edge_at(self, i, g5x_offset):
+        return self.edge[i] + self.offset[i] - g5x_offset[var_axes.index(params["axes"][i].upper())]
+
+# Hole positions for a bolt circle, a line of holes or a grid, worked out
+# once when the pattern is set and kept as x, y pairs in a flat array.
+#   circle X Y DIAMETER HOLES [START_ANGLE]
+#   line X Y ANGLE SPACING HOLES
+#   grid X Y DX DY COLUMNS ROWS
+# Grids are walked back and forth a row at a time to keep the moves short.
+class hole_pattern():
+    def __init__(self, spec):
+        fields = spec.split()
+        if len(fields) == 0:
+            raise ValueError("empty pattern")
+        kind = fields[0].lower()
+        a = [float(f) for f in fields[1:]]
+        self.spec = spec
+        self.points = array('d')
+        if kind == "circle" and len(a) in (4, 5):
+            x, y, r, n = a[0], a[1], a[2] / 2.0, int(a[3])
+            start = a[4] if len(a) == 5 else 0.0
+            for i in range(n):
+                ang = math.radians(start + 360.0 * i / n)
+                self.points.extend((x + r * math.cos(ang), y + r * math.sin(ang)))
+        elif kind == "line" and len(a) == 5:
+            x, y, ang, s, n = a[0], a[1], math.radians(a[2]), a[3], int(a[4])
+            dx, dy = s * math.cos(ang), s * math.sin(ang)
+            for i in range(n):
+                self.points.extend((x + i * dx, y + i * dy))
+        elif kind == "grid" and len(a) == 6:
+            x, y, dx, dy, nx, ny = a[0], a[1], a[2], a[3], int(a[4]), int(a[5])
+            for j in range(ny):
+                cols = range(nx) if j % 2 == 0 else range(nx - 1, -1, -1)
+                for i in cols:
+                    self.points.extend((x + i * dx, y + j * dy))
+        else:
+            raise ValueError("bad pattern: " + spec)
+        self.n = len(self.points) // 2
+        if self.n == 0:
+            raise ValueError("no holes: " + spec)
+
+    def point(self, i):
+        return self.points[2 * i], self.points[2 * i + 1]
+
+# mm in each of stat.program_units: inch, mm and cm
+program_mm = {1: 25.4, 2: 1.0, 3: 10.0}
+
+# The first two linear axes, the plane patterns are laid out in
+def pattern_axes():
+    axes = [i for i, a in enumerate(params["axes"]) if a.upper() in "XYZUVW"]
+    return axes[:2]
+
+# Samples stat and the hal pins every sample_ms off the Tk thread. A new
+# snapshot is published only when something changed, by swapping the
+# latest reference, so the gui never waits on the stat channel.
+class sampler(threading.Thread):
+    def __init__(self, lcnc):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lcnc = lcnc
+        self.latest = lcnc.sample(0)
+        self.wake = None
+        self.running = True
+
+    # Samples every probe_ms while the probe is armed
+    def run(self):
+        period = params["sample_ms"] / 1000.0
+        probe_period = params["probe_ms"] / 1000.0
+        while self.running:
+            snap = self.lcnc.sample(self.latest.seq + 1)
+            if snap.key != self.latest.key:
+                self.latest = snap
+                if not self.wake is None:
+                    self.wake()
+            if self.lcnc.armed:
+                time.sleep(probe_period)
+            else:
+                time.sleep(period)
+
+    def stop(self):
+        self.running = False
+
+# A Linuxcnc parameter (.var) file, read once into a flat array indexed
+# by parameter number. Comments, blank lines and lines that don't parse
+# are skipped. present[n] is 1 for parameters that were in the file.
+class var_file():
+    max_params = 5602
+    g92_enable = 5210
+    g92_base = 5211
+    g5x_index = 5220
+    g5x_base = 5221
+    g5x_stride = 20
+    tool_base = 5401
+
+    def __init__(self, name):
+        self.name = name
+        self.values = array('d', [0.0]) * var_file.max_params
+        self.present = bytearray(var_file.max_params)
+        self.skipped = 0
+        self.mtime = os.path.getmtime(name)
+        with open(name, 'r') as f:
+            text = f.read()
+        for line_no, line in enumerate(text.splitlines(), 1):
+            fields = line.split()
+            if len(fields) == 0 or fields[0][0] in "#;(":
+                continue
+            try:
+                idx = int(fields[0])
+                v = float(fields[1])
+                if idx < 1 or idx >= var_file.max_params:
+                    raise ValueError
+            except (ValueError, IndexError):
+                self.skipped += 1
+                if params["verbose"]:
+                    print(prog + ":", name, "line", line_no, "skipped:", line.strip())
+                continue
+            self.values[idx] = v
+            self.present[idx] = 1
+
+    def get(self, idx, default=0.0):
+        if 0 < idx < var_file.max_params and self.present[idx]:
+            return self.values[idx]
+        return default
+
+    def has(self, idx):
+        return 0 < idx < var_file.max_params and self.present[idx] != 0
+
+    # True if this file has every parameter from lo up to hi that old has.
+    # A file read while Linuxcnc was still writing it is missing the ones
+    # past the cut.
+    def covers(self, old, lo=5200, hi=5400):
+        for idx in range(lo, hi):
+            if old.present[idx] and not self.present[idx]:
+                return False
+        return True
+
+    # Nine values, one for each of XYZABCUVW
+    def get_axes(self, base):
+        return list(self.values[base:base + 9])
+
+    # n is 1 for G54 ... 9 for G59.3
+    def get_g5x(self, n):
+        return self.get_axes(var_file.g5x_base + (n - 1) * var_file.g5x_stride)
+
+    # All zero unless G92 offsets are turned on
+    def get_g92(self):
+        if self.get(var_file.g92_enable) == 0.0:
+            return [0.0] * 9
+        return self.get_axes(var_file.g92_base)
+
+    def get_tool_offset(self):
+        return self.get_axes(var_file.tool_base)
+
+    def get_g5x_index(self):
+        return int(self.get(var_file.g5x_index, 1.0))
+
+# Parses the var file again when Linuxcnc rewrites it. Linuxcnc renames a
+# new file over the old one so inotify watches the directory; without
+# inotify the mtime and size are checked every var_poll_ms, and the file
+# is only parsed once they have stayed the same for two checks. A new file
+# missing any of the 52xx parameters the old one had is taken to be half
+# written and dropped. A good one is published in latest and picked up by
+# the engine's poll.
+class var_watcher(threading.Thread):
+    IN_CLOSE_WRITE = 0x08
+    IN_MOVED_TO = 0x80
+
+    def __init__(self, path, vf):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.latest = vf
+        self.stamp = self.file_stamp()
+        self.pending = None
+        self.wake = None
+        self.running = True
+        self.fd = self.inotify_watch()
+
+    def file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    # Returns an inotify fd watching the file's directory, None if there
+    # is no inotify
+    def inotify_watch(self):
+        fd = -1
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init()
+            if fd < 0:
+                return None
+            d = os.path.dirname(os.path.abspath(self.path)).encode()
+            mask = var_watcher.IN_CLOSE_WRITE | var_watcher.IN_MOVED_TO
+            if libc.inotify_add_watch(fd, d, mask) < 0:
+                os.close(fd)
+                return None
+        except Exception:
+            if fd >= 0:
+                os.close(fd)
+            return None
+        if params["verbose"]:
+            print(prog + ": watching", self.path, "with inotify")
+        return fd
+
+    def run(self):
+        period = params["var_poll_ms"] / 1000.0
+        while self.running:
+            if self.fd is None:
+                time.sleep(period)
+            else:
+                # The timeout only matters for stop()
+                try:
+                    r, w, x = select.select([self.fd], [], [], 1.0)
+                    if len(r) == 0:
+                        continue
+                    os.read(self.fd, 4096)
+                except (select.error, OSError) as e:
+                    print(prog + ": inotify failed, polling", self.path, e)
+                    self.close()
+                    continue
+            self.check()
+
+    def close(self):
+        if not self.fd is None:
+            os.close(self.fd)
+            self.fd = None
+
+    def check(self):
+        stamp = self.file_stamp()
+        if stamp is None or stamp == self.stamp:
+            return
+        if self.fd is None and stamp != self.pending:
+            self.pending = stamp
+            return
+        try:
+            vf = var_file(self.path)
+        except (IOError, OSError, UnicodeDecodeError) as e:
+            if params["verbose"]:
+                print(prog + ": reload of", self.path, "failed:", e)
+            return
+        self.stamp = stamp
+        if not vf.covers(self.latest):
+            if params["verbose"]:
+                print(prog + ":", self.path, "is incomplete, keeping the old one")
+            return
+        if params["verbose"]:
+            print(prog + ": reloaded", self.path)
+        self.latest = vf
+        if not self.wake is None:
+            self.wake()
+
+    # Waits for run to see running go False so the fd isn't closed under
+    # its select
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join()
+        self.close()
+
+# One queued command and how it went. status is pending, done, failed
+# or timeout. state is None for MDI commands or the task state to set.
+class lc_cmd():
+    def __init__(self, text, state=None):
+        self.text = text
+        self.state = state
+        self.status = "pending"
+        self.t = time.time()
+
+# Runs commands on a worker thread so the gui never sits in wait_complete.
+# A command identical to the one just queued (or running) is merged with it.
+class cmd_queue(threading.Thread):
+    def __init__(self, lcnc):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lcnc = lcnc
+        self.cv = threading.Condition()
+        self.waiting = []
+        self.current = None
+        self.last = None
+        self.seq = 0
+        self.wake = None
+        self.running = True
+
+    def send(self, text, state=None):
+        with self.cv:
+            if len(self.waiting) > 0:
+                tail = self.waiting[-1]
+            else:
+                tail = self.current
+            if not tail is None and tail.text == text:
+                if params["verbose"]:
+                    print("cmd_queue: merged", text)
+                log.event("mdi_merged", text=text)
+                return tail
+            cmd = lc_cmd(text, state)
+            log.event("mdi_sent", text=text)
+            self.waiting.append(cmd)
+            self.set_last(cmd)
+            self.cv.notify()
+            return cmd
+
+    def set_last(self, cmd):
+        self.last = cmd
+        self.seq += 1
+        if not self.wake is None:
+            self.wake()
+
+    def get_status(self):
+        if self.last is None:
+            return None
+        return self.last.status
+
+    def run(self):
+        while True:
+            with self.cv:
+                while self.running and len(self.waiting) == 0:
+                    self.cv.wait()
+                if not self.running:
+                    return
+                cmd = self.waiting.pop(0)
+                self.current = cmd
+            status = self.lcnc.execute(cmd)
+            with self.cv:
+                cmd.status = status
+                self.current = None
+                if self.last is cmd:
+                    self.set_last(cmd)
+            dt = time.time() - cmd.t
+            log.event("mdi_" + status, text=cmd.text, ms=round(dt * 1000.0, 1))
+            log.observe("mdi_seconds", dt)
+            if status != "done" or params["verbose"]:
+                print("cmd_queue:", cmd.text, status, "{:.3f}s".format(dt))
+
+    def stop(self):
+        with self.cv:
+            self.running = False
+            self.cv.notify()
 
 # Linux cnc interface
 class lc():
@@ -36,83 +863,1227 @@ class lc():
             self.s = linuxcnc.stat()
             self.s.poll()
             self.c = linuxcnc.command()
-            self.h = hal.component("yadro")
-            for p in range(params['naxes']):
-                self.h.newpin(str(p), hal.HAL_FLOAT, hal.HAL_IN)
+            self.h = hal.component(prog)
+            self.new_pins()
             self.h.ready()
         except:
             exit(1)
+        self.setup(sampler if params["sample_ms"] > 0 else None)
 
-    def poll(self):
+    # Creates yadro's pins on self.h
+    def new_pins(self):
+        self.pin_names = [str(p) for p in range(params['naxes'])]
+        for pin in self.pin_names:
+            self.h.newpin(pin, hal.HAL_FLOAT, hal.HAL_IN)
+        if params["velocity"]:
+            self.vels = ["vel."+str(p) for p in range(params["naxes"])]
+            for pin in self.vels:
+                self.h.newpin(pin, hal.HAL_FLOAT, hal.HAL_OUT)
+            self.h.newpin("feed", hal.HAL_FLOAT, hal.HAL_OUT)
+        self.positions = ["pos."+str(p) for p in range(params["naxes"])]
+        for pin in self.positions:
+            self.h.newpin(pin, hal.HAL_FLOAT, hal.HAL_OUT)
+        self.h.newpin("g5x-index", hal.HAL_S32, hal.HAL_OUT)
+        self.h.newpin("units-mm", hal.HAL_BIT, hal.HAL_OUT)
+        self.h.newpin("estop", hal.HAL_BIT, hal.HAL_OUT)
+        self.h.newpin("homed", hal.HAL_BIT, hal.HAL_OUT)
+        self.h.newpin("enabled", hal.HAL_BIT, hal.HAL_OUT)
+        self.h.newpin("running", hal.HAL_BIT, hal.HAL_OUT)
+        if params["probe"]:
+            self.h.newpin("probe", hal.HAL_BIT, hal.HAL_IN)
+
+    # source takes the sampler's place, None samples from poll
+    def setup(self, source):
+        # Velocities are refit about as often as the display can show them
+        self.history = None
+        if params["velocity"]:
+            self.history = sample_ring(params["naxes"], params["history"])
+        self.vel = [0.0] * params["naxes"]
+        self.feed = 0.0
+        self.vel_every = max(1, params["fast_ms"] // max(params["sample_ms"], 1))
+        self.vel_count = 0
+        self.linear = [a.upper() in "XYZUVW" for a in params["axes"]]
+        self.armed = False
+        self.capture = None
+        self.probe_seq = 0
+        self.last_probe = False
+        self.prev_sample = None
+        self.last_state = None
+        self.seen_state = None
+        self.changed = []
+        self.subscribers = dict()
+        self.clock = time.time
+        self.recorder = None
+        if not params["record"] is None:
+            self.recorder = recorder(params["record"], params["record_size"])
+        self.sampler = None
+        if not source is None:
+            self.sampler = source(self)
+            self.snap = self.sampler.latest
+            self.sampler.start()
+        else:
+            self.snap = self.sample(0)
+        self.cmds = cmd_queue(self)
+        self.cmds.start()
+
+    def stop(self):
+        if not self.sampler is None:
+            self.sampler.stop()
+        self.cmds.stop()
+        if not self.recorder is None:
+            self.recorder.close()
+
+    # Runs on the sampler thread unless sample_ms is 0
+    def sample(self, seq):
+        t = self.clock()
         self.s.poll()
+        pins = [self.h[pin] for pin in self.pin_names]
+        if not self.recorder is None:
+            self.recorder.add(t, pins, params["probe"] and self.h["probe"] != 0, self.s)
+        if not self.history is None:
+            self.history.add(t, pins)
+            self.vel_count += 1
+            if self.vel_count >= self.vel_every:
+                self.vel_count = 0
+                self.update_vel(t)
+        if params["probe"]:
+            self.check_probe(t, pins)
+        snap = snapshot(self.s, t, pins, self.vel, self.feed, seq, self.probe_seq,
+                        self.last_state)
+        self.last_state = snap.state
+        self.set_outputs(snap)
+        return snap
 
-    def is_homed(self):
-        mask = 0
-        for i in range(len(self.s.homed)):
-            mask |= (self.s.homed[i] << i)
-        return mask == self.s.axis_mask
+    # Latches a probe_capture when the probe pin goes true while armed
+    def check_probe(self, t, pins):
+        probe = self.h["probe"] != 0
+        if probe and not self.last_probe and self.armed and not self.prev_sample is None:
+            t0, pins0 = self.prev_sample
+            self.capture = probe_capture(t0, pins0, t, pins, self.vel, self.s.g5x_offset)
+            self.armed = False
+            if not self.recorder is None:
+                self.recorder.arm(t, False)
+            self.probe_seq += 1
+            if params["verbose"]:
+                print("probe: edge at", self.capture.edge, "axis", self.capture.axis)
+            log.event("probe", axis=self.capture.axis, edge=self.capture.edge)
+        self.last_probe = probe
+        self.prev_sample = (t, pins)
 
-    def is_running(self):
-        rv = (not self.s.estop and
-              self.s.task_state == linuxcnc.STATE_ON and
-              self.is_homed() and
-              (self.s.interp_state == linuxcnc.INTERP_IDLE))
-        return rv
+    def arm_probe(self, on):
+        self.armed = on
+        if not self.recorder is None:
+            self.recorder.arm(self.clock(), on)
+
+    # Whether the probe is armed and the last capture
+    def get_probe(self):
+        return self.armed, self.capture
+
+    # Publishes what the display shows so other components don't have to
+    # work it out again
+    def set_outputs(self, snap):
+        for i in range(len(snap.pins)):
+            self.h[self.positions[i]] = snap.pins[i]
+        self.h["g5x-index"] = snap.g5x_index
+        self.h["units-mm"] = snap.linear_units > 0.5
+        state = snap.state
+        self.h["estop"] = state.estop
+        self.h["homed"] = state.homed
+        self.h["enabled"] = state.enabled
+        self.h["running"] = state.running
+
+    # Refits the velocities and publishes them on the hal pins
+    def update_vel(self, t):
+        vel = self.history.slopes(params["vel_window"], t)
+        feed2 = 0.0
+        for i in range(len(vel)):
+            self.h[self.vels[i]] = vel[i]
+            if self.linear[i]:
+                feed2 += vel[i] * vel[i]
+        self.vel = vel
+        self.feed = feed2 ** 0.5
+        self.h["feed"] = self.feed
+
+    # Picks up the newest snapshot, everything below reads from it
+    def poll(self):
+        if self.sampler is None:
+            snap = self.sample(self.snap.seq + 1)
+            if snap.key != self.snap.key:
+                self.snap = snap
+        else:
+            self.snap = self.sampler.latest
+        self.check_state()
+
+    # Notes which derived fields changed since the last poll and tells
+    # their subscribers
+    def check_state(self):
+        state = self.snap.state
+        if state is self.seen_state:
+            self.changed = []
+            return
+        self.changed = state.diff(self.seen_state)
+        self.seen_state = state
+        for f in self.changed:
+            for callback in self.subscribers.get(f, []):
+                callback(f, getattr(state, f))
+
+    # callback(name, value) runs from poll each time field name changes,
+    # and once for the first snapshot
+    def subscribe(self, name, callback):
+        self.subscribers.setdefault(name, []).append(callback)
 
+    def get_state(self):
+        return self.snap.state
+
+    # The newest snapshot without polling, for other threads
+    def latest(self):
+        if self.sampler is None:
+            return self.snap
+        return self.sampler.latest
+
+    # These look at the latest snapshot unless they're handed one
+    def is_homed(self, snap=None):
+        if snap is None:
+            snap = self.snap
+        return snap.state.homed
+
+    def is_running(self, snap=None):
+        if snap is None:
+            snap = self.snap
+        return snap.state.running
+
+    # Queues s and returns its lc_cmd, or None if the machine isn't ready
     def send_mdi(self, s):
         if params["verbose"]:
             print("send_mdi:", s)
         if self.is_running():
-            if not self.s.task_mode == linuxcnc.MODE_MDI:
-                self.c.mode(linuxcnc.MODE_MDI)
-                self.c.wait_complete()
-            self.c.mdi(s)
+            return self.cmds.send(s)
         else:
             print("can't send", s)
+            return None
+
+    # Runs on the cmd_queue thread, the only user of self.c. An MDI that
+    # is still running when the timeout is up, like a long G0 to a hole,
+    # was accepted and counts as done; the machine isn't running again
+    # until the interpreter goes idle.
+    def execute(self, cmd):
+        timeout = params["mdi_timeout"]
+        if not cmd.state is None:
+            self.c.state(cmd.state)
+        else:
+            if not self.snap.task_mode == linuxcnc.MODE_MDI:
+                self.c.mode(linuxcnc.MODE_MDI)
+                if self.c.wait_complete(timeout) == -1:
+                    return "timeout"
+            self.c.mdi(cmd.text)
+        rv = self.c.wait_complete(timeout)
+        if rv == -1:
+            if cmd.state is None and self.latest().interp_state != linuxcnc.INTERP_IDLE:
+                return "done"
+            return "timeout"
+        if rv == linuxcnc.RCS_ERROR:
+            return "failed"
+        return "done"
+
+    def get_cmd_seq(self):
+        return self.cmds.seq
+
+    def get_cmd_status(self):
+        return self.cmds.get_status()
 
     def get_g5x_index(self):
-        if params["very_verbose"]:
-            print("g5x_index:", self.s.g5x_index)
-        return self.s.g5x_index
+        return self.snap.state.g5x_index
+
+    def get_task_mode(self):
+        return self.snap.state.task_mode
+
+    # What a linear machine unit is in the units G words are read in, G20
+    # or G21. linear_units is machine units per mm.
+    def get_program_scale(self):
+        snap = self.snap
+        mm = program_mm.get(snap.program_units)
+        if mm is None:
+            return 1.0
+        # Divided in this order it comes out exactly 1.0 when the units match
+        return (1.0 / snap.linear_units) / mm
+
+    # Offsets of the active G5x system, nine values for XYZABCUVW
+    def get_g5x_offset(self):
+        return self.snap.g5x_offset
+
+    def get_seq(self):
+        return self.snap.seq
 
     def get_pins(self):
-        pins = [self.h[str(p)] for p in range(params['naxes'])]
-        if params["very_verbose"]:
-            print("pins:", pins)
-        return pins
+        return self.snap.pins
 
-    def get_indicators(self):
-        if params["very_verbose"]:
-            print("get indicators:", self.s.estop, self.s.homed, self.s.task_state)
-        estop = self.s.estop != 0
-        homed = self.is_homed()
-        enabled = self.s.task_state == linuxcnc.STATE_ON
-        return estop, homed, enabled
+    # Units per second
+    def get_velocities(self):
+        return self.snap.vel, self.snap.feed
+
+    def get_indicators(self, snap=None):
+        if snap is None:
+            snap = self.snap
+        state = snap.state
+        return state.estop, state.homed, state.enabled
 
     def set_enable(self, on):
         if params["verbose"]:
             print("set_enable:", on)
-        if (self.s.enabled > 0) == on:
+        if (self.snap.enabled > 0) == on:
             return
         if on:
-            self.c.state(linuxcnc.STATE_ON)
+            self.cmds.send("state on", linuxcnc.STATE_ON)
         else:
-            self.c.state(linuxcnc.STATE_OFF)
+            self.cmds.send("state off", linuxcnc.STATE_OFF)
+
+# Shares this lc with other yadro windows. Clients connect to a Unix
+# socket and get a json line for every new snapshot. They send back the
+# commands to queue and get a line back when each one is finished.
+class snap_server(threading.Thread):
+    def __init__(self, lcnc, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lcnc = lcnc
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(5)
+        self.clients = dict()
+        self.cmds = []
+        self.running = True
+
+    def run(self):
+        period = max(params["sample_ms"], 5) / 1000.0
+        last_seq = None
+        while self.running:
+            r, w, x = select.select([self.sock] + list(self.clients), [], [], period)
+            for conn in r:
+                if conn is self.sock:
+                    self.accept()
+                else:
+                    self.receive(conn)
+            snap = self.lcnc.latest()
+            if snap.seq != last_seq:
+                last_seq = snap.seq
+                line = snap.encode().encode()
+                for conn in list(self.clients):
+                    self.send(conn, line)
+            self.finish_cmds()
+        for conn in list(self.clients):
+            self.drop(conn)
+        self.sock.close()
+        os.unlink(self.path)
+
+    def accept(self):
+        conn, addr = self.sock.accept()
+        conn.settimeout(1.0)
+        self.clients[conn] = b""
+        if params["verbose"]:
+            print("snap_server: client", len(self.clients), "attached")
+        log.event("client_attached", clients=len(self.clients))
+        hello = {"hello": {"axes": "".join(params["axes"])}}
+        self.send(conn, (json.dumps(hello) + "\n").encode())
+        self.send(conn, self.lcnc.latest().encode().encode())
+
+    def drop(self, conn):
+        if not conn in self.clients:
+            return
+        del self.clients[conn]
+        conn.close()
+        self.cmds = [c for c in self.cmds if not c[0] is conn]
+        if params["verbose"]:
+            print("snap_server: client detached,", len(self.clients), "left")
+        log.event("client_detached", clients=len(self.clients))
+
+    # A client that can't keep up or has gone away is dropped
+    def send(self, conn, line):
+        try:
+            conn.sendall(line)
+        except (socket.error, OSError):
+            self.drop(conn)
+
+    def receive(self, conn):
+        try:
+            data = conn.recv(4096)
+        except (socket.error, OSError):
+            data = b""
+        if len(data) == 0:
+            self.drop(conn)
+            return
+        lines = (self.clients[conn] + data).split(b"\n")
+        self.clients[conn] = lines[-1]
+        for line in lines[:-1]:
+            try:
+                self.handle(conn, json.loads(line.decode()))
+            except (ValueError, KeyError, TypeError) as e:
+                print("snap_server: bad request", line, e)
+
+    # MDI commands are only queued if the machine is ready here too
+    def handle(self, conn, msg):
+        if params["verbose"]:
+            print("snap_server:", msg)
+        cmd = None
+        if not msg["state"] is None or self.lcnc.is_running(self.lcnc.latest()):
+            cmd = self.lcnc.cmds.send(msg["text"], msg["state"])
+        self.cmds.append((conn, msg["id"], cmd))
+
+    def finish_cmds(self):
+        waiting = []
+        for conn, cmd_id, cmd in self.cmds:
+            if not cmd is None and cmd.status == "pending":
+                waiting.append((conn, cmd_id, cmd))
+                continue
+            status = "failed"
+            if not cmd is None:
+                status = cmd.status
+            self.send(conn, (json.dumps({"cmd": cmd_id, "status": status}) + "\n").encode())
+        self.cmds = [c for c in waiting if c[0] in self.clients]
+
+    def stop(self):
+        self.running = False
+
+# Reads snapshots and command results from a snap_server for a remote_lc.
+# It takes the sampler's place, latest and wake work the same way. If the
+# server goes away it keeps trying to attach again.
+class snap_client(threading.Thread):
+    def __init__(self, lcnc, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lcnc = lcnc
+        self.path = path
+        self.lock = threading.Lock()
+        self.wake = None
+        self.finished = None
+        self.done = False
+        self.running = True
+        self.seq = 0
+        self.last_state = None
+        if not self.attach():
+            if not self.done:
+                print(prog + ": Could not attach to", path)
+            exit(1)
+
+    # Connects and reads the hello and the first snapshot
+    def attach(self):
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.path)
+            self.f = self.sock.makefile('rb')
+            hello = json.loads(self.f.readline().decode())["hello"]
+            if hello["axes"] != "".join(params["axes"]):
+                print(prog + ": server axes are", hello["axes"])
+                self.done = True
+                return False
+            self.latest = self.decode(json.loads(self.f.readline().decode())["snap"])
+        except (socket.error, OSError, ValueError, KeyError):
+            return False
+        if params["verbose"]:
+            print("snap_client: attached to", self.path)
+        return True
+
+    # Local sequence numbers so they keep going up across a reattach
+    def decode(self, d):
+        self.seq += 1
+        snap = snapshot(remote_stat(d["stat"]), d["t"], d["pins"], d["vel"],
+                        d["feed"], self.seq, 0, self.last_state)
+        self.last_state = snap.state
+        return snap
+
+    def handle(self, msg):
+        if "snap" in msg:
+            self.latest = self.decode(msg["snap"])
+        elif "cmd" in msg:
+            self.lcnc.cmds.done(msg["cmd"], msg["status"])
+
+    # A line that doesn't parse is handled like a lost connection. If the
+    # server comes back with other axes the client gives up and calls
+    # finished, the window can't show them.
+    def run(self):
+        while self.running:
+            try:
+                line = self.f.readline()
+                if len(line) > 0:
+                    self.handle(json.loads(line.decode()))
+            except (socket.error, OSError, ValueError, KeyError, TypeError) as e:
+                if params["verbose"]:
+                    print("snap_client:", e)
+                line = b""
+            if len(line) == 0:
+                if not self.running:
+                    return
+                print(prog + ": lost", self.path)
+                self.lcnc.cmds.lost()
+                self.close()
+                while self.running and not self.attach():
+                    if self.done:
+                        self.running = False
+                        if not self.finished is None:
+                            self.finished()
+                        return
+                    time.sleep(1.0)
+            if not self.wake is None:
+                self.wake()
+
+    def close(self):
+        try:
+            self.f.close()
+            self.sock.close()
+        except (socket.error, OSError):
+            pass
+
+    def send(self, msg):
+        with self.lock:
+            try:
+                self.sock.sendall((json.dumps(msg) + "\n").encode())
+                return True
+            except (socket.error, OSError):
+                return False
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, OSError):
+            pass
+
+# Takes cmd_queue's place in a remote_lc. Commands go to the snap_server
+# and their lc_cmd is finished when its result comes back.
+class remote_cmds():
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.sent = dict()
+        self.next_id = 0
+        self.last = None
+        self.seq = 0
+        self.wake = None
+
+    def send(self, text, state=None):
+        with self.lock:
+            if not self.last is None and self.last.status == "pending" and self.last.text == text:
+                return self.last
+            cmd = lc_cmd(text, state)
+            self.next_id += 1
+            self.sent[self.next_id] = cmd
+            self.last = cmd
+            self.seq += 1
+            msg = {"id": self.next_id, "text": text, "state": state}
+        if not self.client.send(msg):
+            self.done(msg["id"], "failed")
+        return cmd
+
+    def done(self, cmd_id, status):
+        with self.lock:
+            cmd = self.sent.pop(cmd_id, None)
+            if cmd is None:
+                return
+            cmd.status = status
+            if self.last is cmd:
+                self.seq += 1
+        if status != "done" or params["verbose"]:
+            print("remote_cmds:", cmd.text, status,
+                  "{:.3f}s".format(time.time() - cmd.t))
+        if not self.wake is None:
+            self.wake()
+
+    # The server went away with these still running
+    def lost(self):
+        with self.lock:
+            ids = list(self.sent)
+        for cmd_id in ids:
+            self.done(cmd_id, "failed")
+
+    def get_status(self):
+        if self.last is None:
+            return None
+        return self.last.status
+
+    def stop(self):
+        pass
+
+# An lc that reads everything from a snap_server instead of hal and
+# linuxcnc.stat. The server publishes the output pins.
+class remote_lc(lc):
+    def __init__(self, path):
+        self.armed = False
+        self.capture = None
+        self.recorder = None
+        self.seen_state = None
+        self.changed = []
+        self.subscribers = dict()
+        self.sampler = snap_client(self, path)
+        self.cmds = remote_cmds(self.sampler)
+        self.snap = self.sampler.latest
+        self.sampler.start()
+
+    def poll(self):
+        self.snap = self.sampler.latest
+        self.check_state()
+
+    def stop(self):
+        self.sampler.stop()
+
+# The record log, written by --record and read back by --replay. A header
+# with the axes, then a record for each sample that changed something: a
+# kind byte and the sample time, then
+#   REC_STAT    the linuxcnc.stat fields yadro uses, when any of them change
+#   REC_PINS    a flags byte (1 is the probe pin), then a double per axis
+#   REC_ARM     a byte, 1 when the probe was armed and 0 when it was disarmed
+# A stat record is always followed by a pins record. Replay takes one
+# sample for each pins record.
+REC_STAT = 1
+REC_PINS = 2
+REC_ARM = 3
+rec_magic = b"YDRO"
+rec_version = 2
+rec_header = struct.Struct("!4sBB9s")
+rec_head = struct.Struct("!Bd")
+rec_stat = struct.Struct("!BBIIBBBBBdB9d")
+rec_arm = struct.Struct("!B")
+
+def rec_pins(naxes):
+    return struct.Struct("!B{}d".format(naxes))
+
+# Appends samples to the record log from the sampler thread. Writes are
+# buffered and flushed about once a second. When the file passes limit
+# kilobytes it is renamed to path.1, replacing the one before, and a new
+# file is started with the current stat and pins, so no more than twice
+# the limit is ever on disk.
+class recorder():
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit * 1024
+        self.pins = rec_pins(params["naxes"])
+        self.lock = threading.Lock()
+        self.last_stat = None
+        self.last_pins = None
+        self.last_arm = False
+        try:
+            self.start()
+        except (IOError, OSError) as e:
+            print(prog + ": can't record to", path, e)
+            exit(1)
+
+    def start(self):
+        self.f = open(self.path, "wb")
+        self.f.write(rec_header.pack(rec_magic, rec_version, params["naxes"],
+                                     "".join(params["axes"]).encode()))
+        self.size = rec_header.size
+        self.flushed = time.time()
+
+    def write(self, kind, t, payload):
+        self.f.write(rec_head.pack(kind, t))
+        self.f.write(payload)
+        self.size += rec_head.size + len(payload)
+
+    def add(self, t, pins, probe, s):
+        homed = tuple(s.homed)
+        mask = 0
+        for i in range(len(homed)):
+            mask |= (homed[i] != 0) << i
+        stat = rec_stat.pack(s.estop, len(homed), mask, s.axis_mask, s.task_state,
+                             s.task_mode, s.interp_state, s.g5x_index, s.enabled,
+                             s.linear_units, s.program_units, *tuple(s.g5x_offset)[:9])
+        pins = self.pins.pack(probe, *pins)
+        with self.lock:
+            if self.f is None:
+                return
+            if stat != self.last_stat:
+                self.write(REC_STAT, t, stat)
+                self.last_stat = stat
+            elif pins == self.last_pins:
+                return
+            self.write(REC_PINS, t, pins)
+            self.last_pins = pins
+            try:
+                if self.size >= self.limit:
+                    self.rotate(t)
+                elif time.time() - self.flushed >= 1.0:
+                    self.f.flush()
+                    self.flushed = time.time()
+            except (IOError, OSError) as e:
+                print(prog + ": recording stopped,", e)
+                self.f = None
+
+    def rotate(self, t):
+        self.f.close()
+        os.rename(self.path, self.path + ".1")
+        self.start()
+        self.write(REC_STAT, t, self.last_stat)
+        self.write(REC_PINS, t, self.last_pins)
+        if self.last_arm:
+            self.write(REC_ARM, t, rec_arm.pack(True))
+        log.event("record_rotated", path=self.path)
+
+    # Arming is recorded so a replay latches the same touches
+    def arm(self, t, on):
+        with self.lock:
+            if self.f is None:
+                return
+            self.write(REC_ARM, t, rec_arm.pack(on))
+            self.last_arm = on
+
+    def close(self):
+        with self.lock:
+            if not self.f is None:
+                self.f.close()
+                self.f = None
+
+# Reads a record log back, checking it was made with the same axes
+class replay_log():
+    def __init__(self, path):
+        try:
+            with open(path, "rb") as f:
+                self.data = f.read()
+            magic, version, naxes, axes = rec_header.unpack_from(self.data, 0)
+        except (IOError, OSError, struct.error) as e:
+            print(prog + ": can't replay", path, e)
+            exit(1)
+        axes = axes[:naxes].decode()
+        if magic != rec_magic:
+            print(prog + ":", path, "is not a " + prog + " record log")
+            exit(1)
+        if version != rec_version:
+            print(prog + ":", path, "was recorded by another version of " + prog)
+            exit(1)
+        if axes != "".join(params["axes"]):
+            print(prog + ":", path, "was recorded with axes", axes)
+            exit(1)
+        self.pins = rec_pins(naxes)
+
+    # (kind, t, fields) for each record, a cut off last record is dropped
+    def records(self):
+        off = rec_header.size
+        sizes = {REC_STAT: rec_stat, REC_PINS: self.pins, REC_ARM: rec_arm}
+        while off + rec_head.size <= len(self.data):
+            kind, t = rec_head.unpack_from(self.data, off)
+            off += rec_head.size
+            body = sizes.get(kind)
+            if body is None or off + body.size > len(self.data):
+                return
+            yield kind, t, body.unpack_from(self.data, off)
+            off += body.size
+
+# Stand in for linuxcnc.stat during a replay, the replayer sets the fields
+class replay_stat():
+    def __init__(self):
+        self.estop = 0
+        self.homed = (0,) * 9
+        self.axis_mask = 0
+        self.task_state = linuxcnc.STATE_ESTOP
+        self.task_mode = linuxcnc.MODE_MANUAL
+        self.interp_state = linuxcnc.INTERP_IDLE
+        self.g5x_index = 1
+        self.enabled = 0
+        self.linear_units = 1.0
+        self.program_units = 2
+        self.g5x_offset = (0.0,) * 9
+
+    def poll(self):
+        pass
+
+    def set(self, fields):
+        (self.estop, nhomed, mask, self.axis_mask, self.task_state, self.task_mode,
+         self.interp_state, self.g5x_index, self.enabled, self.linear_units,
+         self.program_units) = fields[:11]
+        self.homed = tuple((mask >> i) & 1 for i in range(nhomed))
+        self.g5x_offset = fields[11:]
+
+# Stand in for hal.component during a replay. Inputs come from the log,
+# outputs are kept but go nowhere.
+class replay_component():
+    def __init__(self):
+        self.pins = dict()
+
+    def newpin(self, name, kind, direction):
+        self.pins[name] = 0
+
+    def __getitem__(self, name):
+        return self.pins[name]
+
+    def __setitem__(self, name, v):
+        self.pins[name] = v
+
+# Stand in for linuxcnc.command during a replay, there is no machine to
+# run anything so every command fails
+class replay_command():
+    def mode(self, m):
+        pass
+
+    def state(self, s):
+        pass
+
+    def mdi(self, s):
+        if params["verbose"]:
+            print("replay: not sent", s)
+
+    def wait_complete(self, timeout=5.0):
+        return linuxcnc.RCS_ERROR
+
+# Plays a record log into a replay_lc in the sampler's place. Each pins
+# record is sampled at its recorded time, scaled by --replay_speed, and
+# the sample clock is the recorded one so velocities and probe touches
+# come out as they did at the machine. 0 plays as fast as it can. At the
+# end the last values stay up, done is set and finished is called.
+class replayer(threading.Thread):
+    def __init__(self, lcnc):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lcnc = lcnc
+        self.records = lcnc.replay.records()
+        self.speed = params["replay_speed"]
+        self.wake = None
+        self.finished = None
+        self.done = False
+        self.running = True
+        self.t = 0.0
+        self.t0 = None
+        lcnc.clock = self.now
+        for kind, t, fields in self.records:
+            self.apply(kind, t, fields)
+            if kind == REC_PINS:
+                break
+        self.t0 = self.t
+        self.latest = lcnc.sample(0)
+
+    def now(self):
+        return self.t
+
+    def apply(self, kind, t, fields):
+        self.t = t
+        if kind == REC_STAT:
+            self.lcnc.s.set(fields)
+            return
+        if kind == REC_ARM:
+            self.lcnc.armed = fields[0] != 0
+            return
+        h = self.lcnc.h
+        for i, pin in enumerate(self.lcnc.pin_names):
+            h[pin] = fields[i + 1]
+        if params["probe"]:
+            h["probe"] = fields[0] & 1
+
+    def run(self):
+        start = time.time()
+        for kind, t, fields in self.records:
+            if not self.running:
+                return
+            if kind == REC_PINS and self.speed > 0:
+                delay = start + (t - self.t0) / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.apply(kind, t, fields)
+            if kind != REC_PINS:
+                continue
+            snap = self.lcnc.sample(self.latest.seq + 1)
+            if snap.key != self.latest.key:
+                self.latest = snap
+                if not self.wake is None:
+                    self.wake()
+        if params["verbose"]:
+            print("replay: done, {:.1f}s played in {:.1f}s".format(self.t - self.t0,
+                                                                  time.time() - start))
+        log.event("replay_done", seconds=round(self.t - self.t0, 3))
+        self.done = True
+        if not self.finished is None:
+            self.finished()
+
+    def stop(self):
+        self.running = False
+
+# An lc that reads a record log instead of hal and linuxcnc.stat. The
+# engine and the gui can't tell the difference.
+class replay_lc(lc):
+    def __init__(self, path):
+        self.replay = replay_log(path)
+        self.s = replay_stat()
+        self.c = replay_command()
+        self.h = replay_component()
+        self.new_pins()
+        self.setup(replayer)
+
+# The network display protocol. Every frame is a type byte, a flags byte
+# and a 16 bit payload length, then the payload:
+#   NET_HELLO   server to client, json: tool, axes, field names, cs names
+#   NET_STATE   server to client, 32 bit mask of the fields that changed
+#               since the last state frame, then a double for each of them
+#   NET_RATE    client to server, uint16 most state frames per second
+#   NET_ACTION  client to server, action byte, int16 argument, double value
+#               NET_ZERO, NET_HALF and NET_SET take the axis row from 0.
+#               NET_CS takes the G5x index from 1 to 9, G54 is 1, the
+#               same number as cs_names[index - 1] in the hello
+NET_HELLO = 1
+NET_STATE = 2
+NET_RATE = 3
+NET_ACTION = 4
+NET_ZERO = 1
+NET_HALF = 2
+NET_SET = 3
+NET_CS = 4
+net_header = struct.Struct("!BBH")
+net_action = struct.Struct("!Bhd")
+net_mask = struct.Struct("!I")
+net_status = [None, "pending", "done", "failed", "timeout"]
+
+def net_frame(kind, payload):
+    return net_header.pack(kind, 0, len(payload)) + payload
+
+# Splits buf into (kind, payload) frames, returns them and what's left over
+def net_split(buf):
+    frames = []
+    while len(buf) >= net_header.size:
+        kind, flags, n = net_header.unpack_from(buf)
+        if len(buf) < net_header.size + n:
+            break
+        frames.append((kind, buf[net_header.size:net_header.size + n]))
+        buf = buf[net_header.size + n:]
+    return frames, buf
+
+# The fields that differ from last, None if nothing does. last is None
+# before the first frame so that one carries everything.
+def net_encode_state(last, values):
+    mask = 0
+    changed = []
+    for i in range(len(values)):
+        if last is None or values[i] != last[i]:
+            mask |= 1 << i
+            changed.append(values[i])
+    if mask == 0:
+        return None
+    return net_mask.pack(mask) + struct.pack("!" + "d" * len(changed), *changed)
+
+# Applies a state payload to values in place
+def net_decode_state(values, payload):
+    mask, = net_mask.unpack_from(payload)
+    n = bin(mask).count("1")
+    changed = struct.unpack_from("!" + "d" * n, payload, net_mask.size)
+    k = 0
+    for i in range(len(values)):
+        if mask & (1 << i):
+            values[i] = changed[k]
+            k += 1
+
+# One network display client and what it was last sent
+class net_peer():
+    def __init__(self, conn):
+        self.conn = conn
+        self.inbuf = b""
+        self.outbuf = b""
+        self.last = None
+        self.interval = 1.0 / params["net_rate"]
+        self.next_t = 0.0
+
+# Streams the DRO state to network displays over TCP. Each client gets
+# only the fields that changed since its last frame and no more frames a
+# second than it asked for, so a slow client just sees fewer of them. With
+# --net_actions, actions from clients are posted to the engine and go out
+# through send_mdi like the ones from the screen.
+class net_server(threading.Thread):
+    max_outbuf = 65536
+
+    def __init__(self, engine, addr):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.engine = engine
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+        self.sock.listen(5)
+        self.peers = dict()
+        self.fields = [a + " pos" for a in params["axes"]] + [
+            "g5x index", "estop", "homed", "enabled", "running", "mdi status"]
+        self.wake = None
+        self.running = True
+
+    def values(self):
+        engine = self.engine
+        estop, homed, enabled = engine.get_indicators()
+        values = [float(v) for v in engine.get_positions()]
+        values.extend([engine.get_g5x_index(), estop, homed, enabled,
+                       engine.is_running(), net_status.index(engine.get_cmd_status())])
+        return values
+
+    def run(self):
+        while self.running:
+            now = time.time()
+            timeout = 1.0 / params["net_rate"]
+            for peer in self.peers.values():
+                if peer.next_t > now:
+                    timeout = min(timeout, peer.next_t - now)
+            socks = [peer.conn for peer in self.peers.values()]
+            writers = [peer.conn for peer in self.peers.values() if len(peer.outbuf) > 0]
+            r, w, x = select.select([self.sock] + socks, writers, [], timeout)
+            for conn in r:
+                if conn is self.sock:
+                    self.accept()
+                elif conn in self.peers:
+                    self.receive(self.peers[conn])
+            for conn in w:
+                if conn in self.peers:
+                    self.flush(self.peers[conn])
+            self.stream(time.time())
+        for conn in list(self.peers):
+            self.drop(conn)
+        self.sock.close()
+
+    def accept(self):
+        conn, addr = self.sock.accept()
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = net_peer(conn)
+        self.peers[conn] = peer
+        if params["verbose"]:
+            print("net_server:", addr, "connected")
+        log.event("net_connected", addr=str(addr))
+        hello = {"tool": prog, "axes": "".join(params["axes"]),
+                 "fields": self.fields, "cs_names": g5x_names}
+        self.queue(peer, net_frame(NET_HELLO, json.dumps(hello).encode()))
+
+    def drop(self, conn):
+        if conn in self.peers:
+            del self.peers[conn]
+            conn.close()
+            if params["verbose"]:
+                print("net_server: client dropped,", len(self.peers), "left")
+            log.event("net_dropped", clients=len(self.peers))
+
+    def stream(self, now):
+        values = None
+        for peer in list(self.peers.values()):
+            if now < peer.next_t:
+                continue
+            if values is None:
+                values = self.values()
+            payload = net_encode_state(peer.last, values)
+            if payload is None:
+                continue
+            peer.last = values
+            peer.next_t = now + peer.interval
+            self.queue(peer, net_frame(NET_STATE, payload))
+
+    # A client that lets too much pile up is dropped
+    def queue(self, peer, frame):
+        peer.outbuf += frame
+        if len(peer.outbuf) > net_server.max_outbuf:
+            self.drop(peer.conn)
+            return
+        self.flush(peer)
+
+    def flush(self, peer):
+        try:
+            n = peer.conn.send(peer.outbuf)
+            peer.outbuf = peer.outbuf[n:]
+        except socket.error as e:
+            if not e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.drop(peer.conn)
+
+    def receive(self, peer):
+        try:
+            data = peer.conn.recv(4096)
+        except socket.error:
+            data = b""
+        if len(data) == 0:
+            self.drop(peer.conn)
+            return
+        frames, peer.inbuf = net_split(peer.inbuf + data)
+        for kind, payload in frames:
+            try:
+                self.handle(peer, kind, payload)
+            except (struct.error, ValueError, IndexError) as e:
+                print("net_server: bad frame", kind, e)
+
+    def handle(self, peer, kind, payload):
+        if kind == NET_RATE:
+            rate, = struct.unpack("!H", payload)
+            peer.interval = 1.0 / min(max(rate, 1), params["net_rate"])
+        elif kind == NET_ACTION:
+            action, arg, value = net_action.unpack(payload)
+            if not params["net_actions"]:
+                if params["verbose"]:
+                    print("net_server: actions are off, ignored", action, arg, value)
+                return
+            if action == NET_CS:
+                if not 1 <= arg <= len(g5x_names):
+                    raise ValueError("no g5x " + str(arg))
+                self.engine.post("set_g5x", [arg])
+            else:
+                if not 0 <= arg < params["naxes"]:
+                    raise ValueError("no axis " + str(arg))
+                if action == NET_ZERO:
+                    self.engine.post("zero", [arg])
+                elif action == NET_HALF:
+                    self.engine.post("half", [arg])
+                elif action == NET_SET:
+                    self.engine.post("set_value", [arg, value])
+            if not self.wake is None:
+                self.wake()
+
+    def stop(self):
+        self.running = False
+
+# A network display client for testing a net_server. It prints the state
+# as it changes, stdin lines like "zero 0", "half 1", "set 2 1.25" or
+# "cs 2" are sent as actions.
+class net_client():
+    def __init__(self, addr, rate):
+        self.sock = socket.create_connection(addr)
+        self.sock.sendall(net_frame(NET_RATE, struct.pack("!H", rate)))
+        self.buf = b""
+        self.hello = None
+        self.values = None
+
+    # Returns the frames that have come in, None once the server is gone
+    def read(self):
+        data = self.sock.recv(4096)
+        if len(data) == 0:
+            return None
+        frames, self.buf = net_split(self.buf + data)
+        for kind, payload in frames:
+            if kind == NET_HELLO:
+                self.hello = json.loads(payload.decode())
+                self.values = [0.0] * len(self.hello["fields"])
+            elif kind == NET_STATE:
+                net_decode_state(self.values, payload)
+        return frames
+
+    def action(self, action, arg, value=0.0):
+        self.sock.sendall(net_frame(NET_ACTION, net_action.pack(action, arg, value)))
+
+    def show(self):
+        s = []
+        for name, v in zip(self.hello["fields"], self.values):
+            s.append("{}={:g}".format(name.replace(" ", "_"), v))
+        print(" ".join(s))
+        sys.stdout.flush()
+
+    def commands(self):
+        codes = {"zero": NET_ZERO, "half": NET_HALF, "set": NET_SET, "cs": NET_CS}
+        for line in iter(sys.stdin.readline, ""):
+            fields = line.split()
+            try:
+                self.action(codes[fields[0]], int(fields[1]),
+                            float(fields[2]) if len(fields) > 2 else 0.0)
+            except (KeyError, IndexError, ValueError):
+                print("zero|half|set|cs <n> [value]")
+
+    def run(self):
+        t = threading.Thread(target=self.commands)
+        t.daemon = True
+        t.start()
+        while True:
+            frames = self.read()
+            if frames is None:
+                print("server closed")
+                return
+            if any(kind == NET_STATE for kind, payload in frames):
+                self.show()
+
+# [host:]port to an address tuple, host defaults to all interfaces
+def net_addr(s):
+    host, sep, port = s.rpartition(":")
+    return (host, int(port))
+
+# All the axis readouts drawn on one canvas, for --canvas. The font is
+# measured once so every character cell has the same width. Each row is a
+# background rectangle and one text item per cell, and an update only
+# reconfigures the cells whose character changed, with no Tcl variable
+# traces in the way.
+class readout_canvas():
+    pad = 4
+
+    def __init__(self, frame, nrows, ncells):
+        font = tkfont.Font(font=params["font1"])
+        self.cw = max([font.measure(c) for c in "0123456789.-#"])
+        self.ncells = ncells
+        self.width = ncells * self.cw + 2 * readout_canvas.pad
+        row_h = font.metrics("linespace") + 2 * readout_canvas.pad
+        self.canvas = tk.Canvas(frame, width=self.width, height=nrows * row_h,
+                                highlightthickness=0)
+        self.bg = self.canvas.cget("bg")
+        self.rects = []
+        self.cells = []
+        self.shown = []
+        for row in range(nrows):
+            y = row * row_h
+            self.rects.append(self.canvas.create_rectangle(0, y, self.width, y + row_h,
+                                                           width=0, fill=self.bg))
+            self.cells.append([self.canvas.create_text(self.cell_x(c), y + row_h // 2, text="",
+                                                       font=params["font1"])
+                               for c in range(ncells)])
+            self.shown.append([""] * ncells)
+
+    def cell_x(self, c):
+        return readout_canvas.pad + c * self.cw + self.cw // 2
+
+    # Lines each readout up with its grid row once the frame is laid out.
+    # column is the grid column the canvas spans the rows of.
+    def align(self, frame, column):
+        top = None
+        for row in range(len(self.cells)):
+            bbox = frame.grid_bbox(column, row)
+            if bbox is None:
+                return
+            x, y, w, h = bbox
+            if top is None:
+                top = y
+            y -= top
+            self.canvas.coords(self.rects[row], 0, y, self.width, y + h)
+            for c in range(self.ncells):
+                self.canvas.coords(self.cells[row][c], self.cell_x(c), y + h // 2)
+
+    # Right justifies s in the row, a value too wide for it fills the row
+    # with # rather than losing its sign or top digits. Returns True if any
+    # cell changed.
+    def set_text(self, row, s):
+        if len(s) > self.ncells:
+            s = "#" * self.ncells
+        s = s.rjust(self.ncells)
+        shown = self.shown[row]
+        cells = self.cells[row]
+        changed = False
+        for c in range(self.ncells):
+            if s[c] != shown[c]:
+                shown[c] = s[c]
+                self.canvas.itemconfigure(cells[c], text=s[c])
+                changed = True
+        return changed
+
+    # None goes back to the canvas background
+    def set_bg(self, row, color):
+        self.canvas.itemconfigure(self.rects[row], fill=color or self.bg)
 
 # One of these for each DRO row
 class axis_row_gui():
-    def __init__(self, frame, row, text, callback):
+    zone_colors = {"near": "yellow", "on": "green"}
+
+    def __init__(self, frame, row, text, callback, target_callback, readout=None):
         px = 10
         self.row = row
         self.text = text
-        self.value = tk.StringVar()
-        self.value.set(params["inch_format"].format(0.0))
+        self.readout = readout
+        self.shown_v = 0.0
+        self.shown_s = params["inch_format"].format(0.0)
+        self.pos = 0.0
+        self.shown_to_go = False
+        self.shown_zone = None
+        self.entry_state = None
         self.callback = callback
+        self.target_callback = target_callback
         self.title = tk.Label(frame, justify=tk.RIGHT, anchor=tk.E, text=text, font=params["font1"])
+        self.title_fg = self.title.cget("fg")
         self.title.grid(row=row, column=0, columnspan=1, sticky=tk.W)
-        self.vlabel = tk.Label(frame, width=10, justify=tk.RIGHT, anchor=tk.E,
-                            textvariable=self.value, font=params["font1"])
-        self.vlabel.grid(row=row, column=1, columnspan=1, sticky=tk.W)
+        if readout is None:
+            self.value = tk.StringVar()
+            self.value.set(self.shown_s)
+            self.vlabel = tk.Label(frame, width=10, justify=tk.RIGHT, anchor=tk.E,
+                                textvariable=self.value, font=params["font1"])
+            self.vlabel.grid(row=row, column=1, columnspan=1, sticky=tk.W)
+            self.value_bg = self.vlabel.cget("bg")
+        else:
+            readout.set_text(row, self.shown_s)
         self.zero = tk.Button(frame, text="Z", font=params["font2"])
         self.zero.bind("<ButtonRelease-1>", lambda event: self.zero_up(event))
         self.zero.grid(row=row, column=2, columnspan=1, padx=px, sticky=tk.W)
@@ -123,6 +2094,12 @@ class axis_row_gui():
         self.entry.bind("<Return>", lambda event: self.enter_hit())
         self.entry.bind("<ButtonPress-1>", lambda event: self.enter_clicked())
         self.entry.grid(row=row, column=4, columnspan=1, sticky=tk.W, padx=px)
+        self.vel = None
+        self.shown_vel = None
+        if params["velocity"]:
+            self.vel = tk.Label(frame, width=7, justify=tk.RIGHT, anchor=tk.E,
+                                text="", font=params["font2"])
+            self.vel.grid(row=row, column=5, columnspan=1, padx=px, sticky=tk.E)
         self.disable_entry()
 
     def enter_hit(self):
@@ -141,6 +2118,21 @@ class axis_row_gui():
             print("enter_clicked")
         self.callback(self.row, None)
 
+    # The entry becomes the target, an empty entry clears it
+    def target_hit(self):
+        if params["verbose"]:
+            print("target_hit")
+        s = self.entry.get().strip()
+        v = None
+        if s != "":
+            try:
+                v = float(s)
+            except:
+                print('\a')
+                return
+        self.target_callback(self.row, v)
+        self.entry.delete(0, tk.END)
+
     def zero_up(self, event):
         if params["verbose"]:
             print("zero_up")
@@ -149,15 +2141,59 @@ class axis_row_gui():
     def half_up(self, event):
         if params["verbose"]:
             print("half_up")
-        self.callback(self.row, float(self.value.get())/2.0)
+        self.callback(self.row, self.pos/2.0)
 
-    def set_value(self, v):
-        self.value.set(params["inch_format"].format(v))
+    # v is what's shown, pos the position when v is a distance to go
+    def set_value(self, v, pos=None):
+        # Returns True only if Tk had to be told
+        self.pos = v if pos is None else pos
+        if v == self.shown_v:
+            return False
+        self.shown_v = v
+        s = params["inch_format"].format(v)
+        if s == self.shown_s:
+            return False
+        self.shown_s = s
+        if self.readout is None:
+            self.value.set(s)
+            return True
+        return self.readout.set_text(self.row, s)
+
+    # The title turns blue while the row shows a distance to go
+    def set_to_go(self, to_go):
+        if to_go == self.shown_to_go:
+            return False
+        self.shown_to_go = to_go
+        self.title.config(fg="blue" if to_go else self.title_fg)
+        return True
+
+    # The value turns yellow near the target and green on it
+    def set_zone(self, zone):
+        if zone == self.shown_zone:
+            return False
+        self.shown_zone = zone
+        if self.readout is None:
+            self.vlabel.config(bg=self.zone_colors.get(zone, self.value_bg))
+        else:
+            self.readout.set_bg(self.row, self.zone_colors.get(zone))
+        return True
+
+    # v is in units per minute
+    def set_velocity(self, v):
+        s = params["vel_format"].format(v)
+        if s == self.shown_vel:
+            return False
+        self.shown_vel = s
+        self.vel.config(text=s)
+        return True
 
     def kp_entry(self, key):
         if key == 'E':
             self.enter_hit()
             return
+        if key == 'T':
+            self.target_hit()
+            return
         if key == 'C':
             self.entry.delete(0, tk.END)
             return
@@ -169,10 +2205,18 @@ class axis_row_gui():
         self.entry.insert(tk.END, key)
 
     def disable_entry(self):
+        if self.entry_state == tk.DISABLED:
+            return False
+        self.entry_state = tk.DISABLED
         self.entry.config(state=tk.DISABLED)
+        return True
 
     def enable_entry(self):
+        if self.entry_state == tk.NORMAL:
+            return False
+        self.entry_state = tk.NORMAL
         self.entry.config(state=tk.NORMAL)
+        return True
 
 # The keypad
 class keypad_gui():
@@ -181,7 +2225,7 @@ class keypad_gui():
         self.callback = callback
         rows = (('7','8','9'), ('4','5','6'),
                 ('1','2','3'), ('0','.','-'),
-                ('C','<','E'))
+                ('C','<','E'), ('T',))
         px = 5
         for row, values in enumerate(rows):
             for col, c in enumerate(values):
@@ -209,9 +2253,20 @@ class indicator_gui():
         self.homed.grid(row=1, column=0, padx=px, pady=py)
         self.enabled = tk.Label(frame, width=8, text="Enabled", font=params["font1"])
         self.enabled.grid(row=2, column=0, padx=px, pady=py)
+        self.mdi = tk.Label(frame, width=8, text="MDI", font=params["font1"])
+        self.mdi.grid(row=3, column=0, padx=px, pady=py)
         self.enable = tk.Button(frame, width=6, text="On/Off", font=params["font1"])
         self.enable.bind("<ButtonRelease-1>", lambda event: self.enable_up(event))
-        self.enable.grid(row=3, column=0, padx=px, pady=py)
+        self.enable.grid(row=4, column=0, padx=px, pady=py)
+        self.feed = None
+        self.shown_feed = None
+        if params["velocity"]:
+            self.feed = tk.Label(frame, width=8, text="", font=params["font2"])
+            self.feed.grid(row=5, column=0, padx=px, pady=py)
+        self.shown_colors = [None, None, None]
+        self.shown_status = None
+        self.status_colors = {None: "light gray", "pending": "yellow", "done": "green",
+                              "failed": "red", "timeout": "red"}
 
     def enable_up(self, event):
         if params["verbose"]:
@@ -229,17 +2284,167 @@ class indicator_gui():
         enabled_color = "green"
         if not enabled:
             enabled_color = "red"
-        self.estop.config(bg=estop_color)
-        self.homed.config(bg=homed_color)
-        self.enabled.config(bg=enabled_color)
+        # Returns one changed flag per indicator
+        changed = []
+        colors = (estop_color, homed_color, enabled_color)
+        labels = (self.estop, self.homed, self.enabled)
+        for i in range(len(colors)):
+            if self.shown_colors[i] == colors[i]:
+                changed.append(False)
+                continue
+            self.shown_colors[i] = colors[i]
+            labels[i].config(bg=colors[i])
+            changed.append(True)
+        return changed
+
+    # f is in units per minute
+    def set_feed(self, f):
+        s = "F " + params["vel_format"].format(f)
+        if s == self.shown_feed:
+            return False
+        self.shown_feed = s
+        self.feed.config(text=s)
+        return True
+
+    # Status of the last command sent
+    def set_cmd_status(self, status):
+        if status == self.shown_status:
+            return False
+        self.shown_status = status
+        self.mdi.config(bg=self.status_colors[status])
+        return True
+
+# Arms the probe and shows the last edge it found, with buttons that make
+# that edge or the center between two edges zero
+class probe_gui():
+    def __init__(self, frame, arm_callback, zero_callback, center_callback):
+        px = 5
+        self.arm = tk.Button(frame, width=6, text="Probe", font=params["font2"],
+                             command=arm_callback)
+        self.arm.grid(row=0, column=0, padx=px)
+        self.edge = tk.Label(frame, width=14, text="", font=params["font2"])
+        self.edge.grid(row=0, column=1, padx=px)
+        self.zero = tk.Button(frame, width=6, text="Edge 0", font=params["font2"],
+                              command=zero_callback)
+        self.zero.grid(row=0, column=2, padx=px)
+        self.center = tk.Button(frame, width=6, text="Center", font=params["font2"],
+                                command=center_callback)
+        self.center.grid(row=0, column=3, padx=px)
+        self.shown_armed = None
+        self.shown_edge = None
+
+    # edge is None or the axis and the value to show
+    def set_probe(self, armed, edge):
+        changed = False
+        if armed != self.shown_armed:
+            self.shown_armed = armed
+            self.arm.config(bg="yellow" if armed else "light gray")
+            changed = True
+        s = ""
+        if not edge is None:
+            s = params["axes"][edge[0]] + " " + params["inch_format"].format(edge[1])
+        if s != self.shown_edge:
+            self.shown_edge = s
+            self.edge.config(text=s)
+            changed = True
+        return changed
+
+# Hole pattern entry and stepping. The spec is typed in the entry, see
+# hole_pattern for the format.
+class pattern_gui():
+    def __init__(self, frame, engine):
+        px = 5
+        self.engine = engine
+        self.spec = tk.Entry(frame, width=24, font=params["font2"])
+        self.spec.bind("<Return>", lambda event: self.set_hit())
+        self.spec.grid(row=0, column=0, padx=px)
+        self.set = tk.Button(frame, width=4, text="Set", font=params["font2"],
+                             command=self.set_hit)
+        self.set.grid(row=0, column=1, padx=px)
+        self.prev = tk.Button(frame, width=2, text="<", font=params["font2"],
+                              command=lambda: engine.step_hole(-1))
+        self.prev.grid(row=0, column=2, padx=px)
+        self.hole = tk.Label(frame, width=7, text="", font=params["font2"])
+        self.hole.grid(row=0, column=3, padx=px)
+        self.next = tk.Button(frame, width=2, text=">", font=params["font2"],
+                              command=lambda: engine.step_hole(1))
+        self.next.grid(row=0, column=4, padx=px)
+        col = 5
+        if params["pattern_moves"]:
+            self.go = tk.Button(frame, width=4, text="Go", font=params["font2"],
+                                command=engine.goto_hole)
+            self.go.grid(row=0, column=col, padx=px)
+            col += 1
+        self.clear = tk.Button(frame, width=4, text="Clear", font=params["font2"],
+                               command=engine.clear_pattern)
+        self.clear.grid(row=0, column=col, padx=px)
+        self.shown_hole = None
+
+    def set_hit(self):
+        if params["verbose"]:
+            print("pattern set_hit", self.spec.get())
+        if not self.engine.set_pattern(self.spec.get()):
+            print('\a')
+
+    def set_hole(self, hole):
+        if hole == self.shown_hole:
+            return False
+        self.shown_hole = hole
+        s = ""
+        if not hole is None:
+            s = "{}/{}".format(hole[0], hole[1])
+        self.hole.config(text=s)
+        return True
+
+# Every axis in every G5x system, read off the var file. The active
+# system's row is highlighted. Nothing here changes the active system.
+class overview_gui():
+    def __init__(self, frame):
+        px = 5
+        self.cells = []
+        self.shown = []
+        self.names = []
+        self.shown_active = None
+        for col, name in enumerate(params["axes"]):
+            tk.Label(frame, text=name, font=params["font2"]).grid(row=0, column=col + 1, padx=px)
+        for row, cs in enumerate(g5x_names):
+            label = tk.Label(frame, text=cs, anchor=tk.W, font=params["font2"])
+            label.grid(row=row + 1, column=0, padx=px, sticky=tk.W)
+            self.names.append(label)
+            for col in range(params["naxes"]):
+                cell = tk.Label(frame, width=10, anchor=tk.E, text="", font=params["font2"])
+                cell.grid(row=row + 1, column=col + 1, padx=px, sticky=tk.E)
+                self.cells.append(cell)
+                self.shown.append(None)
+        self.name_bg = self.names[0].cget("bg")
+
+    # values is the flat list from dro_engine.update_overview
+    def set_values(self, values, active):
+        changed = False
+        fmt = params["inch_format"]
+        for k in range(len(values)):
+            s = fmt.format(values[k])
+            if s == self.shown[k]:
+                continue
+            self.shown[k] = s
+            self.cells[k].config(text=s)
+            changed = True
+        if active != self.shown_active:
+            if not self.shown_active is None:
+                self.names[self.shown_active - 1].config(bg=self.name_bg)
+            self.names[active - 1].config(bg="light green")
+            self.shown_active = active
+            changed = True
+        return changed
 
 # The G5x radio button5
-class coord_systems():
+class coord_systems_gui():
     def __init__(self, frame, g5x, callback):
         self.callback = callback
         self.rb_var = tk.IntVar()
         self.rb_var.set(g5x - 1)
-        self.coord_sys = ['G54', 'G55', 'G56', 'G57', 'G58', 'G59', 'G59.1', 'G59.2', 'G59.3']
+        self.shown_g5x = g5x
+        self.coord_sys = g5x_names
         for col, cs in enumerate(self.coord_sys):
             rb = tk.Radiobutton(frame, text=cs, variable=self.rb_var, value=col, width=6,
                              indicatoron=0, command=lambda: self.rb_hit(),
@@ -250,27 +2455,365 @@ class coord_systems():
         if params["verbose"]:
             print("rb_hit")
         coord_sys_name = self.coord_sys[self.rb_var.get()]
+        # The radio button moved on its own, make the next poll put it back
+        # if the switch doesn't happen
+        self.shown_g5x = None
         self.callback(coord_sys_name)
 
     def set_g5x_index(self, g5x):
-        if params["very_verbose"]:
-            print("set_g5x_index", g5x)
+        if g5x == self.shown_g5x:
+            return False
+        self.shown_g5x = g5x
         self.rb_var.set(g5x - 1)
+        return True
 
-class main_gui():
+# Everything yadro does that doesn't need a screen. Front ends read the
+# machine state through it and hand it the operator's actions.
+class dro_engine():
     def __init__(self, lcnc):
         self.lcnc = lcnc
+        self.last_seq = None
+        self.posted = deque()
+        self.captures = []
+        self.pattern = None
+        self.hole = 0
+        self.targets = [None] * params["naxes"]
+        self.display = [0.0] * params["naxes"]
+        self.zones = [None] * params["naxes"]
+        self.arrivals = 0
+        for name in ("estop", "homed", "enabled", "g5x_index"):
+            lcnc.subscribe(name, self.log_change)
+        self.vf = None
+        self.watcher = None
+        self.overview = None
+        self.overview_key = None
+        self.overview_delta = None
+        self.seen_g5x = dict()
+        if not params["var_file"] is None:
+            try:
+                self.vf = var_file(params["var_file"])
+            except (IOError, OSError) as e:
+                print(prog + ": Could not read", params["var_file"], e)
+                exit(1)
+            if params["var_poll_ms"] > 0:
+                self.watcher = var_watcher(params["var_file"], self.vf)
+                self.watcher.start()
+
+    def stop(self):
+        if not self.watcher is None:
+            self.watcher.stop()
+        self.lcnc.stop()
+
+    # Queues an action from another thread, the next poll runs it
+    def post(self, name, args):
+        self.posted.append((name, args))
+
+    # Returns True if anything changed since the last poll
+    def poll(self):
+        while len(self.posted) > 0:
+            name, args = self.posted.popleft()
+            getattr(self, name)(*args)
+        if not self.watcher is None and not self.watcher.latest is self.vf:
+            # A system the new file changed is newer there than in the cache
+            for n in list(self.seen_g5x):
+                if self.watcher.latest.get_g5x(n) != self.vf.get_g5x(n):
+                    del self.seen_g5x[n]
+            self.vf = self.watcher.latest
+            log.event("var_reload", path=params["var_file"])
+            self.redraw()
+        self.lcnc.poll()
+        # The last two captures are kept for probe_center
+        armed, capture = self.lcnc.get_probe()
+        if not capture is None and (len(self.captures) == 0 or not self.captures[-1] is capture):
+            self.captures = (self.captures + [capture])[-2:]
+        seq = (self.lcnc.get_seq(), self.lcnc.get_cmd_seq())
+        if seq == self.last_seq:
+            return False
+        self.last_seq = seq
+        self.update_targets(self.lcnc.get_pins())
+        if not self.vf is None:
+            self.update_overview(self.lcnc.get_pins())
+        return True
+
+    # Positions in all nine G5x systems, G54 first, as one flat list with
+    # naxes values per system. Each is the displayed position plus the
+    # active G5x offset less that system's offset; G92 and the tool offset
+    # are the same in all of them and cancel out. The differences only
+    # change with the var file or the active system, so they are kept and
+    # each new snapshot is a single pass over the list. The active system
+    # comes from stat so its row always matches the dro. The offsets stat
+    # showed for each system that has been active are kept and used before
+    # the file, which Linuxcnc may not have written since they changed.
+    def update_overview(self, pins):
+        active = self.lcnc.get_g5x_index()
+        g5x_offset = self.lcnc.get_g5x_offset()
+        key = (self.vf, active, g5x_offset)
+        if key != self.overview_key:
+            self.overview_key = key
+            self.seen_g5x[active] = g5x_offset
+            axes = [var_axes.index(a.upper()) for a in params["axes"]]
+            delta = array('d')
+            for n in range(1, len(g5x_names) + 1):
+                if n == active:
+                    delta.extend([0.0] * len(axes))
+                    continue
+                g5x = self.seen_g5x.get(n)
+                if g5x is None:
+                    g5x = self.vf.get_g5x(n)
+                delta.extend([g5x_offset[j] - g5x[j] for j in axes])
+            self.overview_delta = delta
+        naxes = len(pins)
+        d = self.overview_delta
+        self.overview = [pins[k % naxes] + d[k] for k in range(len(d))]
+
+    # The update_overview list and the active G5x index, None without a
+    # var file
+    def get_overview(self):
+        if self.overview is None:
+            return None
+        return self.overview, self.lcnc.get_g5x_index()
+
+    # Logs estop, homing, enable and G5x transitions
+    def log_change(self, name, value):
+        log.event(name, value=value)
+
+    # Works out the distance to go and approach zone of the axes with a
+    # target. Only runs when a new snapshot came in. The zones are None
+    # without a target, then "far", "near" and "on".
+    def update_targets(self, pins):
+        targets = self.targets
+        self.display = [p if t is None else p - t for p, t in zip(pins, targets)]
+        zones = [None] * len(pins)
+        arrived = False
+        for i in range(len(pins)):
+            if targets[i] is None:
+                continue
+            d = abs(self.display[i])
+            if d <= params["tolerance"]:
+                zones[i] = "on"
+                arrived = arrived or self.zones[i] != "on"
+            elif d <= params["approach"]:
+                zones[i] = "near"
+            else:
+                zones[i] = "far"
+        if arrived:
+            self.arrivals += 1
+        self.zones = zones
+
+    # Makes the next poll report a change
+    def redraw(self):
+        self.last_seq = None
+
+    def get_positions(self):
+        return self.lcnc.get_pins()
+
+    # What the rows show: the distance to go on axes with a target, the
+    # position on the others
+    def get_display(self):
+        return self.display
+
+    def get_targets(self):
+        return self.targets
+
+    # The approach zone of each axis and a count that goes up each time
+    # an axis reaches its target
+    def get_zones(self):
+        return self.zones, self.arrivals
+
+    # Sets the position an axis is heading for, None clears it
+    def set_target(self, row, value):
+        self.targets[row] = value
+        log.event("target", axis=row, value=value)
+        self.redraw()
+
+    # Units per minute
+    def get_velocities(self):
+        vel, feed = self.lcnc.get_velocities()
+        return [v * 60.0 for v in vel], feed * 60.0
+
+    def get_g5x_index(self):
+        return self.lcnc.get_g5x_index()
+
+    def get_indicators(self):
+        return self.lcnc.get_indicators()
+
+    def is_running(self):
+        return self.lcnc.is_running()
+
+    # The derived_state of the newest snapshot. The same object comes back
+    # until a stat field changes.
+    def get_state(self):
+        return self.lcnc.get_state()
+
+    # callback(name, value) runs from poll when a derived_state field changes
+    def subscribe(self, name, callback):
+        self.lcnc.subscribe(name, callback)
+
+    def get_cmd_status(self):
+        return self.lcnc.get_cmd_status()
+
+    # Checks the newest snapshot, for actions
+    def can_send(self):
+        self.lcnc.poll()
+        return self.lcnc.is_running()
+
+    # Positions are in machine units, G words in the program's units
+    def program_value(self, row, value):
+        if params["axes"][row].upper() in "XYZUVW":
+            return value * self.lcnc.get_program_scale()
+        return value
+
+    # The actions return the queued lc_cmd, or None if the machine wasn't ready
+    def set_value(self, row, value):
+        if not self.can_send():
+            return None
+        g5x_index = self.lcnc.get_g5x_index()
+        return self.lcnc.send_mdi("G10 L20 P{} {}{}".format(g5x_index, params["axes"][row],
+                                                            self.program_value(row, value)))
+
+    def zero(self, row):
+        return self.set_value(row, 0.0)
+
+    def half(self, row):
+        return self.set_value(row, self.get_positions()[row] / 2.0)
+
+    # g5x is 1 for G54 through 9 for G59.3
+    def set_g5x(self, g5x):
+        # Report a change on the next poll even if nothing moves, that puts
+        # the front end back if the switch doesn't happen
+        self.redraw()
+        if not self.can_send():
+            return None
+        return self.lcnc.send_mdi(g5x_names[g5x - 1])
+
+    def toggle_enable(self):
+        self.lcnc.poll()
+        estop, homed, enabled = self.lcnc.get_indicators()
+        self.lcnc.set_enable(not enabled)
+
+    # Arms the probe, the next touch is latched. Arming again disarms it.
+    def arm_probe(self):
+        armed, capture = self.lcnc.get_probe()
+        self.lcnc.arm_probe(not armed)
+        self.redraw()
+
+    # Whether the probe is armed and the axis and edge of the newest
+    # capture in the active G5x system, None if there isn't one
+    def get_probe(self):
+        armed, c = self.lcnc.get_probe()
+        if c is None or c.axis is None:
+            return armed, None
+        return armed, (c.axis, c.edge_at(c.axis, self.lcnc.get_g5x_offset()))
+
+    # Makes the edge the last capture found zero on the axis it was moving.
+    # The edge is moved into the active system first, a G10 since the touch
+    # has changed what the positions mean.
+    def probe_zero(self):
+        armed, c = self.lcnc.get_probe()
+        if c is None or c.axis is None:
+            return None
+        pos = self.get_positions()[c.axis]
+        return self.set_value(c.axis, pos - c.edge_at(c.axis, self.lcnc.get_g5x_offset()))
+
+    # Makes the point halfway between the last two edges zero. They have
+    # to be on the same axis, approached from opposite sides, and are moved
+    # into the active system first, so an Edge 0 between the touches or a
+    # switch of system doesn't mix up two sets of offsets.
+    def probe_center(self):
+        armed, b = self.lcnc.get_probe()
+        if b is None or b.axis is None or len(self.captures) < 2:
+            return None
+        a = self.captures[0]
+        if a.axis != b.axis or a.dir[a.axis] * b.dir[b.axis] >= 0.0:
+            if params["verbose"]:
+                print("probe_center: need edges on both sides of one axis")
+            return None
+        g5x_offset = self.lcnc.get_g5x_offset()
+        center = (a.edge_at(a.axis, g5x_offset) + b.edge_at(b.axis, g5x_offset)) / 2.0
+        pos = self.get_positions()[b.axis]
+        return self.set_value(b.axis, pos - center)
+
+    # Lays out a hole pattern and makes the first hole the target. Returns
+    # False if the spec doesn't parse.
+    def set_pattern(self, spec):
+        if len(pattern_axes()) < 2:
+            return False
+        try:
+            self.pattern = hole_pattern(spec)
+        except ValueError as e:
+            if params["verbose"]:
+                print("set_pattern:", e)
+            return False
+        self.hole = 0
+        log.event("pattern", spec=spec, holes=self.pattern.n)
+        self.show_hole()
+        return True
+
+    def clear_pattern(self):
+        if self.pattern is None:
+            return
+        self.pattern = None
+        self.hole = 0
+        for i in pattern_axes():
+            self.targets[i] = None
+        self.redraw()
+
+    # Steps to the next (1) or previous (-1) hole
+    def step_hole(self, step):
+        if self.pattern is None:
+            return
+        self.hole = (self.hole + step) % self.pattern.n
+        self.show_hole()
+
+    def show_hole(self):
+        x, y = self.pattern.point(self.hole)
+        ax, ay = pattern_axes()
+        self.targets[ax] = x
+        self.targets[ay] = y
+        self.redraw()
+
+    # The current hole counting from 1 and the number of holes, None if
+    # there's no pattern
+    def get_hole(self):
+        if self.pattern is None:
+            return None
+        return self.hole + 1, self.pattern.n
+
+    # Rapids to the current hole in the current G5x system
+    def goto_hole(self):
+        if self.pattern is None or not params["pattern_moves"]:
+            return None
+        if not self.can_send():
+            return None
+        x, y = self.pattern.point(self.hole)
+        ax, ay = pattern_axes()
+        return self.lcnc.send_mdi("G0 {}{:.4f} {}{:.4f}".format(params["axes"][ax],
+                                                               self.program_value(ax, x),
+                                                               params["axes"][ay],
+                                                               self.program_value(ay, y)))
+
+class main_gui():
+    def __init__(self, engine):
+        self.engine = engine
 
         px = 5
         py = 15
 
-        root.title("yadro")
+        root.title(prog)
+        self.stats = render_stats()
+        self.shown_arrivals = 0
+        self.shown_state = None
         self.dro_frame = tk.Frame(root)
         self.axis_row = dict()
         self.last_row = None
 
+        self.readout = None
+        if params["canvas"]:
+            self.readout = readout_canvas(self.dro_frame, params["naxes"], 11)
+            self.readout.canvas.grid(row=0, column=1, rowspan=params["naxes"], sticky=tk.NW)
         for row, name in enumerate(params["axes"]):
-            self.axis_row[row] = axis_row_gui(self.dro_frame, row, name, self.entry_callback)
+            self.axis_row[row] = axis_row_gui(self.dro_frame, row, name, self.entry_callback,
+                                              self.target_callback, self.readout)
         self.dro_frame.grid(row=0, column=0, columnspan = 2, padx=px, pady=py, sticky=tk.NW)
 
         self.keypad_frame = tk.Frame(root)
@@ -282,17 +2825,40 @@ class main_gui():
         self.indicator_frame.grid(row=1, column=1, padx = px, pady=py, sticky=tk.N)
 
         self.coord_frame = tk.Frame(root)
-        self.coords = coord_systems(self.coord_frame, lcnc.get_g5x_index(), self.coord_callback)
+        self.coords = coord_systems_gui(self.coord_frame, engine.get_g5x_index(), self.coord_callback)
         self.coord_frame.grid(row=2, column=0, columnspan = 2, padx=px, pady=py, sticky=tk.NW)
 
+        self.probe = None
+        if params["probe"]:
+            self.probe_frame = tk.Frame(root)
+            self.probe = probe_gui(self.probe_frame, engine.arm_probe,
+                                   engine.probe_zero, engine.probe_center)
+            self.probe_frame.grid(row=3, column=0, columnspan = 2, padx=px, pady=py, sticky=tk.NW)
+
+        self.pattern = None
+        if params["pattern"]:
+            self.pattern_frame = tk.Frame(root)
+            self.pattern = pattern_gui(self.pattern_frame, engine)
+            self.pattern_frame.grid(row=4, column=0, columnspan = 2, padx=px, pady=py, sticky=tk.NW)
+
+        self.overview = None
+        if not params["var_file"] is None:
+            self.overview_frame = tk.Frame(root)
+            self.overview = overview_gui(self.overview_frame)
+            self.overview_frame.grid(row=0, column=2, rowspan=5, padx=px, pady=py, sticky=tk.NW)
+
         root.grid_rowconfigure(1, weight=1)
         root.grid_columnconfigure(1, weight=1)
 
+        # The canvas rows follow the heights the other columns gave the grid
+        if not self.readout is None:
+            root.update_idletasks()
+            self.readout.align(self.dro_frame, 1)
+
     def entry_callback(self, row, value):
         if params["verbose"]:
             print("Entry callback", row, value)
-        self.lcnc.poll()
-        if not self.lcnc.is_running():
+        if not self.engine.can_send():
             return
         if value is None:
             # just a click
@@ -302,27 +2868,28 @@ class main_gui():
             self.last_row = row
             return
         # Enter
-        axis_name = self.axis_row[row].text
-        g5x_index = self.lcnc.get_g5x_index()
-        self.lcnc.send_mdi("G10 L20 P{} {}{}".format(g5x_index, axis_name, value))
+        self.engine.set_value(row, value)
+        if not self.last_row is None:
+            self.axis_row[self.last_row].entry.config(bg='light gray')
+        self.last_row = None
+
+    def target_callback(self, row, value):
+        if params["verbose"]:
+            print("Target callback", row, value)
+        self.engine.set_target(row, value)
         if not self.last_row is None:
             self.axis_row[self.last_row].entry.config(bg='light gray')
         self.last_row = None
-        # self.axis_row[row].set_value(value)
 
     def coord_callback(self, g5x):
         if params["verbose"]:
             print("coord_callback", g5x)
-        self.lcnc.poll()
-        if not self.lcnc.is_running():
-            return
-        self.lcnc.send_mdi(g5x)
+        self.engine.set_g5x(g5x_names.index(g5x) + 1)
 
     def keypad_callback(self, key):
         if params["verbose"]:
             print("keypad_callback", key)
-        self.lcnc.poll()
-        if not self.lcnc.is_running():
+        if not self.engine.can_send():
             return
         if self.last_row is None:
             return
@@ -331,43 +2898,133 @@ class main_gui():
     def indicator_callback(self):
         if params["verbose"]:
             print("indicator_callback")
-        self.lcnc.poll()
-        estop, homed, enabled = self.lcnc.get_indicators()
-        if enabled:
-            lcnc.set_enable(False)
-        else:
-            lcnc.set_enable(True)
+        self.engine.toggle_enable()
 
+    # Returns True if any pin or stat value moved since the last poll
     def poll(self):
-        self.lcnc.poll()
-        self.coords.set_g5x_index(self.lcnc.get_g5x_index())
-        pins = self.lcnc.get_pins()
+        engine = self.engine
+        stats = self.stats
+        if not engine.poll():
+            return False
+        stats.note(self.indicators.set_cmd_status(engine.get_cmd_status()))
+        g5x = engine.get_g5x_index()
+        stats.note(self.coords.set_g5x_index(g5x))
+        pins = engine.get_positions()
+        shown = engine.get_display()
+        targets = engine.get_targets()
+        zones, arrivals = engine.get_zones()
         for i in range(len(pins)):
-            self.axis_row[i].set_value(pins[i])
-        estop, homed, enabled = self.lcnc.get_indicators()
-        self.indicators.set_colors(estop, homed, enabled)
-        if self.lcnc.is_running():
+            stats.note(self.axis_row[i].set_value(shown[i], pins[i]))
+            stats.note(self.axis_row[i].set_to_go(not targets[i] is None))
+            stats.note(self.axis_row[i].set_zone(zones[i]))
+        if arrivals != self.shown_arrivals:
+            self.shown_arrivals = arrivals
+            if params["beep"]:
+                root.bell()
+        if params["velocity"]:
+            vel, feed = engine.get_velocities()
+            for i in range(len(vel)):
+                stats.note(self.axis_row[i].set_velocity(vel[i]))
+            stats.note(self.indicators.set_feed(feed))
+        # The indicators and entries only depend on the derived state
+        state = engine.get_state()
+        if not state is self.shown_state:
+            self.shown_state = state
+            for changed in self.indicators.set_colors(state.estop, state.homed, state.enabled):
+                stats.note(changed)
             for row in range(params["naxes"]):
-                self.axis_row[row].enable_entry()
-        else:
-            for row in range(params["naxes"]):
-                self.axis_row[row].disable_entry()
-
-def call_polls():
-    global gui
-    gui.poll()
-    root.after(100, call_polls);
+                if state.running:
+                    stats.note(self.axis_row[row].enable_entry())
+                else:
+                    stats.note(self.axis_row[row].disable_entry())
+        if not self.probe is None:
+            armed, edge = engine.get_probe()
+            stats.note(self.probe.set_probe(armed, edge))
+        if not self.pattern is None:
+            stats.note(self.pattern.set_hole(engine.get_hole()))
+        if not self.overview is None:
+            overview = engine.get_overview()
+            if not overview is None:
+                stats.note(self.overview.set_values(overview[0], overview[1]))
+        stats.poll_done()
+        return True
 
-if __name__ == '__main__':
+def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--verbose', '-v', action='count', default=0,
                     help='print debug info')
     parser.add_argument('--point_size', '-p', dest='point_size', type=int, default=20,
                     help='font point size, default: 20')
+    parser.add_argument('--fast_ms', dest='fast_ms', type=int, default=20,
+                    help='poll period while values change, default: 20')
+    parser.add_argument('--slow_ms', dest='slow_ms', type=int, default=250,
+                    help='poll period when idle, default: 250')
+    parser.add_argument('--backoff', dest='backoff', type=float, default=1.25,
+                    help='poll period growth per idle poll, default: 1.25')
+    parser.add_argument('--sample_ms', dest='sample_ms', type=int, default=10,
+                    help='stat and pin sample period, 0 samples from the gui, default: 10')
+    parser.add_argument('--mdi_timeout', dest='mdi_timeout', type=float, default=5.0,
+                    help='seconds before a stuck MDI command is reported, default: 5')
+    parser.add_argument('--velocity', action='store_true',
+                    help='show axis velocities and feed rate')
+    parser.add_argument('--vel_window', dest='vel_window', type=int, default=100,
+                    help='milliseconds of history used for velocities, default: 100')
+    parser.add_argument('--history', dest='history', type=int, default=1000,
+                    help='samples of position history kept per axis, default: 1000')
+    parser.add_argument('--headless', action='store_true',
+                    help='run without a window, only the hal pins are updated')
+    parser.add_argument('--serve', type=str,
+                    help='share the hal pins and linuxcnc status on this unix socket')
+    parser.add_argument('--attach', type=str,
+                    help='read the hal pins and linuxcnc status from a --serve socket')
+    parser.add_argument('--probe', action='store_true',
+                    help='add a yadro.probe input pin and the probe buttons')
+    parser.add_argument('--probe_radius', dest='probe_radius', type=float, default=0.0,
+                    help='probe tip radius in machine units, default: 0')
+    parser.add_argument('--probe_ms', dest='probe_ms', type=int, default=1,
+                    help='sample period while the probe is armed, default: 1')
+    parser.add_argument('--approach', type=float, default=0.1,
+                    help='distance to go shown yellow, default: 0.1')
+    parser.add_argument('--tolerance', type=float, default=0.0005,
+                    help='distance to go shown green as on target, default: 0.0005')
+    parser.add_argument('--beep', action='store_true',
+                    help='beep when an axis reaches its target')
+    parser.add_argument('--pattern', action='store_true',
+                    help='add the bolt circle, line and grid hole pattern row')
+    parser.add_argument('--pattern_moves', action='store_true',
+                    help='add a Go button that rapids to the current hole')
+    parser.add_argument('--canvas', action='store_true',
+                    help='draw the axis values on one canvas')
+    parser.add_argument('--net', type=str,
+                    help='stream the dro state to network displays on [host:]port')
+    parser.add_argument('--net_rate', dest='net_rate', type=int, default=20,
+                    help='most network updates per second per client, default: 20')
+    parser.add_argument('--net_actions', action='store_true',
+                    help='let network displays zero, halve and set axes and switch g5x')
+    parser.add_argument('--net_client', type=str,
+                    help='run a test network display for the server on host:port')
+    parser.add_argument('--var_file', type=str,
+                    help='show every axis in every g5x system, offsets from this linuxcnc var file')
+    parser.add_argument('--var_poll_ms', dest='var_poll_ms', type=int, default=1000,
+                    help='var file check period without inotify, 0 never reloads, default: 1000')
+    parser.add_argument('--log', type=str,
+                    help='append events to this file as json lines')
+    parser.add_argument('--log_size', dest='log_size', type=int, default=1000,
+                    help='events kept in memory between writes, default: 1000')
+    parser.add_argument('--metrics', type=str,
+                    help='serve event counts and poll timing as prometheus text on [host:]port')
+    parser.add_argument('--record', type=str,
+                    help='record the hal pins and linuxcnc status to this file')
+    parser.add_argument('--record_size', dest='record_size', type=int, default=10240,
+                    help='kilobytes per record file before it is rotated, default: 10240')
+    parser.add_argument('--replay', type=str,
+                    help='play a --record file instead of reading hal and linuxcnc')
+    parser.add_argument('--replay_speed', dest='replay_speed', type=float, default=1.0,
+                    help='replay speed, 0 is as fast as possible, default: 1.0')
     parser.add_argument("axes", type=str, help="Axes (example: XYZ)")
+    return parser
 
-    args = parser.parse_args()
-
+def get_params(args):
     axes = list(args.axes)
 
     params = {}
@@ -382,9 +3039,126 @@ if __name__ == '__main__':
     params["font1"] = ("Helvetica", args.point_size)
     params["font2"] = ("Helvetica", int(args.point_size / 2))
     params["inch_format"] = "{:.4f}"
+    params["fast_ms"] = args.fast_ms
+    params["slow_ms"] = max(args.slow_ms, args.fast_ms)
+    params["backoff"] = max(args.backoff, 1.0)
+    params["sample_ms"] = max(args.sample_ms, 0)
+    params["mdi_timeout"] = args.mdi_timeout
+    params["velocity"] = args.velocity
+    params["history"] = max(args.history, 2)
+    params["vel_window"] = max(args.vel_window, 1) / 1000.0
+    params["vel_format"] = "{:.1f}"
+    params["headless"] = args.headless
+    params["serve"] = args.serve
+    params["attach"] = args.attach
+    if not args.serve is None and not args.attach is None:
+        print("Use --serve or --attach, not both")
+        exit(1)
+    params["probe"] = args.probe
+    params["probe_radius"] = args.probe_radius
+    params["probe_ms"] = max(args.probe_ms, 0)
+    # Only the serving yadro samples the probe pin
+    if params["probe"] and not args.attach is None:
+        print("Use --probe on the --serve side, not with --attach")
+        exit(1)
+    params["approach"] = abs(args.approach)
+    params["tolerance"] = abs(args.tolerance)
+    params["beep"] = args.beep
+    params["pattern"] = args.pattern or args.pattern_moves
+    params["pattern_moves"] = args.pattern_moves
+    params["canvas"] = args.canvas
+    params["net"] = args.net
+    params["net_rate"] = max(args.net_rate, 1)
+    params["net_actions"] = args.net_actions
+    params["var_file"] = args.var_file
+    params["var_poll_ms"] = max(args.var_poll_ms, 0)
+    params["log"] = args.log
+    params["log_size"] = max(args.log_size, 1)
+    params["metrics"] = args.metrics
+    params["record"] = args.record
+    params["record_size"] = max(args.record_size, 1)
+    params["replay"] = args.replay
+    params["replay_speed"] = max(args.replay_speed, 0.0)
+    if not args.replay is None and not args.attach is None:
+        print("Use --replay or --attach, not both")
+        exit(1)
 
-    lcnc = lc()
-    gui = main_gui(lcnc)
+    return params
 
-    root.after(20, call_polls);
-    root.mainloop()
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    params = get_params(args)
+
+    if not args.net_client is None:
+        net_client(net_addr(args.net_client), params["net_rate"]).run()
+        exit(0)
+
+    log = event_log(prog, params["log_size"])
+    log.timing = not params["log"] is None or not params["metrics"] is None
+    if not params["log"] is None:
+        log.open(params["log"])
+    metrics = None
+    if not params["metrics"] is None:
+        host, port = net_addr(params["metrics"])
+        metrics = metrics_server((host or "127.0.0.1", port))
+        metrics.start()
+    log.event("start", axes="".join(params["axes"]))
+
+    if not params["attach"] is None:
+        lcnc = remote_lc(params["attach"])
+    elif not params["replay"] is None:
+        lcnc = replay_lc(params["replay"])
+    else:
+        lcnc = lc()
+    server = None
+    if not params["serve"] is None:
+        server = snap_server(lcnc, params["serve"])
+        server.start()
+    engine = dro_engine(lcnc)
+    net = None
+    if not params["net"] is None:
+        net = net_server(engine, net_addr(params["net"]))
+        net.start()
+
+    if params["headless"]:
+        sched = poll_scheduler(engine.poll)
+    else:
+        if tk is None:
+            print("No Tk, use --headless")
+            exit(1)
+        root = tk.Tk()
+        gui = main_gui(engine)
+        sched = poll_scheduler(gui.poll)
+    if not lcnc.sampler is None:
+        lcnc.sampler.wake = sched.wake
+    # A headless replay exits at the end of the log, an attached window
+    # when the server comes back with other axes
+    if not params["attach"] is None or (params["headless"] and not params["replay"] is None):
+        lcnc.sampler.finished = sched.finish
+        if lcnc.sampler.done:
+            sched.finish()
+    lcnc.cmds.wake = sched.wake
+    if not engine.watcher is None:
+        engine.watcher.wake = sched.wake
+    if not net is None:
+        net.wake = sched.wake
+    if params["headless"]:
+        sched.run_headless()
+    else:
+        sched.start()
+        root.mainloop()
+    if not server is None:
+        server.stop()
+        server.join()
+    if not net is None:
+        net.stop()
+    engine.stop()
+    if not metrics is None:
+        metrics.stop()
+    log.event("stop")
+    log.stop()
+    if params["verbose"] and not params["headless"]:
+        gui.stats.report()
+    # It gave up on a server that came back with other axes
+    if not params["attach"] is None and lcnc.sampler.done:
+        exit(1)